@@ -1,6 +1,6 @@
 from .component import FeatureLayerComponent
 from .extension import FeatureExtension
-from .feature import Feature, FeatureSet
+from .feature import Feature, FeatureBatch, FeatureSet, feature_batches
 from .interface import (
     FIELD_TYPE,
     FIELD_TYPE_OGR,
@@ -10,19 +10,34 @@ from .interface import (
     GEOM_TYPE_OGR_2_GEOM_TYPE,
     IFeatureLayer,
     IFeatureQuery,
+    IFeatureQueryBatch,
     IFeatureQueryClipByBox,
     IFeatureQueryFilter,
     IFeatureQueryFilterBy,
+    IFeatureQueryFilterExpr,
+    IFeatureQueryGeoJSON,
     IFeatureQueryIlike,
     IFeatureQueryIntersects,
+    IFeatureQueryKeyset,
     IFeatureQueryLike,
+    IFeatureQueryMVT,
     IFeatureQueryOrderBy,
     IFeatureQuerySimplify,
+    IFeatureQueryStream,
     IFieldEditableFeatureLayer,
     IGeometryEditableFeatureLayer,
     IVersionableFeatureLayer,
     IWritableFeatureLayer,
 )
-from .model import FIELD_FORBIDDEN_NAME, FeatureQueryIntersectsMixin, LayerField, LayerFieldsMixin
+from .model import (
+    FIELD_FORBIDDEN_NAME,
+    FeatureQueryIntersectsMixin,
+    LayerField,
+    LayerFieldsMixin,
+    filter_expr_condition,
+    keyset_condition,
+    mvt_query,
+)
+from .mvt_cache import mvt_cache_invalidation
 from .transaction import FeatureLayerTransaction
 from .versioning import FVersioningMeta, FVersioningObj
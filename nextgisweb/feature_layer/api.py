@@ -1,16 +1,20 @@
 import re
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 from contextlib import contextmanager
 from dataclasses import dataclass
 from functools import cached_property, partial
 from typing import Any, List, Literal, Optional
 
-from msgspec import UNSET, Meta, Struct
+import transaction
+from msgspec import UNSET, Meta, Struct, structs
+from pyramid.response import Response
 from sqlalchemy.orm.exc import NoResultFound
 from typing_extensions import Annotated
 
 from nextgisweb.env import gettext
 from nextgisweb.lib.apitype import Query
 from nextgisweb.lib.geometry import Geometry, GeometryNotValid, Transformer, geom_area, geom_length
+from nextgisweb.lib.json import Fragment, dumpb, loadb
 
 from nextgisweb.core.exception import ValidationError
 from nextgisweb.pyramid import JSONType
@@ -20,11 +24,14 @@ from nextgisweb.spatial_ref_sys import SRS
 from .dtutil import DT_DATATYPES, DT_DUMPERS, DT_LOADERS
 from .exception import FeatureNotFound
 from .extension import FeatureExtension
-from .feature import Feature
+from .feature import Feature, FeatureBatch, feature_batches
 from .interface import (
     IFeatureLayer,
+    IFeatureQueryGeoJSON,
     IFeatureQueryIlike,
+    IFeatureQueryKeyset,
     IFeatureQueryLike,
+    IFeatureQueryStream,
     IVersionableFeatureLayer,
     IWritableFeatureLayer,
 )
@@ -35,6 +42,9 @@ FeatureID = Annotated[int, Meta(description="Feature ID")]
 ParamGeomFormat = Literal["wkt", "geojson"]
 ParamDtFormat = Literal["iso", "obj"]
 ParamSrs = Optional[Annotated[int, Meta(gt=0)]]
+ParamStream = Literal["geojson", "ndjson"]
+
+STREAM_CONTENT_TYPE = dict(geojson="application/geo+json", ndjson="application/x-ndjson")
 
 
 class LoaderParams(Struct, kw_only=True):
@@ -117,6 +127,7 @@ class DumperParams(Struct, kw_only=True):
     label: bool = False
     geom: bool = True
     geom_format: ParamGeomFormat = "wkt"
+    geom_precision: Optional[Annotated[int, Meta(ge=0, le=15)]] = None
     dt_format: ParamDtFormat = "obj"
     fields: Optional[List[str]] = None
     extensions: Optional[List[str]] = None
@@ -183,6 +194,10 @@ class Dumper:
             query.geom()
             if self.params.geom_format == "wkt":
                 query.geom_format("WKT")
+            elif self.params.geom_format == "geojson" and IFeatureQueryGeoJSON.providedBy(query):
+                query.geom_format("GeoJSON")
+                if self.params.geom_precision is not None:
+                    query.geom_precision(self.params.geom_precision)
             if self.params.srs:
                 query.srs(SRS.filter_by(id=self.params.srs).one())
 
@@ -213,6 +228,52 @@ class Dumper:
 
         return result
 
+    def dump_batch(self, batch: FeatureBatch) -> List[Any]:
+        """Dump a columnar batch of features the same way as features are
+        dumped one by one, but without instantiating them when possible"""
+
+        result = [dict(id=fid) for fid in batch.fid]
+
+        for item, vid in zip(result, batch.vid):
+            if vid is not None:
+                item["vid"] = vid
+
+        if self.params.label:
+            for idx, item in enumerate(result):
+                item["label"] = batch.feature(idx).label
+
+        if self.params.geom:
+            if batch.geom is UNSET:
+                geoms = (None,) * len(batch)
+            elif self.params.geom_format == "wkt" and batch.geom_format == "WKT":
+                # Already serialized by the feature query
+                geoms = batch.geom
+            elif self.params.geom_format == "geojson" and batch.geom_format == "GeoJSON":
+                # Spliced into the output without decoding
+                geoms = [Fragment(g) if g is not None else None for g in batch.geom]
+            else:
+                geom_dumper = self.geom_dumper
+                geoms = [
+                    geom_dumper(batch.geometry(idx)) if g is not None else None
+                    for idx, g in enumerate(batch.geom)
+                ]
+            for item, geom in zip(result, geoms):
+                item["geom"] = geom
+
+        if (fdumpers := self.field_dumpers) is not None:
+            for item in result:
+                item["fields"] = dict()
+            for fkey, fdump in fdumpers.items():
+                for item, fval in zip(result, batch.fields[fkey]):
+                    item["fields"][fkey] = fdump(fval) if fval is not None else None
+
+        if (edumpers := self.extension_dumpers) is not None:
+            for idx, item in enumerate(result):
+                feature = batch.feature(idx)
+                item["extensions"] = {ident: ext(feature) for ident, ext in edumpers.items()}
+
+        return result
+
 
 def query_feature_or_not_found(query, resource_id, feature_id):
     """Query one feature by id or return FeatureNotFound exception."""
@@ -414,19 +475,20 @@ def cget(
     order_by: Optional[str] = None,
     limit: Optional[Annotated[int, Meta(ge=0)]] = None,
     offset: Annotated[int, Meta(ge=0)] = 0,
+    stream: Optional[ParamStream] = None,
+    cursor: Optional[str] = None,
 ) -> JSONType:
-    """Read features"""
-    request.resource_permission(DataScope.read)
-
-    dumper = Dumper(resource, dumper_params)
-    query = dumper.feature_query()
+    """Read features
 
-    # Paging
-    if limit is not None:
-        query.limit(limit, offset)
+    Pages of features can be requested either by offset or by an opaque
+    cursor, which is returned in the Link header of a full page and doesn't
+    slow down deep paging. In streaming mode features are written to the
+    response as they are fetched, either as GeoJSON FeatureCollection or as
+    newline-delimited JSON with a feature per line."""
+    request.resource_permission(DataScope.read)
 
-    apply_fields_filter(query, request)
-    apply_intersect_filter(query, request, resource)
+    if stream == "geojson":
+        dumper_params = structs.replace(dumper_params, geom_format="geojson")
 
     # Ordering
     order_by_ = []
@@ -437,10 +499,121 @@ def cget(
                 order = ["asc", "desc"][order == "-"]
                 order_by_.append([order, colname])
 
-    if order_by_:
-        query.order_by(*order_by_)
+    key = None
+    if cursor is not None:
+        if offset != 0:
+            raise ValidationError(gettext("Parameters 'cursor' and 'offset' are exclusive."))
+        key = decode_cursor(cursor, len(order_by_) + 1)
+
+    def feature_query(resource):
+        dumper = Dumper(resource, dumper_params)
+        query = dumper.feature_query()
+
+        # Paging
+        if limit is not None:
+            query.limit(limit, offset)
+
+        apply_fields_filter(query, request)
+        apply_intersect_filter(query, request, resource)
+
+        if order_by_:
+            query.order_by(*order_by_)
+
+        if IFeatureQueryKeyset.providedBy(query):
+            # Values of ordering fields are required for a cursor
+            query.fields(*dumper.field_dumpers.keys(), *(k for _, k in order_by_))
+            if key is not None:
+                query.keyset(key)
+        elif key is not None:
+            raise ValidationError(gettext("Cursor paging isn't supported by the layer."))
+
+        return dumper, query
+
+    if stream is None:
+        dumper, query = feature_query(resource)
+        result = []
+        batch_size = request.env.feature_layer.options["stream.batch_size"]
+        for batch in feature_batches(query, batch_size):
+            result.extend(dumper.dump_batch(batch))
+
+        if limit and len(result) == limit and IFeatureQueryKeyset.providedBy(query):
+            last = batch.feature(len(batch) - 1)
+            next_cursor = feature_cursor(last, [k for _, k in order_by_])
+            next_query = {k: v for k, v in request.GET.items() if k not in ("offset", "cursor")}
+            next_url = request.route_url(
+                "feature_layer.feature.collection",
+                id=resource.id,
+                _query=dict(next_query, cursor=next_cursor),
+            )
+            request.response.headers["Link"] = f'<{next_url}>; rel="next"'
+
+        return result
+
+    # Validate parameters while it's still possible to respond with an error
+    feature_query(resource)
+
+    return Response(
+        app_iter=stream_features(
+            resource.id,
+            feature_query,
+            stream,
+            request.env.feature_layer.options["stream.batch_size"],
+        ),
+        content_type=STREAM_CONTENT_TYPE[stream],
+        charset="utf-8",
+    )
+
+
+def feature_cursor(feature, order_fields):
+    """Encode cursor pointing after the feature in the given field order"""
+    key = [feature.fields[k] for k in order_fields]
+    key.append(feature.id)
+    return urlsafe_b64encode(dumpb(key)).rstrip(b"=").decode("ascii")
+
+
+def decode_cursor(value, size):
+    try:
+        key = loadb(urlsafe_b64decode(value + "=" * (-len(value) % 4)))
+    except ValueError:
+        key = None
+    if not isinstance(key, list) or len(key) != size or not isinstance(key[-1], int):
+        raise ValidationError(gettext("Invalid cursor."))
+    return key
+
+
+def stream_features(resource_id, feature_query, fmt, batch_size):
+    # The request transaction is already committed when the response body is
+    # being iterated, so features are read within a separate transaction.
+    with transaction.manager:
+        resource = Resource.filter_by(id=resource_id).one()
+        dumper, query = feature_query(resource)
+        if IFeatureQueryStream.providedBy(query):
+            query.stream(batch_size)
+
+        if fmt == "geojson":
+            head, tail, separator = b'{"type":"FeatureCollection","features":[', b"]}", b","
+            encode = _geojson_feature
+        else:
+            head, tail, separator = b"", b"", b""
+            encode = lambda data: dumpb(data) + b"\n"
+
+        if head:
+            yield head
+
+        leading = b""
+        for batch in feature_batches(query, batch_size):
+            yield leading + separator.join(encode(item) for item in dumper.dump_batch(batch))
+            leading = separator
+
+        if tail:
+            yield tail
+
 
-    return [dumper(feature) for feature in query()]
+def _geojson_feature(data):
+    result = dict(type="Feature", id=data.pop("id"), geometry=data.pop("geom", None))
+    result["properties"] = data.pop("fields", {})
+    result.update(data)
+    return dumpb(result)
 
 
 def cpost(
@@ -1,20 +1,33 @@
 import os
 import tempfile
-import zipfile
 
-from osgeo import gdal
-from pyramid.response import FileResponse
+import zipstream
+from msgspec import UNSET
+from osgeo import gdal, ogr
+from pyramid.response import FileResponse, Response
 from sqlalchemy.orm.exc import NoResultFound
 
 from nextgisweb.env import env, gettext, gettextf
 from nextgisweb.lib.geometry import Geometry, GeometryNotValid, Transformer
 
 from nextgisweb.core.exception import ValidationError
-from nextgisweb.resource import DataScope, Resource, ResourceFactory
+from nextgisweb.resource import (
+    DataScope,
+    ExportJobKind,
+    ExportJobResult,
+    Resource,
+    ResourceFactory,
+)
 from nextgisweb.resource.exception import ResourceNotFound
 from nextgisweb.spatial_ref_sys import SRS
 
-from .interface import IFeatureLayer, IFeatureQueryIlike
+from .feature import feature_batches
+from .interface import (
+    GEOM_TYPE_2_WKB_TYPE,
+    IFeatureLayer,
+    IFeatureQueryIlike,
+    IVersionableFeatureLayer,
+)
 from .ogrdriver import EXPORT_FORMAT_OGR
 
 
@@ -24,13 +37,16 @@ def _ogr_memory_ds():
 
 def _ogr_layer_from_features(
     layer,
-    features,
+    query,
     *,
     ds,
     name="",
     fields=None,
     use_display_name=False,
     fid=None,
+    preserve_fid=True,
+    progress=None,
+    **layer_kw,
 ):
     layer_fields = (
         layer.fields
@@ -41,18 +57,55 @@ def _ogr_layer_from_features(
         )
     )
     ogr_layer = layer.to_ogr(
-        ds, name=name, fields=layer_fields, use_display_name=use_display_name, fid=fid
+        ds, name=name, fields=layer_fields, use_display_name=use_display_name, fid=fid, **layer_kw
     )
     layer_defn = ogr_layer.GetLayerDefn()
 
-    f_kw = dict()
-    if fid is not None:
-        f_kw["fid"] = fid
-    if use_display_name:
-        f_kw["aliases"] = {field.keyname: field.display_name for field in layer_fields}
+    # Fields are set by index as drivers may launder their names
+    field_index = {field.keyname: idx for idx, field in enumerate(layer_fields)}
+    fid_index = len(layer_fields) if fid is not None else None
+    transactions = ogr_layer.TestCapability(ogr.OLCTransactions)
+
+    # Features are fetched by columnar batches and written to OGR directly,
+    # without intermediate Feature and Geometry objects.
+    batch_size = env.feature_layer.options["stream.batch_size"]
+    written = 0
+    for batch in feature_batches(query, batch_size):
+        geoms = batch.geom
+        if geoms is not UNSET:
+            if batch.geom_format == "WKB":
+                geom_loader = ogr.CreateGeometryFromWkb
+            else:
+                geom_loader = ogr.CreateGeometryFromWkt
+
+        columns = [
+            (field_index[k], column) for k, column in batch.fields.items() if k in field_index
+        ]
+
+        if transactions:
+            ogr_layer.StartTransaction()
+
+        for idx, feature_id in enumerate(batch.fid):
+            ogr_feature = ogr.Feature(layer_defn)
+            if preserve_fid:
+                ogr_feature.SetFID(feature_id)
+            if geoms is not UNSET and (geom := geoms[idx]) is not None:
+                ogr_feature.SetGeometry(geom_loader(geom))
+
+            for k, column in columns:
+                ogr_feature[k] = column[idx]
+
+            if fid_index is not None:
+                ogr_feature[fid_index] = feature_id
+
+            ogr_layer.CreateFeature(ogr_feature)
+
+        if transactions:
+            ogr_layer.CommitTransaction()
 
-    for f in features:
-        ogr_layer.CreateFeature(f.to_ogr(layer_defn, **f_kw))
+        if progress is not None:
+            written += len(batch)
+            progress(written)
 
     return ogr_layer
 
@@ -137,12 +190,15 @@ class ExportOptions:
         self.use_display_name = display_name.lower() == "true"
 
 
-def export(resource, options, filepath):
+def export(resource, options, filepath, progress=None):
     query = resource.feature_query()
 
-    if (export_limit := env.feature_layer.export_limit) is not None:
+    export_limit = env.feature_layer.export_limit
+    total_count = None
+    if export_limit is not None or progress is not None:
         total_count = query().total_count
 
+    if export_limit is not None:
         if total_count > export_limit:
             raise ValidationError(
                 message=gettextf(
@@ -171,18 +227,45 @@ def export(resource, options, filepath):
     if options.fields is not None:
         query.fields(*options.fields)
 
-    ogr_ds = _ogr_memory_ds()
-    _ogr_layer = _ogr_layer_from_features(
-        resource,
-        query(),
-        ds=ogr_ds,
+    driver = options.driver
+    srs = options.srs if options.srs is not None else resource.srs
+
+    layer_kw = dict(
         fields=options.fields,
         use_display_name=options.use_display_name,
         fid=options.fid_field,
     )
+    if progress is not None and total_count > 0:
+        layer_kw["progress"] = lambda written: progress(written / total_count)
+
+    ogr_driver = gdal.GetDriverByName(driver.name)
+    if driver.direct_write and ogr_driver.GetMetadataItem(gdal.DCAP_CREATE) == "YES":
+        # Write features from the query cursor straight into the target
+        # dataset, reprojecting them by the feature query
+        query.srs(srs)
+
+        ogr_ds = ogr_driver.Create(filepath, 0, 0, 0, gdal.GDT_Unknown, options=options.dsco)
+        if ogr_ds is None:
+            raise RuntimeError(gdal.GetLastErrorMsg())
+
+        _ogr_layer_from_features(
+            resource,
+            query,
+            ds=ogr_ds,
+            name=resource.display_name,
+            srs=srs,
+            geom_type=GEOM_TYPE_2_WKB_TYPE[resource.geometry_type],
+            options=options.lco,
+            preserve_fid=driver.fid_support and options.fid_field is None,
+            **layer_kw,
+        )
 
-    driver = options.driver
-    srs = options.srs if options.srs is not None else resource.srs
+        # Flush and close the dataset
+        ogr_ds = None
+        return
+
+    ogr_ds = _ogr_memory_ds()
+    _ogr_layer_from_features(resource, query, ds=ogr_ds, **layer_kw)
 
     vtopts = dict(
         options=[],
@@ -205,16 +288,55 @@ def export(resource, options, filepath):
         raise RuntimeError(gdal.GetLastErrorMsg())
 
 
-def _zip_response(request, directory, filename):
-    with tempfile.NamedTemporaryFile(suffix=".zip") as tmp_file:
-        with zipfile.ZipFile(tmp_file, "w", zipfile.ZIP_DEFLATED) as zipf:
-            for root, dirs, files in os.walk(directory):
-                for file in files:
-                    path = os.path.join(root, file)
-                    zipf.write(path, os.path.relpath(path, directory))
-        response = FileResponse(tmp_file.name, content_type="application/zip", request=request)
-        response.content_disposition = f"attachment; filename={filename}.zip"
-        return response
+def _read_chunks(path, size=1 << 20):
+    with open(path, "rb") as fd:
+        while chunk := fd.read(size):
+            yield chunk
+
+
+def _zip_stream(directory):
+    zip_stream = zipstream.ZipFile(mode="w", compression=zipstream.ZIP_DEFLATED, allowZip64=True)
+    for root, dirs, files in os.walk(directory):
+        for file in files:
+            path = os.path.join(root, file)
+            zip_stream.write_iter(os.path.relpath(path, directory), _read_chunks(path))
+    return zip_stream
+
+
+def _zip_file(directory, filepath):
+    with open(filepath, "wb") as fd:
+        for chunk in _zip_stream(directory):
+            fd.write(chunk)
+
+
+class _ZipAppIter:
+    """Archive of a temporary directory compressed on the fly while it is
+    being sent, the directory is removed when the response is closed"""
+
+    def __init__(self, tmp_dir):
+        self._tmp_dir = tmp_dir
+        self._iter = iter(_zip_stream(tmp_dir.name))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._iter)
+
+    def close(self):
+        try:
+            self._iter.close()
+        finally:
+            self._tmp_dir.cleanup()
+
+
+def _zip_response(request, tmp_dir, filename):
+    return Response(
+        app_iter=_ZipAppIter(tmp_dir),
+        content_type="application/zip",
+        content_disposition=f"attachment; filename={filename}.zip",
+        request=request,
+    )
 
 
 def export_single(resource, request):
@@ -226,23 +348,29 @@ def export_single(resource, request):
             params[p] = int(params[p])
     options = ExportOptions(**params)
 
-    with tempfile.TemporaryDirectory() as tmp_dir:
+    # The directory is owned by a zipped response, which removes it
+    tmp_dir = tempfile.TemporaryDirectory()
+    try:
         filename = f"{resource.id}.{options.driver.extension}"
-        filepath = os.path.join(tmp_dir, filename)
+        filepath = os.path.join(tmp_dir.name, filename)
 
         export(resource, options, filepath)
 
         zipped = request.GET.get("zipped", "true").lower() == "true"
         if not options.driver.single_file or zipped:
             return _zip_response(request, tmp_dir, filename)
-        else:
-            response = FileResponse(
-                filepath,
-                content_type=options.driver.mime or "application/octet-stream",
-                request=request,
-            )
-            response.content_disposition = f"attachment; filename={filename}"
-            return response
+    except BaseException:
+        tmp_dir.cleanup()
+        raise
+
+    with tmp_dir:
+        response = FileResponse(
+            filepath,
+            content_type=options.driver.mime or "application/octet-stream",
+            request=request,
+        )
+        response.content_disposition = f"attachment; filename={filename}"
+        return response
 
 
 def view_geojson(resource, request):
@@ -269,6 +397,46 @@ def view_geojson_head(resource, request):
     return view_geojson(resource, request)
 
 
+def _multi_resources(params_resources, request):
+    result = list()
+    for param in params_resources:
+        try:
+            resource = Resource.filter_by(id=param["id"]).one()
+        except NoResultFound:
+            raise ResourceNotFound(param["id"])
+        request.resource_permission(DataScope.read, resource)
+
+        if "name" in param:
+            name = param["name"]
+            if name != os.path.basename(name):
+                raise ValidationError(
+                    message=gettext("File name parameter '{}' is not valid.") % name
+                )
+        else:
+            name = str(resource.id)
+
+        result.append((resource, name))
+    return result
+
+
+def _export_multi(items, options, directory, progress=None):
+    for idx, (resource, name) in enumerate(items):
+        if not options.driver.single_file:
+            layer_dir = os.path.join(directory, name)
+            os.mkdir(layer_dir)
+        else:
+            layer_dir = directory
+        filepath = os.path.join(layer_dir, f"{name}.{options.driver.extension}")
+
+        layer_progress = None
+        if progress is not None:
+
+            def layer_progress(value, idx=idx):
+                progress((idx + value) / len(items))
+
+        export(resource, options, filepath, layer_progress)
+
+
 def export_multi(request):
     if request.method == "GET":
         params = dict(request.GET)
@@ -290,33 +458,106 @@ def export_multi(request):
         params_resources = params.pop("resources")
     options = ExportOptions(**params)
 
-    with tempfile.TemporaryDirectory() as tmp_dir:
-        for param in params_resources:
-            try:
-                resource = Resource.filter_by(id=param["id"]).one()
-            except NoResultFound:
-                raise ResourceNotFound(param["id"])
-            request.resource_permission(DataScope.read, resource)
-
-            if "name" in param:
-                name = param["name"]
-                if name != os.path.basename(name):
-                    raise ValidationError(
-                        message=gettext("File name parameter '{}' is not valid.") % name
-                    )
-            else:
-                name = str(resource.id)
+    tmp_dir = tempfile.TemporaryDirectory()
+    try:
+        items = _multi_resources(params_resources, request)
+        _export_multi(items, options, tmp_dir.name)
+    except BaseException:
+        tmp_dir.cleanup()
+        raise
+
+    return _zip_response(request, tmp_dir, "layers")
+
+
+class FeatureLayerExportJob(ExportJobKind):
+    """Export of a feature layer, which takes the resource ID in the
+    'resource' parameter and the same parameters as the export API"""
+
+    identity = "feature_layer.export"
+
+    @classmethod
+    def prepare(cls, params, *, request):
+        params = dict(params)
+        if (resource_id := params.pop("resource", None)) is None:
+            raise ValidationError(message=gettext("Resource is not provided."))
+        try:
+            resource = Resource.filter_by(id=resource_id).one()
+        except NoResultFound:
+            raise ResourceNotFound(resource_id)
+        if not IFeatureLayer.providedBy(resource):
+            raise ValidationError(message=gettext("Resource is not a feature layer."))
+        request.resource_permission(DataScope.read, resource)
+
+        params.pop("zipped", None)
+        ExportOptions(**params)
+        return [resource]
+
+    @classmethod
+    def dedupe(cls, resource):
+        # Changes of layers without versioning support might be made outside
+        # of the Web GIS, e.g. in PostGIS.
+        return IVersionableFeatureLayer.providedBy(resource)
+
+    @classmethod
+    def run(cls, params, *, workdir, progress):
+        params = dict(params)
+        resource = Resource.filter_by(id=params.pop("resource")).one()
+        zipped = params.pop("zipped", True)
+        options = ExportOptions(**params)
+
+        data_dir = os.path.join(workdir, "data")
+        os.mkdir(data_dir)
 
-            if not options.driver.single_file:
-                layer_dir = os.path.join(tmp_dir, name)
-                os.mkdir(layer_dir)
-            else:
-                layer_dir = tmp_dir
-            filepath = os.path.join(layer_dir, f"{name}.{options.driver.extension}")
-
-            export(resource, options, filepath)
+        filename = f"{resource.id}.{options.driver.extension}"
+        filepath = os.path.join(data_dir, filename)
+        export(resource, options, filepath, progress)
 
-        return _zip_response(request, tmp_dir, "layers")
+        if not options.driver.single_file or zipped:
+            filepath = os.path.join(workdir, f"{filename}.zip")
+            _zip_file(data_dir, filepath)
+            return ExportJobResult(filepath, f"{filename}.zip", "application/zip")
+
+        content_type = options.driver.mime or "application/octet-stream"
+        return ExportJobResult(filepath, filename, content_type)
+
+
+class FeatureLayerExportMultiJob(ExportJobKind):
+    """Export of multiple feature layers into a ZIP archive, which takes the
+    same parameters as the multiple layers export API"""
+
+    identity = "feature_layer.export_multi"
+
+    @classmethod
+    def prepare(cls, params, *, request):
+        params = dict(params)
+        try:
+            params_resources = params.pop("resources")
+        except KeyError:
+            raise ValidationError(message=gettext("Resources are not provided."))
+
+        ExportOptions(**params)
+        return [resource for resource, name in _multi_resources(params_resources, request)]
+
+    @classmethod
+    def dedupe(cls, resource):
+        return IVersionableFeatureLayer.providedBy(resource)
+
+    @classmethod
+    def run(cls, params, *, workdir, progress):
+        params = dict(params)
+        items = [
+            (Resource.filter_by(id=param["id"]).one(), param.get("name", str(param["id"])))
+            for param in params.pop("resources")
+        ]
+        options = ExportOptions(**params)
+
+        data_dir = os.path.join(workdir, "data")
+        os.mkdir(data_dir)
+        _export_multi(items, options, data_dir, progress)
+
+        filepath = os.path.join(workdir, "layers.zip")
+        _zip_file(data_dir, filepath)
+        return ExportJobResult(filepath, "layers.zip", "application/zip")
 
 
 def setup_pyramid(comp, config):
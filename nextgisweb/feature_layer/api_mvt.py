@@ -9,6 +9,7 @@ from pyramid.response import Response
 from shapely.geometry import box
 from sqlalchemy.orm.exc import NoResultFound
 from typing_extensions import Annotated
+from zope.event.classhandler import handler
 
 from nextgisweb.lib.apitype import AnyOf, ContentType, StatusCode
 from nextgisweb.lib.geometry import Geometry
@@ -17,11 +18,13 @@ from nextgisweb.core.exception import ValidationError
 from nextgisweb.feature_layer import IFeatureLayer
 from nextgisweb.render.api import TileX, TileY, TileZ
 from nextgisweb.resource import DataScope, Resource
+from nextgisweb.resource.event import AfterResourcePut
 from nextgisweb.resource.exception import ResourceNotFound
 from nextgisweb.spatial_ref_sys import SRS
 
 from .api_export import _ogr_layer_from_features
-from .interface import IFeatureQueryClipByBox, IFeatureQuerySimplify
+from .interface import IFeatureQueryClipByBox, IFeatureQueryMVT, IFeatureQuerySimplify
+from .mvt_cache import mvt_cache_get, mvt_cache_invalidate, mvt_cache_put, mvt_cache_variant
 from .ogrdriver import MVT_DRIVER_EXIST
 
 
@@ -42,13 +45,11 @@ def mvt(
     extent: int = 4096,
     simplification: Optional[float],
     padding: Annotated[float, Meta(ge=0, le=0.5)] = 0.05,
+    cache: bool = True,
 ) -> AnyOf[
     Annotated[None, ContentType("application/vnd.mapbox-vector-tile")],
     Annotated[None, StatusCode(204)],
 ]:
-    if not MVT_DRIVER_EXIST:
-        return HTTPNotFound(explanation="MVT GDAL driver not found")
-
     if simplification is None:
         simplification = extent / 512
 
@@ -64,18 +65,11 @@ def mvt(
     )
     bbox = Geometry.from_shape(box(*bbox), srid=merc.id)
 
-    options = [
-        "FORMAT=DIRECTORY",
-        "TILE_EXTENSION=pbf",
-        "MINZOOM=%d" % z,
-        "MAXZOOM=%d" % z,
-        "EXTENT=%d" % extent,
-        "COMPRESS=NO",
-    ]
-
-    ds = _ogr_ds("MVT", options)
-
-    vsibuf = ds.GetName()
+    # Protobuf messages are concatenable, so each layer is encoded (or taken
+    # from the cache) separately and then tile layers are just joined.
+    content = []
+    cache = cache and request.env.feature_layer.options["mvt_cache.enabled"]
+    variant = mvt_cache_variant(extent, simplification, padding)
 
     for resid in resource:
         try:
@@ -88,51 +82,118 @@ def mvt(
 
         request.resource_permission(DataScope.read, obj)
 
-        query = obj.feature_query()
-        query.intersects(bbox)
-        query.geom()
+        data = mvt_cache_get(obj.id, variant, (z, x, y)) if cache else None
+        if data is None:
+            query = obj.feature_query()
+            native = IFeatureQueryMVT.providedBy(query)
+            if not native and not MVT_DRIVER_EXIST:
+                return HTTPNotFound(explanation="MVT GDAL driver not found")
+
+            data = _encode_layer(
+                obj,
+                query,
+                native,
+                merc,
+                bbox,
+                (z, x, y),
+                extent=extent,
+                simplification=simplification,
+                padding=padding,
+            )
 
-        if IFeatureQueryClipByBox.providedBy(query):
-            query.clip_by_box(bbox)
+            if cache:
+                mvt_cache_put(obj.id, variant, (z, x, y), data)
 
-        if IFeatureQuerySimplify.providedBy(query):
-            tolerance = ((obj.srs.maxx - obj.srs.minx) / (1 << z)) / extent
-            query.simplify(tolerance * simplification)
+        content.append(data)
 
-        _ogr_layer_from_features(obj, query(), name="ngw:%d" % obj.id, ds=ds)
+    content = b"".join(content)
+    if len(content) == 0:
+        return HTTPNoContent()
 
-    # flush changes
-    ds = None
+    return Response(content, content_type="application/vnd.mapbox-vector-tile")
 
-    filepath = os.path.join("%s" % vsibuf, "%d" % z, "%d" % x, "%d.pbf" % y)
 
-    try:
-        f = gdal.VSIFOpenL(filepath, "rb")
+def _encode_layer(obj, query, native, merc, bbox, tile, *, extent, simplification, padding):
+    z, x, y = tile
 
-        if f is not None:
-            # SEEK_END = 2
-            gdal.VSIFSeekL(f, 0, 2)
-            size = gdal.VSIFTellL(f)
+    # Layers supporting ST_AsMVT are encoded by the database, the rest are
+    # written via the GDAL MVT driver.
+    if native:
+        query.srs(merc)
+        qsrs = merc
+    else:
+        query.geom()
+        qsrs = obj.srs
+
+    query.intersects(bbox)
+
+    if IFeatureQueryClipByBox.providedBy(query):
+        query.clip_by_box(bbox)
+
+    if IFeatureQuerySimplify.providedBy(query):
+        tolerance = ((qsrs.maxx - qsrs.minx) / (1 << z)) / extent
+        query.simplify(tolerance * simplification)
+
+    name = "ngw:%d" % obj.id
+    if native:
+        return query().mvt(
+            merc.tile_extent(tile),
+            name=name,
+            extent=extent,
+            buffer=int(extent * padding),
+        )
+
+    ds = _ogr_ds(
+        "MVT",
+        [
+            "FORMAT=DIRECTORY",
+            "TILE_EXTENSION=pbf",
+            "MINZOOM=%d" % z,
+            "MAXZOOM=%d" % z,
+            "EXTENT=%d" % extent,
+            "COMPRESS=NO",
+        ],
+    )
+    _ogr_layer_from_features(obj, query, name=name, ds=ds)
 
-            # SEEK_SET = 0
-            gdal.VSIFSeekL(f, 0, 0)
-            content = bytes(gdal.VSIFReadL(1, size, f))
-            gdal.VSIFCloseL(f)
+    vsibuf = ds.GetName()
 
-            return Response(
-                content,
-                content_type="application/vnd.mapbox-vector-tile",
-            )
-        else:
-            return HTTPNoContent()
+    # flush changes
+    ds = None
 
+    try:
+        return _read_ogr_tile(vsibuf, z, x, y)
     finally:
         gdal.Unlink(vsibuf)
 
 
+def _read_ogr_tile(vsibuf, z, x, y):
+    filepath = os.path.join("%s" % vsibuf, "%d" % z, "%d" % x, "%d.pbf" % y)
+
+    f = gdal.VSIFOpenL(filepath, "rb")
+    if f is None:
+        return b""
+
+    # SEEK_END = 2
+    gdal.VSIFSeekL(f, 0, 2)
+    size = gdal.VSIFTellL(f)
+
+    # SEEK_SET = 0
+    gdal.VSIFSeekL(f, 0, 0)
+    content = bytes(gdal.VSIFReadL(1, size, f))
+    gdal.VSIFCloseL(f)
+
+    return content
+
+
 def setup_pyramid(comp, config):
     config.add_route(
         "feature_layer.mvt",
         "/api/component/feature_layer/mvt",
         get=mvt,
     )
+
+    @handler(AfterResourcePut)
+    def _invalidate_mvt_cache(event):
+        if comp.options["mvt_cache.enabled"] and IFeatureLayer.providedBy(event.resource):
+            mvt_cache_invalidate(event.resource.id)
@@ -1,3 +1,6 @@
+import os.path
+from datetime import timedelta
+
 from nextgisweb.env import Component, require
 from nextgisweb.lib.config import Option
 
@@ -15,6 +18,7 @@ class FeatureLayerComponent(Component):
     def initialize(self):
         self.FeatureExtension = FeatureExtension
         self.export_limit = self.options["export.limit"]
+        self.mvt_cache_path = os.path.join(self.env.core.gtsdir(self), "mvt_cache")
 
     @require("resource")
     def setup_pyramid(self, config):
@@ -23,6 +27,19 @@ class FeatureLayerComponent(Component):
         view.setup_pyramid(self, config)
         api.setup_pyramid(self, config)
 
+    def maintenance(self):
+        super().maintenance()
+        self.cleanup()
+
+    def cleanup(self):
+        from .mvt_cache import mvt_cache_cleanup
+
+        mvt_cache_cleanup()
+
+    def backup_configure(self, config):
+        super().backup_configure(config)
+        config.exclude_table_data("public", "feature_layer_mvt_cache")
+
     def client_settings(self, request):
         editor_widget = dict()
         for k, ecls in FeatureExtension.registry.items():
@@ -45,5 +62,8 @@ class FeatureLayerComponent(Component):
     option_annotations = (
         Option("export.limit", int, default=None, doc='The export limit'),
         Option("versioning.enabled", bool, default=False),
+        Option("mvt_cache.enabled", bool, default=False, doc="Cache MVT tiles and invalidate them on feature edits."),
+        Option("mvt_cache.ttl", timedelta, default=timedelta(hours=1), doc="Lifetime of cached MVT tiles, which limits how long data changed outside the Web GIS (e.g. in PostGIS tables) isn't visible."),
+        Option("stream.batch_size", int, default=1000, doc="Number of features fetched from a database cursor at once while streaming."),
     )
     # fmt: on
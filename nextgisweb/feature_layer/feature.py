@@ -5,8 +5,9 @@ from msgspec import UNSET, UnsetType
 from osgeo import ogr
 
 from nextgisweb.lib.geometry import Geometry
+from nextgisweb.lib.json import loadb
 
-from .interface import FIELD_TYPE
+from .interface import FIELD_TYPE, IFeatureQueryBatch
 
 
 class Feature:
@@ -106,3 +107,107 @@ class FeatureSet:
             type="FeatureCollection",
             features=[f.__geo_interface__ for f in self],
         )
+
+
+class FeatureBatch:
+    """Block of features stored by columns: lists of feature IDs, versions,
+    geometries in a serialized form (WKB bytes, WKT or GeoJSON strings
+    depending on geom_format) and field values keyed by field keyname. Geometries are
+    UNSET if they weren't requested."""
+
+    def __init__(self, layer, fid, *, vid=None, geom=UNSET, geom_format="WKB", fields=None):
+        self.layer = layer
+        self.fid = fid
+        self.vid = vid if vid is not None else (None,) * len(fid)
+        self.geom = geom
+        self.geom_format = geom_format
+        self.fields = fields if fields is not None else dict()
+
+    def __len__(self):
+        return len(self.fid)
+
+    def geometry(self, idx):
+        if self.geom is UNSET:
+            return UNSET
+        elif (geom_data := self.geom[idx]) is None:
+            return None
+        elif self.geom_format == "WKB":
+            return Geometry.from_wkb(geom_data, validate=False)
+        elif self.geom_format == "WKT":
+            return Geometry.from_wkt(geom_data, validate=False)
+        elif self.geom_format == "GeoJSON":
+            return Geometry.from_geojson(loadb(geom_data), validate=False)
+        else:
+            raise NotImplementedError
+
+    def feature(self, idx):
+        return Feature(
+            layer=self.layer,
+            id=self.fid[idx],
+            version=self.vid[idx],
+            fields={k: v[idx] for k, v in self.fields.items()},
+            geom=self.geometry(idx),
+        )
+
+    def __iter__(self):
+        for idx in range(len(self.fid)):
+            yield self.feature(idx)
+
+    @classmethod
+    def from_rows(cls, layer, keys, rows, *, fid, vid=None, geom=None, geom_format, fields):
+        """Transpose database result rows into a batch. Arguments fid, vid and
+        geom are result column names, fields is a list of (keyname, column
+        name) pairs."""
+
+        columns = dict(zip(keys, zip(*rows)))
+
+        if geom is None:
+            geom_column = UNSET
+        elif geom_format == "WKB":
+            geom_column = [bytes(v) if v is not None else None for v in columns[geom]]
+        else:
+            geom_column = columns[geom]
+
+        return cls(
+            layer,
+            columns[fid],
+            vid=columns[vid] if vid is not None else None,
+            geom=geom_column,
+            geom_format=geom_format,
+            fields={keyname: columns[column] for keyname, column in fields},
+        )
+
+    @classmethod
+    def from_features(cls, layer, features):
+        fid, vid, geom, fields = [], [], [], dict()
+        for idx, feature in enumerate(features):
+            fid.append(feature.id)
+            vid.append(feature.version)
+            if (g := feature.geom) is not UNSET:
+                geom.append(g.wkb if g is not None else None)
+            for k, v in feature.fields.items():
+                if (column := fields.get(k)) is None:
+                    column = fields[k] = [None] * idx
+                column.append(v)
+
+        return cls(layer, fid, vid=vid, geom=geom if len(geom) > 0 else UNSET, fields=fields)
+
+
+def feature_batches(query, size):
+    """Iterate over the query result by FeatureBatch blocks of the given size.
+    Feature queries which don't support columnar fetching fall back to the
+    conversion of Feature objects."""
+
+    if IFeatureQueryBatch.providedBy(query):
+        yield from query().batches(size)
+        return
+
+    chunk = []
+    for feature in query():
+        chunk.append(feature)
+        if len(chunk) >= size:
+            yield FeatureBatch.from_features(query.layer, chunk)
+            chunk = []
+
+    if chunk:
+        yield FeatureBatch.from_features(query.layer, chunk)
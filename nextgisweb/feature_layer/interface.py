@@ -187,6 +187,12 @@ class IFeatureQueryFilter(IFeatureQuery):
         """Set query rules"""
 
 
+class IFeatureQueryFilterExpr(IFeatureQuery):
+    def filter_expr(self, expr):
+        """Set query by a filter expression tree which is compiled into a
+        single SQL condition, see filter_expr_condition for the syntax"""
+
+
 class IFeatureQueryFilterBy(IFeatureQuery):
     def filter_by(self, **kwargs):
         """Set query by attributes"""
@@ -222,3 +228,36 @@ class IFeatureQueryClipByBox(IFeatureQuery):
 class IFeatureQuerySimplify(IFeatureQuery):
     def simplify(self, tolerance):
         """Simplify geometry by the given tolerance"""
+
+
+class IFeatureQueryMVT(IFeatureQuery):
+    """Feature query which result set can be encoded into a Mapbox vector tile
+    layer on the database side via mvt(bounds, name=, extent=, buffer=) method
+    of the feature set. Geometries are expected in EPSG:3857 so the query SRS
+    should be set accordingly."""
+
+
+class IFeatureQueryStream(IFeatureQuery):
+    def stream(self, batch_size):
+        """Fetch features from a server-side cursor in batches of the given
+        size instead of loading the whole result set into memory"""
+
+
+class IFeatureQueryKeyset(IFeatureQuery):
+    def keyset(self, key):
+        """Start the result set after the given key: values of order_by
+        fields followed by ID of the last feature of the previous page"""
+
+
+class IFeatureQueryBatch(IFeatureQuery):
+    """Feature query which result set can be fetched by columnar blocks via
+    batches(size) method of the feature set, which yields FeatureBatch
+    objects without instantiating Feature and Geometry for each row"""
+
+
+class IFeatureQueryGeoJSON(IFeatureQuery):
+    """Feature query which supports "GeoJSON" geometry format serialized on
+    the database side. Geometries are loaded as GeoJSON strings."""
+
+    def geom_precision(self, digits):
+        """Set maximum number of decimal digits of GeoJSON coordinates"""
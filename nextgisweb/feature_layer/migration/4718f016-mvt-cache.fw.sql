@@ -0,0 +1,20 @@
+/*** {
+    "revision": "4718f016", "parents": ["438055b2"],
+    "date": "2024-09-20T10:15:00",
+    "message": "MVT cache"
+} ***/
+
+CREATE TABLE feature_layer_mvt_cache
+(
+    resource_id integer NOT NULL,
+    variant character varying NOT NULL,
+    z smallint NOT NULL,
+    x integer NOT NULL,
+    y integer NOT NULL,
+    tstamp integer NOT NULL,
+    CONSTRAINT feature_layer_mvt_cache_pkey PRIMARY KEY (resource_id, variant, z, x, y),
+    CONSTRAINT feature_layer_mvt_cache_resource_id_fkey FOREIGN KEY (resource_id)
+        REFERENCES resource (id) ON DELETE CASCADE
+);
+
+COMMENT ON TABLE feature_layer_mvt_cache IS 'feature_layer';
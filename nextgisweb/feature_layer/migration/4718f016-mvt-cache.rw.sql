@@ -0,0 +1,3 @@
+/*** { "revision": "4718f016" } ***/
+
+DROP TABLE feature_layer_mvt_cache;
@@ -92,11 +92,22 @@ class LayerFieldsMixin:
             backref=orm.backref("_feature_label_field_backref"),
         )
 
-    def to_ogr(self, ogr_ds, *, name="", fields=None, use_display_name=False, fid=None):
+    def to_ogr(
+        self,
+        ogr_ds,
+        *,
+        name="",
+        fields=None,
+        use_display_name=False,
+        fid=None,
+        srs=None,
+        geom_type=ogr.wkbUnknown,
+        options=(),
+    ):
         if fields is None:
             fields = self.fields
-        sr = self.srs.to_osr()
-        ogr_layer = ogr_ds.CreateLayer(name, srs=sr)
+        sr = (self.srs if srs is None else srs).to_osr()
+        ogr_layer = ogr_ds.CreateLayer(name, srs=sr, geom_type=geom_type, options=list(options))
         for field in fields:
             ogr_layer.CreateField(
                 ogr.FieldDefn(
@@ -279,3 +290,145 @@ class FeatureQueryIntersectsMixin:
             geom = transformer.transform(geom)
 
         self._intersects = geom
+
+
+def mvt_query(idcol, geomexpr, columns, where, bounds, *, name, extent, buffer):
+    """Build a query encoding features into a single Mapbox vector tile layer
+    with ST_AsMVT. The geometry expression must be in the bounds SRS."""
+
+    tile_geom = sa.func.st_asmvtgeom(
+        geomexpr, sa.func.st_makeenvelope(*bounds), extent, buffer, True
+    )
+    tile = (
+        sa.select(idcol.label("fid"), tile_geom.label("geom"), *columns)
+        .where(*where)
+        .subquery("tile")
+    )
+    return sa.select(
+        sa.func.st_asmvt(sa.literal_column(tile.name), name, extent, "geom", "fid")
+    ).select_from(tile)
+
+
+def keyset_condition(order, key):
+    """Build a condition selecting rows following the key in the given order
+    which is a list of (direction, column) pairs ending with the ID column.
+    NULLs go last in ascending and first in descending order like PostgreSQL
+    sorts them by default."""
+
+    *order, (_, idcol) = order
+    *values, fid = key
+
+    cond = idcol > fid
+    for (direction, column), value in reversed(list(zip(order, values))):
+        if value is None:
+            after = sa.false() if direction == "asc" else column.isnot(None)
+            equal = column.is_(None)
+        else:
+            if direction == "asc":
+                after = sa.or_(column > value, column.is_(None))
+            else:
+                after = column < value
+            equal = column == value
+        cond = sa.or_(after, sa.and_(equal, cond))
+    return cond
+
+
+FILTER_EXPR_COMPARISON = dict(
+    eq=sa.sql.operators.eq,
+    ne=sa.sql.operators.ne,
+    gt=sa.sql.operators.gt,
+    ge=sa.sql.operators.ge,
+    lt=sa.sql.operators.lt,
+    le=sa.sql.operators.le,
+)
+
+FILTER_EXPR_SPATIAL = dict(
+    intersects=sa.func.st_intersects,
+    within=sa.func.st_within,
+    contains=sa.func.st_contains,
+    touches=sa.func.st_touches,
+    crosses=sa.func.st_crosses,
+    overlaps=sa.func.st_overlaps,
+    equals=sa.func.st_equals,
+)
+
+
+def filter_expr_condition(expr, *, idcol, fields, geomcol, srid):
+    """Compile a filter expression tree into a single SQL condition
+
+    Expressions are tuples which start with an operator:
+
+    * ``("and", *exprs)``, ``("or", *exprs)`` and ``("not", expr)``
+    * ``(op, key, value)`` where op is one of eq, ne, gt, ge, lt and le
+    * ``("like", key, pattern)`` and ``("ilike", key, pattern)`` where the
+      pattern uses SQL wildcards and backslash as an escape character
+    * ``("between", key, lower, upper)``, ``("isnull", key)`` and
+      ``("in", key, values)``
+    * ``(op, geom)`` where op is one of bbox, intersects, disjoint, within,
+      contains, touches, crosses, overlaps and equals
+    * ``("dwithin", geom, distance)`` and ``("beyond", geom, distance)``
+      where the distance is in units of the layer SRS
+
+    The key "id" refers to feature IDs, other keys refer to fields. Spatial
+    predicates are applied to the geometry column as is, so spatial indexes
+    can be used, and operand geometries are transformed to the column SRS."""
+
+    def column(key):
+        if key == "id":
+            return idcol
+        if key not in fields:
+            raise ValueError("Field '%s' not found." % key)
+        return fields[key]
+
+    def geometry(geom):
+        geom_srid = srid if geom.srid is None else geom.srid
+        result = sa.func.st_geomfromwkb(geom.wkb)
+        if geom_srid != srid and SRS.filter_by(id=geom_srid).one().is_geographic:
+            # Prevent tolerance condition error
+            bound_geom = sa.func.st_makeenvelope(-180, -89.9, 180, 89.9)
+            result = sa.func.st_intersection(bound_geom, result)
+        result = sa.func.st_setsrid(result, geom_srid)
+        if geom_srid != srid:
+            result = sa.func.st_transform(result, srid)
+        return result
+
+    def _compile(expr):
+        op, *args = expr
+        if op in ("and", "or"):
+            return getattr(sa, f"{op}_")(*(_compile(a) for a in args))
+        elif op == "not":
+            return sa.not_(_compile(*args))
+        elif op in FILTER_EXPR_COMPARISON:
+            key, value = args
+            return FILTER_EXPR_COMPARISON[op](column(key), value)
+        elif op in ("like", "ilike"):
+            key, pattern = args
+            col = column(key)
+            if not isinstance(col.type, sa.String):
+                col = sa.cast(col, sa.Unicode)
+            return getattr(col, op)(pattern, escape="\\")
+        elif op == "between":
+            key, lower, upper = args
+            return column(key).between(lower, upper)
+        elif op == "isnull":
+            (key,) = args
+            return column(key).is_(None)
+        elif op == "in":
+            key, values = args
+            return column(key).in_(values)
+        elif op == "bbox":
+            (geom,) = args
+            return sa.func.st_intersects(geomcol, sa.func.st_envelope(geometry(geom)))
+        elif op in FILTER_EXPR_SPATIAL:
+            (geom,) = args
+            return FILTER_EXPR_SPATIAL[op](geomcol, geometry(geom))
+        elif op == "disjoint":
+            (geom,) = args
+            return sa.not_(sa.func.st_intersects(geomcol, geometry(geom)))
+        elif op in ("dwithin", "beyond"):
+            geom, distance = args
+            cond = sa.func.st_dwithin(geomcol, geometry(geom), distance)
+            return cond if op == "dwithin" else sa.not_(cond)
+        raise ValueError("Invalid filter operator '%s'." % op)
+
+    return _compile(expr)
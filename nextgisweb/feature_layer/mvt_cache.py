@@ -0,0 +1,243 @@
+import os
+import os.path
+import shutil
+from datetime import datetime
+from functools import wraps
+
+import sqlalchemy as sa
+import transaction
+from msgspec import UNSET
+from zope.sqlalchemy import mark_changed
+
+from nextgisweb.env import Base, DBSession, env
+from nextgisweb.lib.geometry import Geometry, Transformer
+from nextgisweb.lib.logging import logger
+
+from nextgisweb.render.model import TIMESTAMP_EPOCH, get_tile_db
+from nextgisweb.resource import Resource
+from nextgisweb.spatial_ref_sys import SRS
+
+MVT_CACHE_MAX_Z = 22
+
+
+class MVTCacheTile(Base):
+    __tablename__ = "feature_layer_mvt_cache"
+
+    resource_id = sa.Column(sa.ForeignKey(Resource.id, ondelete="CASCADE"), primary_key=True)
+    variant = sa.Column(sa.Unicode, primary_key=True)
+    z = sa.Column(sa.SmallInteger, primary_key=True)
+    x = sa.Column(sa.Integer, primary_key=True)
+    y = sa.Column(sa.Integer, primary_key=True)
+    tstamp = sa.Column(sa.Integer, nullable=False)
+
+
+_tab = MVTCacheTile.__table__
+
+
+def mvt_cache_variant(extent, simplification, padding):
+    """Cache variant key for tile encoding parameters"""
+    return "{}-{:g}-{:g}".format(extent, simplification, padding)
+
+
+def _tilestor_path(resource_id, variant):
+    return os.path.join(env.feature_layer.mvt_cache_path, str(resource_id), variant)
+
+
+def _tstamp_now(now=None):
+    if now is None:
+        now = datetime.utcnow()
+    return int((now - TIMESTAMP_EPOCH).total_seconds())
+
+
+def _tstamp_expired(now=None):
+    """Tiles written before this timestamp are expired, as layer data may be
+    changed outside the Web GIS without invalidation"""
+    ttl = env.feature_layer.options["mvt_cache.ttl"]
+    return _tstamp_now(now) - int(ttl.total_seconds())
+
+
+def mvt_cache_get(resource_id, variant, tile):
+    """Get cached tile layer data or None if the tile is missing or expired"""
+    z, x, y = tile
+
+    tstamp = DBSession.execute(
+        sa.select(_tab.c.tstamp).where(
+            _tab.c.resource_id == resource_id,
+            _tab.c.variant == variant,
+            _tab.c.z == z,
+            _tab.c.x == x,
+            _tab.c.y == y,
+            _tab.c.tstamp >= _tstamp_expired(),
+        )
+    ).scalar()
+
+    if tstamp is None:
+        return None
+
+    tilestor, lock = get_tile_db(_tilestor_path(resource_id, variant))
+    with lock:
+        srow = tilestor.execute(
+            "SELECT data FROM tile WHERE z = ? AND x = ? AND y = ? AND tstamp >= ?",
+            (z, x, y, tstamp),
+        ).fetchone()
+
+    return None if srow is None else bytes(srow[0])
+
+
+def mvt_cache_put(resource_id, variant, tile, data):
+    z, x, y = tile
+    tstamp = _tstamp_now()
+
+    # Tile data goes first, so metadata never refers to missing data
+    tilestor, lock = get_tile_db(_tilestor_path(resource_id, variant))
+    with lock:
+        # fmt: off
+        tilestor.execute("""
+            INSERT INTO tile VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (z, x, y) DO UPDATE
+            SET tstamp = ?, data = ?
+            WHERE tstamp <= ?
+        """, (z, x, y, tstamp, data, tstamp, data, tstamp))
+        # fmt: on
+        tilestor.commit()
+
+    # fmt: off
+    DBSession.execute(sa.text("""
+        INSERT INTO feature_layer_mvt_cache AS c (resource_id, variant, z, x, y, tstamp)
+        VALUES (:resource_id, :variant, :z, :x, :y, :tstamp)
+        ON CONFLICT (resource_id, variant, z, x, y) DO UPDATE
+        SET tstamp = :tstamp WHERE c.tstamp < :tstamp
+    """), dict(resource_id=resource_id, variant=variant, z=z, x=x, y=y, tstamp=tstamp))
+    # fmt: on
+    mark_changed(DBSession())
+
+
+def mvt_cache_invalidate(resource_id, bounds=None):
+    """Invalidate cached tiles of a resource. Only tiles touching the given
+    EPSG:3857 bounds are invalidated, or all of them if bounds are None."""
+
+    where = [_tab.c.resource_id == resource_id]
+
+    if bounds is not None:
+        merc = SRS.filter_by(id=3857).one()
+
+        cond = []
+        for z in range(MVT_CACHE_MAX_Z + 1):
+            xmin, ymin, xmax, ymax = merc.extent_tile_range(bounds, z)
+            # One more tile around to cover tile padding
+            tmax = 2**z - 1
+            cond.append(
+                sa.and_(
+                    _tab.c.z == z,
+                    _tab.c.x.between(max(xmin - 1, 0), min(xmax + 1, tmax)),
+                    _tab.c.y.between(max(ymin - 1, 0), min(ymax + 1, tmax)),
+                )
+            )
+        where.append(sa.or_(*cond))
+
+    result = DBSession.execute(sa.delete(_tab).where(*where))
+    if result.rowcount > 0:
+        mark_changed(DBSession())
+
+
+def _bounds_stored(layer, fid, merc):
+    query = layer.feature_query()
+    query.srs(merc)
+    query.box()
+    query.filter_by(id=fid)
+    for feature in query():
+        return feature.box.bounds if feature.box else None
+    return None
+
+
+def _bounds_geom(layer, geom, merc):
+    if geom in (None, UNSET):
+        return None
+    if layer.srs_id != merc.id:
+        geom = Transformer(layer.srs.wkt, merc.wkt).transform(
+            Geometry.from_box(*geom.bounds, srid=layer.srs_id)
+        )
+    return geom.bounds
+
+
+def mvt_cache_invalidation(func):
+    """Decorator for IWritableFeatureLayer methods which invalidates cached
+    tiles touching both previous and new locations of edited features"""
+
+    op = func.__name__
+    assert op in (
+        "feature_create",
+        "feature_put",
+        "feature_delete",
+        "feature_restore",
+        "feature_delete_all",
+    )
+
+    @wraps(func)
+    def wrapped(layer, *args, **kwargs):
+        if not env.feature_layer.options["mvt_cache.enabled"]:
+            return func(layer, *args, **kwargs)
+
+        if op == "feature_delete_all":
+            result = func(layer, *args, **kwargs)
+            mvt_cache_invalidate(layer.id)
+            return result
+
+        merc = SRS.filter_by(id=3857).one()
+        (arg,) = args
+
+        bounds = []
+        if op in ("feature_put", "feature_delete"):
+            fid = arg if op == "feature_delete" else arg.id
+            bounds.append(_bounds_stored(layer, fid, merc))
+
+        result = func(layer, *args, **kwargs)
+
+        if op == "feature_create":
+            bounds.append(_bounds_geom(layer, arg.geom, merc))
+        elif op == "feature_put":
+            bounds.append(_bounds_geom(layer, arg.geom, merc))
+        elif op == "feature_restore":
+            bounds.append(_bounds_stored(layer, arg.id, merc))
+
+        for b in bounds:
+            if b is not None:
+                mvt_cache_invalidate(layer.id, b)
+
+        return result
+
+    return wrapped
+
+
+def mvt_cache_cleanup(now=None):
+    """Remove expired tiles and tile storages of deleted resources"""
+
+    expired = _tstamp_expired(now)
+    path = env.feature_layer.mvt_cache_path
+    with transaction.manager:
+        result = DBSession.execute(sa.delete(_tab).where(_tab.c.tstamp < expired))
+        if result.rowcount > 0:
+            mark_changed(DBSession())
+        exists = set(str(i) for i, in DBSession.query(Resource.id))
+    logger.info("Deleted: %d expired MVT cache tiles.", result.rowcount)
+
+    if not os.path.isdir(path):
+        return
+
+    deleted = 0
+    for name in os.listdir(path):
+        rpath = os.path.join(path, name)
+        if name not in exists:
+            shutil.rmtree(rpath)
+            deleted += 1
+            continue
+
+        for variant in os.listdir(rpath):
+            if variant.endswith(("-wal", "-shm", "-journal")):
+                continue
+            tilestor, lock = get_tile_db(os.path.join(rpath, variant))
+            with lock:
+                tilestor.execute("DELETE FROM tile WHERE tstamp < ?", (expired,))
+                tilestor.commit()
+
+    logger.info("Deleted: %d MVT cache storages.", deleted)
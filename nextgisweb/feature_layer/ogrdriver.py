@@ -27,6 +27,7 @@ OGRDriverT = namedtuple(
         "fid_support",
         "lco_configurable",
         "dsco_configurable",
+        "direct_write",
     ],
 )
 
@@ -41,6 +42,7 @@ def OGRDriver(
     fid_support=False,
     lco_configurable=None,
     dsco_configurable=None,
+    direct_write=True,
 ):
     return OGRDriverT(
         name,
@@ -52,6 +54,7 @@ def OGRDriver(
         fid_support,
         lco_configurable,
         dsco_configurable,
+        direct_write,
     )
 
 
@@ -146,6 +149,7 @@ EXPORT_FORMAT_OGR["DXF"] = OGRDriver(
     "dxf",
     single_file=True,
     mime="application/dxf",
+    direct_write=False,
 )
 
 EXPORT_FORMAT_OGR["SXF"] = OGRDriver(
@@ -155,6 +159,7 @@ EXPORT_FORMAT_OGR["SXF"] = OGRDriver(
     single_file=False,
     options=("SXF_NEW_BEHAVIOR=YES",),
     dsco_configurable=("SXF_MAP_SCALE:1000000", "SXF_MAP_NAME", "SXF_SHEET_KEY"),
+    direct_write=False,
 )
 
 OGR_DRIVER_NAME_2_EXPORT_FORMATS = [
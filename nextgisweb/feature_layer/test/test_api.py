@@ -1,9 +1,11 @@
 import importlib
 import json
+from datetime import datetime, timedelta
 from itertools import product
 
 import pytest
 import transaction
+from osgeo import gdal
 
 from nextgisweb.env import DBSession
 from nextgisweb.lib.geometry import Geometry
@@ -253,14 +255,68 @@ def test_mvt(extent, simplification, padding, ngw_webtest_app, vector_layer_id):
     ngw_webtest_app.get("/api/component/feature_layer/mvt", params, status=200)
 
 
+def test_mvt_native(ngw_webtest_app, vector_layer_id):
+    params = dict(ZXY0, resource=vector_layer_id, extent=4096)
+    resp = ngw_webtest_app.get("/api/component/feature_layer/mvt", params, status=200)
+
+    vsipath = "/vsimem/test_mvt_native.pbf"
+    gdal.FileFromMemBuffer(vsipath, resp.body)
+    try:
+        ds = gdal.OpenEx(vsipath, gdal.OF_VECTOR, open_options=["X=0", "Y=0", "Z=0"])
+        layer = ds.GetLayerByName("ngw:%d" % vector_layer_id)
+        assert layer.GetFeatureCount() == 2
+        assert {f["name"] for f in layer} == {"feature1", "feature2"}
+    finally:
+        ds = None
+        gdal.Unlink(vsipath)
+
+
+def test_mvt_cache(ngw_env, ngw_webtest_app, vector_layer_id):
+    from ..mvt_cache import MVTCacheTile, mvt_cache_cleanup
+
+    def cached():
+        with transaction.manager:
+            return MVTCacheTile.filter_by(resource_id=vector_layer_id, z=0).count()
+
+    params = dict(ZXY0, resource=vector_layer_id, extent=4096)
+    feature_url = "/api/resource/%d/feature/1" % vector_layer_id
+
+    with ngw_env.feature_layer.options.override({"mvt_cache.enabled": True}):
+        body = ngw_webtest_app.get("/api/component/feature_layer/mvt", params).body
+        assert cached() == 1
+
+        resp = ngw_webtest_app.get("/api/component/feature_layer/mvt", params)
+        assert resp.body == body
+
+        # Feature editing invalidates tiles touching the feature
+        ngw_webtest_app.put_json(feature_url, dict(fields=dict(price=-3)))
+        assert cached() == 0
+
+        ngw_webtest_app.get("/api/component/feature_layer/mvt", dict(params, cache=False))
+        assert cached() == 0
+
+    # Tiles expire, as layer data may be changed outside the Web GIS
+    options = {"mvt_cache.enabled": True, "mvt_cache.ttl": timedelta(hours=1)}
+    with ngw_env.feature_layer.options.override(options):
+        ngw_webtest_app.get("/api/component/feature_layer/mvt", params)
+        assert cached() == 1
+
+        mvt_cache_cleanup(datetime.utcnow() + timedelta(minutes=30))
+        assert cached() == 1
+
+        mvt_cache_cleanup(datetime.utcnow() + timedelta(hours=2))
+        assert cached() == 0
+
+
 @pytest.mark.parametrize(
     "mvt_driver_exist, status_expected",
     (
         (True, 200),
-        (False, 404),
+        # Vector layers are encoded by PostGIS and don't require the driver
+        (False, 200),
     ),
 )
-def test_mvt_should_return_not_found_if_mvt_driver_not_available(
+def test_mvt_driver_not_available(
     mvt_driver_exist, status_expected, ngw_webtest_app, vector_layer_id
 ):
     from .. import ogrdriver
@@ -300,6 +356,61 @@ def test_filter(ngw_webtest_app, vector_layer_id):
     ngw_webtest_app.get(url_feature, dict(fld_not_exists="no matter"), status=422)
 
 
+def test_cget_geojson(ngw_webtest_app, vector_layer_id):
+    url_feature = f"/api/resource/{vector_layer_id}/feature/"
+    features = ngw_webtest_app.get(url_feature, dict(geom_format="geojson")).json
+    for f in features:
+        geom = Geometry.from_wkt(ngw_webtest_app.get(f"{url_feature}{f['id']}").json["geom"])
+        expected = geom.to_geojson()
+        assert f["geom"]["type"] == expected["type"]
+        assert f["geom"]["coordinates"] == pytest.approx(list(expected["coordinates"]))
+
+    resp = ngw_webtest_app.get(url_feature, dict(geom_format="geojson", geom_precision=2))
+    for f, fp in zip(features, resp.json):
+        assert fp["geom"]["coordinates"] == [round(c, 2) for c in f["geom"]["coordinates"]]
+
+
+@pytest.mark.parametrize("order_by", (None, "-price", "name,-price"))
+def test_cget_cursor(order_by, ngw_webtest_app, vector_layer_id):
+    url_feature = f"/api/resource/{vector_layer_id}/feature/"
+    params = dict(fields="name") if order_by is None else dict(fields="name", order_by=order_by)
+    expected = [f["id"] for f in ngw_webtest_app.get(url_feature, params).json]
+
+    ids, url, query = [], url_feature, dict(params, limit=1)
+    while True:
+        resp = ngw_webtest_app.get(url, query)
+        ids.extend(f["id"] for f in resp.json)
+        if "Link" not in resp.headers:
+            break
+        url, query = resp.headers["Link"].split(";")[0].strip("<>"), None
+        assert "cursor=" in url
+    assert ids == expected
+
+    ngw_webtest_app.get(url_feature, dict(cursor="invalid"), status=422)
+    ngw_webtest_app.get(url_feature, dict(cursor=resp.request.GET["cursor"], offset=1), status=422)
+
+
+@pytest.mark.parametrize("batch_size", (1, 1000))
+def test_cget_stream(batch_size, ngw_env, ngw_webtest_app, vector_layer_id):
+    url_feature = f"/api/resource/{vector_layer_id}/feature/"
+    features = ngw_webtest_app.get(url_feature, dict(geom_format="geojson")).json
+
+    with ngw_env.feature_layer.options.override({"stream.batch_size": batch_size}):
+        resp = ngw_webtest_app.get(url_feature, dict(stream="ndjson", geom_format="geojson"))
+        assert resp.content_type == "application/x-ndjson"
+        assert [json.loads(line) for line in resp.text.splitlines()] == features
+
+        resp = ngw_webtest_app.get(url_feature, dict(stream="geojson"))
+        assert resp.content_type == "application/geo+json"
+        fc = resp.json
+        assert fc["type"] == "FeatureCollection"
+        assert [f["id"] for f in fc["features"]] == [f["id"] for f in features]
+        assert [f["geometry"] for f in fc["features"]] == [f["geom"] for f in features]
+        assert [f["properties"] for f in fc["features"]] == [f["fields"] for f in features]
+
+    ngw_webtest_app.get(url_feature, dict(stream="ndjson", fld_not_exists="x"), status=422)
+
+
 def test_cdelete(ngw_webtest_app, vector_layer_id):
     url_feature = f"/api/resource/{vector_layer_id}/feature/"
 
@@ -1,6 +1,10 @@
+import hashlib
 import json
+from datetime import datetime, timedelta
 from string import ascii_letters, printable
 from tempfile import NamedTemporaryFile
+from time import sleep
+from uuid import uuid4
 
 import pytest
 import transaction
@@ -9,6 +13,8 @@ from osgeo import gdal
 from nextgisweb.env import DBSession
 from nextgisweb.lib.geometry import Geometry
 
+from nextgisweb.resource import ResourceExportJob
+from nextgisweb.resource.export_job import export_job_cleanup
 from nextgisweb.vector_layer import VectorLayer
 
 from .. import Feature
@@ -182,3 +188,69 @@ def test_export_multi(driver_label, resources, ngw_webtest_app):
             layer = ds.GetLayer(0)
             assert layer is not None
             assert layer.GetFeatureCount() == 1
+
+
+def test_export_job(layer_id, update_field, ngw_webtest_app):
+    update_field(keyname="field")
+
+    job_url = "/api/component/resource/export_job/"
+    body = dict(
+        kind="feature_layer.export",
+        params=dict(resource=layer_id, format="GeoJSON", srs=4326, zipped=False),
+    )
+
+    def wait(job):
+        for _ in range(100):
+            if job["status"] in ("done", "failed"):
+                break
+            sleep(0.1)
+            job = ngw_webtest_app.get(job_url + job["id"]).json
+        return job
+
+    job = wait(ngw_webtest_app.post_json(job_url, body).json)
+    assert job["status"] == "done"
+    assert job["progress"] == 1
+
+    resp = ngw_webtest_app.get(job["download"])
+    assert resp.json["features"][0]["properties"] == dict(field="value")
+
+    # Identical export of the unchanged layer is served from the result
+    assert ngw_webtest_app.post_json(job_url, body).json["id"] == job["id"]
+
+    update_field(keyname="changed")
+    changed = wait(ngw_webtest_app.post_json(job_url, body).json)
+    assert changed["id"] != job["id"]
+
+    resp = ngw_webtest_app.get(changed["download"])
+    assert resp.json["features"][0]["properties"] == dict(changed="value")
+
+
+def test_export_job_stale(layer_id, ngw_webtest_app):
+    job_url = "/api/component/resource/export_job/"
+    body = dict(
+        kind="feature_layer.export",
+        params=dict(resource=layer_id, format="CSV", srs=4326, zipped=False),
+    )
+
+    # Job which was running when its worker died
+    with transaction.manager:
+        created = datetime.utcnow() - timedelta(days=1)
+        stale = ResourceExportJob(
+            id=uuid4().hex,
+            kind=body["kind"],
+            params=body["params"],
+            dedupe_key=hashlib.sha256(
+                json.dumps([body["kind"], body["params"]], sort_keys=True).encode("utf-8")
+            ).hexdigest(),
+            status="running",
+            created=created,
+            heartbeat=created,
+            expires=datetime.utcnow() + timedelta(days=1),
+            resources=[VectorLayer.filter_by(id=layer_id).one()],
+        ).persist()
+
+    assert ngw_webtest_app.post_json(job_url, body).json["id"] != stale.id
+
+    export_job_cleanup()
+    resp = ngw_webtest_app.get(job_url + stale.id)
+    assert resp.json["status"] == "failed"
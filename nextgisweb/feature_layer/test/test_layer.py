@@ -4,6 +4,7 @@ from datetime import date, datetime, time
 import pytest
 from msgspec import UNSET
 from osgeo import ogr
+from shapely.geometry import box
 
 from nextgisweb.lib.geometry import Geometry, Transformer
 
@@ -13,10 +14,13 @@ from nextgisweb.vector_layer.test import create_feature_layer as create_vector_l
 from nextgisweb.wfsclient import WFSLayer
 from nextgisweb.wfsclient.test import create_feature_layer as create_wfs_layer
 
+from ..feature import feature_batches
 from ..interface import (
+    IFeatureQueryClipByBox,
     IFeatureQueryFilter,
     IFeatureQueryFilterBy,
     IFeatureQueryOrderBy,
+    IFeatureQuerySimplify,
 )
 from .data import generate_filter_extents
 
@@ -130,6 +134,19 @@ def test_attributes(
         assert len(fs) == limit
         cmp_fields(gj_fs[offset + limit - 1]["properties"], fs[limit - 1].fields)
 
+        # - batches
+        query = layer.feature_query()
+        query.geom()
+        features = list(query())
+        batches = list(feature_batches(query, 2))
+        assert all(0 < len(b) <= 2 for b in batches)
+        bfeatures = [bf for b in batches for bf in b]
+        assert len(bfeatures) == len(features)
+        for f, bf in zip(features, bfeatures):
+            assert bf.id == f.id
+            assert bf.fields == f.fields
+            assert (bf.geom and bf.geom.wkb) == (f.geom and f.geom.wkb)
+
         q = layer.feature_query()
 
         if IFeatureQueryFilter.providedBy(q):
@@ -238,6 +255,49 @@ def test_geometry(
             cmp_geom(gj_fs[i]["geometry"], f.geom, srs)
 
 
+@pytest.mark.parametrize(
+    "create_resource",
+    (
+        pytest.param(create_vector_layer, id="vector_layer"),
+        pytest.param(create_postgis_layer, id="postgis_layer"),
+    ),
+)
+def test_clip_simplify(create_resource, ngw_resource_group_sub, ngw_data_path):
+    data = ngw_data_path / "geometry" / "polygon.geojson"
+
+    ds = ogr.Open(str(data))
+    ogrlayer = ds.GetLayer(0)
+
+    with create_resource(ogrlayer, ngw_resource_group_sub) as layer:
+        layer.persist()
+
+        srs = SRS.filter_by(id=4326).one()
+
+        def query_geoms(setup):
+            query = layer.feature_query()
+            query.geom()
+            query.srs(srs)
+            setup(query)
+            return [f.geom.shape for f in query() if f.geom is not None]
+
+        source = query_geoms(lambda query: None)
+
+        # - clip_by_box
+        assert IFeatureQueryClipByBox.providedBy(layer.feature_query())
+        clip = box(37.6605, 55.7705, 37.6615, 55.7712)
+        clip_geom = Geometry.from_shape(clip, srid=srs.id)
+        for shape in query_geoms(lambda query: query.clip_by_box(clip_geom)):
+            if not shape.is_empty:
+                assert clip.buffer(1e-9).contains(shape)
+
+        # - simplify
+        assert IFeatureQuerySimplify.providedBy(layer.feature_query())
+        simplified = query_geoms(lambda query: query.simplify(1e-3))
+        assert len(simplified) == len(source)
+        for shape, src in zip(simplified, source):
+            assert len(shape.exterior.coords) <= len(src.exterior.coords)
+
+
 filter_extents_data = generate_filter_extents()
 
 
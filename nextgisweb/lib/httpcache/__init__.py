@@ -0,0 +1,224 @@
+import os
+import sqlite3
+from email.utils import parsedate_to_datetime
+from hashlib import sha256
+from threading import local
+from time import time
+from typing import NamedTuple, Optional
+
+# Access time is updated at most once per this number of seconds, not to turn
+# every cache hit into a write
+ACCESSED_RESOLUTION = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entry (
+    key TEXT PRIMARY KEY,
+    status_code INTEGER NOT NULL,
+    content BLOB NOT NULL,
+    content_type TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    expires REAL NOT NULL,
+    accessed REAL NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entry_accessed_idx ON entry (accessed);
+"""
+
+
+class CacheEntry(NamedTuple):
+    """Cached upstream response which mimics the response object attributes
+    used by callers, i.e. status_code and content"""
+
+    status_code: int
+    content: bytes
+    content_type: Optional[str]
+    etag: Optional[str]
+    last_modified: Optional[str]
+    expires: float
+
+    @property
+    def fresh(self):
+        return self.expires > time()
+
+    def validators(self):
+        """Headers for conditional revalidation of a stale entry"""
+        headers = dict()
+        if self.etag is not None:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified is not None:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+def cache_key(url, *, username=None, password=None):
+    """Key of a request with credentials, as responses depend on them. Keys
+    are hashed by the cache, so credentials aren't stored."""
+    credentials = "" if username is None else "%s:%s" % (username, password or "")
+    return "%s\n%s" % (credentials, url)
+
+
+def cacheable_response(status_code, headers):
+    """Whether a response is an image or an empty tile, as upstream errors
+    often come with 200 status and an XML or HTML body"""
+    if status_code in (204, 404):
+        return True
+    content_type = headers.get("Content-Type", "")
+    return status_code == 200 and content_type.lower().startswith("image/")
+
+
+def cache_control(headers):
+    result = dict()
+    for directive in headers.get("Cache-Control", "").split(","):
+        name, _, value = directive.strip().partition("=")
+        if name:
+            result[name.lower()] = value.strip('"')
+    return result
+
+
+class HTTPCache:
+    """On-disk cache of upstream HTTP responses with LRU eviction
+
+    Responses are stored in an SQLite database by a key, which should include
+    the request URL and everything else affecting the response, and keys are
+    hashed not to store credentials. Freshness lifetime follows upstream
+    Cache-Control and Expires headers and defaults to the given TTL. Stale
+    entries with ETag or Last-Modified are revalidated with conditional
+    requests. Least recently used entries are evicted when the total size of
+    content exceeds max_size bytes."""
+
+    def __init__(self, path, *, max_size, ttl):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl.total_seconds()
+
+        self._local = local()
+
+        # The cache is created before worker processes are forked, and SQLite
+        # connections can't be used across fork, so this one is closed.
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                conn.execute("PRAGMA journal_mode = WAL")
+                conn.executescript(SCHEMA)
+                self._size = conn.execute("SELECT coalesce(sum(size), 0) FROM entry").fetchone()[0]
+        finally:
+            conn.close()
+
+    def _connection(self):
+        # Connections are per-thread and per-process, as a forked process
+        # inherits connections of the thread which forked it
+        pid = os.getpid()
+        if getattr(self._local, "pid", None) != pid:
+            self._local.conn = sqlite3.connect(self.path, timeout=30)
+            self._local.conn.execute("PRAGMA synchronous = NORMAL")
+            self._local.pid = pid
+        return self._local.conn
+
+    def _key(self, key):
+        return sha256(key.encode("utf-8")).hexdigest()
+
+    def _lifetime(self, headers):
+        cc = cache_control(headers)
+        if "no-store" in cc:
+            return None
+        if "no-cache" in cc:
+            return 0
+        for directive in ("s-maxage", "max-age"):
+            if directive in cc:
+                try:
+                    return max(int(cc[directive]), 0)
+                except ValueError:
+                    return 0
+        if (expires := headers.get("Expires")) is not None:
+            try:
+                return max(parsedate_to_datetime(expires).timestamp() - time(), 0)
+            except (TypeError, ValueError):
+                return 0
+        return self.ttl
+
+    def get(self, key):
+        hkey = self._key(key)
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT status_code, content, content_type, etag, last_modified, expires, "
+                "accessed FROM entry WHERE key = ?",
+                (hkey,),
+            ).fetchone()
+            if row is None:
+                return None
+            *row, accessed = row
+            if (now := time()) - accessed > ACCESSED_RESOLUTION:
+                conn.execute("UPDATE entry SET accessed = ? WHERE key = ?", (now, hkey))
+        return CacheEntry(*row)
+
+    def put(self, key, status_code, content, headers):
+        """Store a response if upstream allows it and return it as an entry"""
+
+        lifetime = self._lifetime(headers)
+        now = time()
+        entry = CacheEntry(
+            status_code=status_code,
+            content=content,
+            content_type=headers.get("Content-Type"),
+            etag=headers.get("ETag"),
+            last_modified=headers.get("Last-Modified"),
+            expires=now + (lifetime or 0),
+        )
+
+        # Entries which can't be revalidated are useless once expired
+        if lifetime is None or (lifetime == 0 and entry.validators() == {}):
+            return entry
+
+        size = len(content)
+        if size > self.max_size:
+            return entry
+
+        hkey = self._key(key)
+        with self._connection() as conn:
+            # Replaced entries don't add their size
+            replaced = conn.execute("SELECT size FROM entry WHERE key = ?", (hkey,)).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO entry "
+                "(key, status_code, content, content_type, etag, last_modified, expires, "
+                "accessed, size) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (hkey, *entry, now, size),
+            )
+
+        self._size += size - (replaced[0] if replaced is not None else 0)
+        if self._size > self.max_size:
+            self.evict()
+        return entry
+
+    def revalidate(self, key, entry, headers):
+        """Extend lifetime of an entry after 304 Not Modified response"""
+
+        lifetime = self._lifetime(headers)
+        entry = entry._replace(
+            etag=headers.get("ETag", entry.etag),
+            last_modified=headers.get("Last-Modified", entry.last_modified),
+            expires=time() + (lifetime or 0),
+        )
+
+        with self._connection() as conn:
+            if lifetime is None:
+                conn.execute("DELETE FROM entry WHERE key = ?", (self._key(key),))
+            else:
+                conn.execute(
+                    "UPDATE entry SET etag = ?, last_modified = ?, expires = ? WHERE key = ?",
+                    (entry.etag, entry.last_modified, entry.expires, self._key(key)),
+                )
+        return entry
+
+    def evict(self):
+        """Delete least recently used entries to fit into 90% of max_size"""
+
+        with self._connection() as conn:
+            conn.execute(
+                "DELETE FROM entry WHERE key IN ("
+                "SELECT key FROM ("
+                "SELECT key, sum(size) OVER (ORDER BY accessed DESC, key) AS total FROM entry"
+                ") WHERE total > ?)",
+                (self.max_size * 0.9,),
+            )
+            self._size = conn.execute("SELECT coalesce(sum(size), 0) FROM entry").fetchone()[0]
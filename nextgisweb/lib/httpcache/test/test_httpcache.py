@@ -0,0 +1,72 @@
+from datetime import timedelta
+
+import pytest
+
+from .. import HTTPCache, cache_key, cacheable_response
+
+
+@pytest.fixture()
+def cache(tmp_path):
+    yield HTTPCache(str(tmp_path / "cache.sqlite"), max_size=100, ttl=timedelta(hours=1))
+
+
+def test_freshness(cache):
+    assert cache.get("a") is None
+
+    cache.put("a", 200, b"data", {"Content-Type": "image/png"})
+    entry = cache.get("a")
+    assert entry.status_code == 200 and entry.content == b"data"
+    assert entry.content_type == "image/png"
+    assert entry.fresh
+
+    cache.put("b", 200, b"data", {"Cache-Control": "no-store"})
+    assert cache.get("b") is None
+
+    cache.put("c", 200, b"data", {"Cache-Control": "max-age=0"})
+    assert cache.get("c") is None
+
+    cache.put("d", 200, b"data", {"Cache-Control": "no-cache", "ETag": '"v1"'})
+    entry = cache.get("d")
+    assert not entry.fresh
+    assert entry.validators() == {"If-None-Match": '"v1"'}
+
+    entry = cache.revalidate("d", entry, {"Cache-Control": "max-age=60"})
+    assert entry.fresh
+    assert cache.get("d").fresh
+
+
+def test_eviction(cache, monkeypatch):
+    # Update access time on each hit
+    monkeypatch.setattr("nextgisweb.lib.httpcache.ACCESSED_RESOLUTION", -1)
+
+    for key in ("a", "b", "c"):
+        cache.put(key, 200, b"x" * 30, {})
+    cache.put("c", 200, b"x" * 30, {})
+    assert cache._size == 90
+
+    cache.get("a")
+    cache.put("d", 200, b"x" * 30, {})
+
+    assert cache.get("b") is None
+    for key in ("a", "c", "d"):
+        assert cache.get(key) is not None
+
+    cache.put("e", 200, b"x" * 200, {})
+    assert cache.get("e") is None
+
+
+def test_cacheable_response():
+    assert cacheable_response(200, {"Content-Type": "image/png"})
+    assert cacheable_response(204, {})
+    assert cacheable_response(404, {"Content-Type": "text/html"})
+    assert not cacheable_response(200, {"Content-Type": "text/xml"})
+    assert not cacheable_response(200, {})
+    assert not cacheable_response(500, {"Content-Type": "image/png"})
+
+
+def test_cache_key():
+    url = "http://example.com/tile"
+    assert cache_key(url) != cache_key(url, username="user", password="a")
+    assert cache_key(url, username="user", password="a") != cache_key(
+        url, username="user", password="b"
+    )
@@ -0,0 +1,65 @@
+from collections import OrderedDict
+from threading import Lock
+
+from requests import Session
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class SessionPool:
+    """Keep-alive HTTP sessions shared between requests to the same upstream
+
+    Sessions are kept by a caller-provided key, usually a connection resource
+    ID, so cookies never leak between connections. A None key, e.g. the ID of
+    a connection which isn't flushed yet, gets a new session which isn't kept.
+    Each session has a bounded connection pool and retries idempotent requests
+    failed due to connection errors or gateway responses with exponential
+    backoff. Least recently used sessions are dropped when there are more than
+    max_sessions of them."""
+
+    def __init__(self, *, headers, pool_size, retries, backoff_factor=0.3, max_sessions=256):
+        self.headers = headers
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.max_sessions = max_sessions
+
+        self._sessions = OrderedDict()
+        self._lock = Lock()
+
+    def _create(self):
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_size,
+            pool_maxsize=self.pool_size,
+            max_retries=Retry(
+                total=self.retries,
+                backoff_factor=self.backoff_factor,
+                status_forcelist=(502, 503, 504),
+                raise_on_status=False,
+            ),
+        )
+
+        session = Session()
+        session.headers.update(self.headers)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def session(self, key):
+        if key is None:
+            return self._create()
+
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._sessions[key] = self._create()
+                # Evicted sessions aren't closed as they may be in use, their
+                # connections are closed on garbage collection
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            else:
+                self._sessions.move_to_end(key)
+            return session
+
+    def __len__(self):
+        return len(self._sessions)
@@ -39,3 +39,6 @@ def dumps(data, *a, **kw):
 
 
 loadb = loads = orjson.loads
+
+# Pre-encoded JSON which is inserted into the output of dumpb as is
+Fragment = orjson.Fragment
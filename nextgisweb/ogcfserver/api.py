@@ -8,7 +8,12 @@ from shapely.geometry import box
 from nextgisweb.lib.geometry import Geometry
 
 import nextgisweb.feature_layer.api as feature_layer_api
-from nextgisweb.feature_layer import Feature, IWritableFeatureLayer
+from nextgisweb.feature_layer import (
+    Feature,
+    IFeatureQueryKeyset,
+    IWritableFeatureLayer,
+    feature_batches,
+)
 from nextgisweb.feature_layer.api import query_feature_or_not_found, versioning
 from nextgisweb.pyramid import JSONType
 from nextgisweb.resource import DataScope, ResourceFactory, ServiceScope
@@ -84,10 +89,13 @@ def dumper_factory(
 
 
 def feature_to_ogc(dumper: feature_layer_api.Dumper, feature: Feature):
-    data = dumper(feature)
+    return item_to_ogc(dumper(feature))
+
+
+def item_to_ogc(data):
     return dict(
         type="Feature",
-        id=feature.id,
+        id=data["id"],
         geometry=data["geom"],
         properties=data["fields"],
     )
@@ -217,35 +225,53 @@ def items(resource, request) -> JSONType:
                 else 10
             )
             offset = int(request.GET.get("offset", 0))
+            cursor = request.GET.get("cursor")
 
             dumper = dumper_factory(c.resource)
             query = dumper.feature_query()
             query.limit(limit, offset)
 
+            keyset = IFeatureQueryKeyset.providedBy(query)
+            if keyset and cursor is not None:
+                query.keyset(feature_layer_api.decode_cursor(cursor, 1))
+
             bbox = request.GET.get("bbox")
             if bbox is not None:
                 box_coords = map(float, bbox.split(",")[:4])
                 box_geom = Geometry.from_shape(box(*box_coords), srid=4326, validate=False)
                 query.intersects(box_geom)
 
-            features = [feature_to_ogc(dumper, feature) for feature in query()]
+            features = []
+            batch_size = request.env.feature_layer.options["stream.batch_size"]
+            for batch in feature_batches(query, batch_size):
+                features.extend(item_to_ogc(item) for item in dumper.dump_batch(batch))
 
-            items = dict(
-                type="FeatureCollection",
-                features=features,
-                timeStamp=datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
-                links=[
-                    {
-                        "rel": "self",
-                        "type": "application/json",
-                        "title": "This document",
-                        "href": request.route_url(
-                            "ogcfserver.items",
-                            id=resource.id,
-                            collection_id=collection_id,
-                            _query=request.params,
-                        ),
-                    },
+            links = [
+                {
+                    "rel": "self",
+                    "type": "application/json",
+                    "title": "This document",
+                    "href": request.route_url(
+                        "ogcfserver.items",
+                        id=resource.id,
+                        collection_id=collection_id,
+                        _query=request.params,
+                    ),
+                },
+            ]
+
+            if not keyset:
+                next_query = {**request.params, "offset": limit + offset}
+            elif len(features) == limit > 0:
+                # Deep pages are requested by a cursor instead of offset
+                next_query = {k: v for k, v in request.params.items() if k != "offset"}
+                last = batch.feature(len(batch) - 1)
+                next_query["cursor"] = feature_layer_api.feature_cursor(last, ())
+            else:
+                next_query = None
+
+            if next_query is not None:
+                links.append(
                     {
                         "rel": "next",
                         "type": "application/geo+json",
@@ -254,20 +280,29 @@ def items(resource, request) -> JSONType:
                             "ogcfserver.items",
                             id=resource.id,
                             collection_id=collection_id,
-                            _query={**request.params, "offset": limit + offset},
-                        ),
-                    },
-                    {
-                        "rel": "collection",
-                        "type": "application/json",
-                        "title": c.display_name,
-                        "href": request.route_url(
-                            "ogcfserver.collection",
-                            id=resource.id,
-                            collection_id=collection_id,
+                            _query=next_query,
                         ),
-                    },
-                ],
+                    }
+                )
+
+            links.append(
+                {
+                    "rel": "collection",
+                    "type": "application/json",
+                    "title": c.display_name,
+                    "href": request.route_url(
+                        "ogcfserver.collection",
+                        id=resource.id,
+                        collection_id=collection_id,
+                    ),
+                }
+            )
+
+            items = dict(
+                type="FeatureCollection",
+                features=features,
+                timeStamp=datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+                links=links,
             )
             return items
     return HTTPNotFound()
@@ -373,6 +408,17 @@ _PARAM_OFFSET = {
     },
 }
 
+_PARAM_CURSOR = {
+    "name": "cursor",
+    "in": "query",
+    "description": "The optional cursor parameter indicates the position in the result set after "
+    "which the server shall begin presenting results. It is provided by the next link.",
+    "required": False,
+    "style": "form",
+    "explode": False,
+    "schema": {"type": "string"},
+}
+
 _PARAM_BBOX = {
     "name": "bbox",
     "in": "query",
@@ -456,7 +502,7 @@ def openapi(resource, request) -> JSONType:
             "200": {"description": "successful operation"},
             "default": {"description": "unexpected error"},
         },
-        "parameters": {"offset": _PARAM_OFFSET, "bbox": _PARAM_BBOX},
+        "parameters": {"offset": _PARAM_OFFSET, "cursor": _PARAM_CURSOR, "bbox": _PARAM_BBOX},
     }
 
     for c in resource.collections:
@@ -481,6 +527,7 @@ def openapi(resource, request) -> JSONType:
                 "operationId": f"get{c.keyname}Features",
                 "parameters": [
                     {"$ref": "#/components/parameters/offset"},
+                    {"$ref": "#/components/parameters/cursor"},
                     {"$ref": "#/components/parameters/bbox"},
                     {"$ref": f"{ogcapi_yaml_url}#/components/parameters/limit"},
                 ],
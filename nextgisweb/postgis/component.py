@@ -8,6 +8,7 @@ class PostgisComponent(Component):
     def initialize(self):
         super().initialize()
         self._engine = dict()
+        self._table_stats = dict()
 
     @require("feature_layer")
     def setup_pyramid(self, config):
@@ -16,7 +17,11 @@ class PostgisComponent(Component):
         api.setup_pyramid(self, config)
         view.setup_pyramid(self, config)
 
+    # fmt: off
     option_annotations = (
         Option("connect_timeout", timedelta, default=timedelta(seconds=15)),
         Option("statement_timeout", timedelta, default=timedelta(seconds=15)),
+        Option("introspection.ttl", timedelta, default=timedelta(minutes=5), doc="Lifetime of cached metadata of layer tables."),
+        Option("estimate.threshold", int, default=0, doc="Estimated row count starting from which layer extents are taken from table statistics, 0 disables it.")
     )
+    # fmt: on
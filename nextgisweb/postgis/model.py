@@ -1,6 +1,7 @@
 import re
 from contextlib import contextmanager
-from typing import Literal, Union
+from time import monotonic
+from typing import Any, Dict, Literal, NamedTuple, Tuple, Union
 
 import sqlalchemy as sa
 import sqlalchemy.event as sa_event
@@ -19,6 +20,7 @@ from zope.interface import implementer
 from nextgisweb.env import Base, env, gettext
 from nextgisweb.lib import saext
 from nextgisweb.lib.geometry import Geometry
+from nextgisweb.lib.json import loadb
 from nextgisweb.lib.logging import logger
 
 from nextgisweb.core.exception import ForbiddenError, ValidationError
@@ -27,19 +29,32 @@ from nextgisweb.feature_layer import (
     FIELD_TYPE,
     GEOM_TYPE,
     Feature,
+    FeatureBatch,
     FeatureQueryIntersectsMixin,
     FeatureSet,
     IFeatureLayer,
     IFeatureQuery,
+    IFeatureQueryBatch,
+    IFeatureQueryClipByBox,
     IFeatureQueryFilter,
     IFeatureQueryFilterBy,
+    IFeatureQueryFilterExpr,
+    IFeatureQueryGeoJSON,
     IFeatureQueryIlike,
     IFeatureQueryIntersects,
+    IFeatureQueryKeyset,
     IFeatureQueryLike,
+    IFeatureQueryMVT,
     IFeatureQueryOrderBy,
+    IFeatureQuerySimplify,
+    IFeatureQueryStream,
     IWritableFeatureLayer,
     LayerField,
     LayerFieldsMixin,
+    filter_expr_condition,
+    keyset_condition,
+    mvt_cache_invalidation,
+    mvt_query,
 )
 from nextgisweb.layer import IBboxLayer, SpatialLayerMixin
 from nextgisweb.resource import (
@@ -120,6 +135,14 @@ def calculate_extent(layer, where=None, geomcol=None):
     return extent
 
 
+class TableStats(NamedTuple):
+    key: Tuple[Any, ...]
+    expires: float
+    geometry_constrained: bool
+    row_estimate: Union[int, None]
+    extent: Union[Dict[str, float], None]
+
+
 class PostgisConnection(Base, Resource):
     identity = "postgis_connection"
     cls_display_name = gettext("PostGIS connection")
@@ -282,6 +305,8 @@ class PostgisLayer(Base, Resource, SpatialLayerMixin, LayerFieldsMixin):
 
         self.feature_label_field = None
 
+        env.postgis._table_stats.pop(self.id, None)
+
         with self.connection.get_connection() as conn:
             inspector = sa.inspect(conn.engine)
             try:
@@ -410,6 +435,92 @@ class PostgisLayer(Base, Resource, SpatialLayerMixin, LayerFieldsMixin):
                     gettext("Column '%(column)s' not found!") % dict(column=self.column_geom)
                 )
 
+    def table_stats(self):
+        """Remote table metadata cached for the postgis.introspection.ttl
+
+        The geometry column is constrained if its type and dimension are
+        enforced by a typmod or CHECK constraints, so the geometry type
+        predicate isn't needed. The row estimate and the estimated extent come
+        from table statistics and are None if the table hasn't been analyzed.
+        The extent is estimated for tables larger than the
+        postgis.estimate.threshold only, it's used for the layer extent. Feature
+        counts and extents of feature queries are always exact."""
+
+        comp = env.postgis
+        key = (
+            self.connection_id,
+            self.schema,
+            self.table,
+            self.column_geom,
+            self.geometry_type,
+            self.geometry_srid,
+        )
+
+        stats = comp._table_stats.get(self.id)
+        if stats is not None and stats.key == key and stats.expires > monotonic():
+            return stats
+
+        with self.connection.get_connection() as conn:
+            # fmt: off
+            row = conn.execute(text(
+                """SELECT type, coord_dimension FROM geometry_columns
+                WHERE f_table_schema = :s
+                    AND f_table_name = :t
+                    AND f_geometry_column = :column
+            """), dict(s=self.schema, t=self.table, column=self.column_geom)).first()
+
+            reltuples = conn.execute(text(
+                """SELECT c.reltuples FROM pg_class c
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE n.nspname = :s AND c.relname = :t
+            """), dict(s=self.schema, t=self.table)).scalar()
+            # fmt: on
+
+            geometry_constrained = False
+            # Types of XYZM columns have no suffix, so only 2D and 3D columns
+            # are matched against the layer geometry type
+            if row is not None and row.type != "GEOMETRY" and row.coord_dimension in (2, 3):
+                tab_geom_type = row.type + ("Z" if row.coord_dimension == 3 else "")
+                geometry_constrained = tab_geom_type == self.geometry_type
+
+            # Never analyzed tables have reltuples equal to -1 or 0
+            row_estimate = int(reltuples) if reltuples is not None and reltuples > 0 else None
+
+            extent = None
+            threshold = comp.options["estimate.threshold"]
+            if threshold > 0 and row_estimate is not None and row_estimate >= threshold:
+                bbox = st_transform(
+                    st_setsrid(
+                        func.st_estimatedextent(self.schema, self.table, self.column_geom),
+                        self.geometry_srid,
+                    ),
+                    4326,
+                )
+                try:
+                    minLon, minLat, maxLon, maxLat = conn.execute(
+                        select(st_xmin(bbox), st_ymin(bbox), st_xmax(bbox), st_ymax(bbox))
+                    ).first()
+                except SQLAlchemyError:
+                    logger.warning(
+                        "Failed to estimate extent of %s.%s",
+                        self.schema,
+                        self.table,
+                        exc_info=True,
+                    )
+                else:
+                    if minLon is not None:
+                        extent = dict(minLon=minLon, maxLon=maxLon, minLat=minLat, maxLat=maxLat)
+
+        stats = TableStats(
+            key=key,
+            expires=monotonic() + comp.options["introspection.ttl"].total_seconds(),
+            geometry_constrained=geometry_constrained,
+            row_estimate=row_estimate,
+            extent=extent,
+        )
+        comp._table_stats[self.id] = stats
+        return stats
+
     def get_info(self):
         return super().get_info() + (
             (
@@ -471,6 +582,7 @@ class PostgisLayer(Base, Resource, SpatialLayerMixin, LayerFieldsMixin):
 
         return values
 
+    @mvt_cache_invalidation
     def feature_put(self, feature):
         """Update existing object
 
@@ -484,6 +596,7 @@ class PostgisLayer(Base, Resource, SpatialLayerMixin, LayerFieldsMixin):
         with self.connection.get_connection() as conn:
             conn.execute(stmt)
 
+    @mvt_cache_invalidation
     def feature_create(self, feature):
         """Insert new object to DB which is described in feature
 
@@ -499,6 +612,7 @@ class PostgisLayer(Base, Resource, SpatialLayerMixin, LayerFieldsMixin):
         with self.connection.get_connection() as conn:
             return conn.execute(stmt).scalar()
 
+    @mvt_cache_invalidation
     def feature_delete(self, feature_id):
         """Remove record with id
 
@@ -512,6 +626,7 @@ class PostgisLayer(Base, Resource, SpatialLayerMixin, LayerFieldsMixin):
         with self.connection.get_connection() as conn:
             conn.execute(stmt)
 
+    @mvt_cache_invalidation
     def feature_delete_all(self):
         """Remove all records from a layer"""
         tab = self._sa_table()
@@ -523,6 +638,11 @@ class PostgisLayer(Base, Resource, SpatialLayerMixin, LayerFieldsMixin):
     # IBboxLayer
     @property
     def extent(self):
+        # Layer extents are approximate anyway, so large tables can do with
+        # statistics instead of a full scan
+        stats = self.table_stats()
+        if stats.extent is not None:
+            return stats.extent
         return calculate_extent(self)
 
 
@@ -569,10 +689,18 @@ class PostgisLayerSerializer(Serializer, resource=PostgisLayer):
     IFeatureQuery,
     IFeatureQueryFilter,
     IFeatureQueryFilterBy,
+    IFeatureQueryFilterExpr,
+    IFeatureQueryGeoJSON,
     IFeatureQueryLike,
     IFeatureQueryIlike,
     IFeatureQueryIntersects,
     IFeatureQueryOrderBy,
+    IFeatureQueryClipByBox,
+    IFeatureQuerySimplify,
+    IFeatureQueryMVT,
+    IFeatureQueryStream,
+    IFeatureQueryKeyset,
+    IFeatureQueryBatch,
 )
 class FeatureQueryBase(FeatureQueryIntersectsMixin):
     def __init__(self):
@@ -581,6 +709,9 @@ class FeatureQueryBase(FeatureQueryIntersectsMixin):
         self._srs = None
         self._geom = None
         self._geom_format = "WKB"
+        self._geom_precision = None
+        self._clip_by_box = None
+        self._simplify = None
         self._box = None
 
         self._fields = None
@@ -589,11 +720,15 @@ class FeatureQueryBase(FeatureQueryIntersectsMixin):
 
         self._filter = None
         self._filter_by = None
+        self._filter_expr = None
         self._like = None
         self._ilike = None
 
         self._order_by = None
 
+        self._stream = None
+        self._keyset = None
+
     def srs(self, srs):
         self._srs = srs
 
@@ -603,6 +738,15 @@ class FeatureQueryBase(FeatureQueryIntersectsMixin):
     def geom_format(self, geom_format):
         self._geom_format = geom_format
 
+    def geom_precision(self, digits):
+        self._geom_precision = digits
+
+    def clip_by_box(self, box):
+        self._clip_by_box = box
+
+    def simplify(self, tolerance):
+        self._simplify = tolerance
+
     def box(self):
         self._box = True
 
@@ -619,6 +763,9 @@ class FeatureQueryBase(FeatureQueryIntersectsMixin):
     def filter_by(self, **kwargs):
         self._filter_by = kwargs
 
+    def filter_expr(self, expr):
+        self._filter_expr = expr
+
     def order_by(self, *args):
         self._order_by = args
 
@@ -628,6 +775,12 @@ class FeatureQueryBase(FeatureQueryIntersectsMixin):
     def ilike(self, value):
         self._ilike = value
 
+    def stream(self, batch_size):
+        self._stream = batch_size
+
+    def keyset(self, key):
+        self._keyset = key
+
     def __call__(self):
         tab = alias(self.layer._sa_table(True), name="tab")
 
@@ -644,20 +797,39 @@ class FeatureQueryBase(FeatureQueryIntersectsMixin):
         else:
             geomexpr = geomcol
 
+        if self._clip_by_box is not None:
+            clip = st_setsrid(
+                func.st_makeenvelope(*self._clip_by_box.bounds),
+                self._clip_by_box.srid,
+            )
+            geomexpr = func.st_clipbybox2d(geomexpr, clip)
+
+        if self._simplify is not None:
+            geomexpr = func.st_simplifypreservetopology(geomexpr, self._simplify)
+
+        # Geometry expression before serialization for MVT encoding
+        geomtile = geomexpr
+
         if self._geom:
             if self._geom_format == "WKB":
                 geomexpr = func.st_asbinary(geomexpr, "NDR")
+            elif self._geom_format == "GeoJSON":
+                precision = 9 if self._geom_precision is None else self._geom_precision
+                geomexpr = func.st_asgeojson(geomexpr, precision, 0)
             else:
                 geomexpr = func.st_astext(geomexpr)
 
             columns.append(geomexpr.label("geom"))
 
         selected_fields = []
+        selected_columns = []
         for idx, fld in enumerate(self.layer.fields):
             if self._fields is None or fld.keyname in self._fields:
                 label = f"fld_{idx}"
-                columns.append(getattr(tab.columns, fld.column_name).label(label))
+                fld_c = getattr(tab.columns, fld.column_name)
+                columns.append(fld_c.label(label))
                 selected_fields.append((fld.keyname, label))
+                selected_columns.append(fld_c.label(fld.keyname))
 
         if self._filter_by:
             for k, v in self._filter_by.items():
@@ -711,6 +883,19 @@ class FeatureQueryBase(FeatureQueryIntersectsMixin):
             if len(_where_filter) > 0:
                 where.append(sa.and_(*_where_filter))
 
+        if self._filter_expr is not None:
+            where.append(
+                filter_expr_condition(
+                    self._filter_expr,
+                    idcol=idcol,
+                    fields={
+                        fld.keyname: tab.columns[fld.column_name] for fld in self.layer.fields
+                    },
+                    geomcol=geomcol,
+                    srid=self.layer.geometry_srid,
+                )
+            )
+
         if self._like or self._ilike:
             operands = [
                 cast(tab.columns[fld.column_name], sa.Unicode)
@@ -745,38 +930,43 @@ class FeatureQueryBase(FeatureQueryIntersectsMixin):
         if self._box:
             columns.extend(
                 (
-                    st_xmin(geomexpr).label("box_left"),
-                    st_ymin(geomexpr).label("box_bottom"),
-                    st_xmax(geomexpr).label("box_right"),
-                    st_ymax(geomexpr).label("box_top"),
+                    st_xmin(geomtile).label("box_left"),
+                    st_ymin(geomtile).label("box_bottom"),
+                    st_xmax(geomtile).label("box_right"),
+                    st_ymax(geomtile).label("box_top"),
                 )
             )
 
-        gt = self.layer.geometry_type
-        if gt in GEOM_TYPE.has_z:
-            gt = re.sub(r"Z$", "", gt)
-            ndims = 3
-        else:
-            ndims = 2
-
-        where.append(
-            sql_or(
-                geomcol.is_(None),
-                sql_and(
-                    func.geometrytype(geomcol) == text(f"'{gt}'"),
-                    func.st_ndims(geomcol) == text(str(ndims)),
-                ),
+        # Skip per-row geometry type checks if the column is constrained
+        if not self.layer.table_stats().geometry_constrained:
+            gt = self.layer.geometry_type
+            if gt in GEOM_TYPE.has_z:
+                gt = re.sub(r"Z$", "", gt)
+                ndims = 3
+            else:
+                ndims = 2
+
+            where.append(
+                sql_or(
+                    geomcol.is_(None),
+                    sql_and(
+                        func.geometrytype(geomcol) == text(f"'{gt}'"),
+                        func.st_ndims(geomcol) == text(str(ndims)),
+                    ),
+                )
             )
-        )
 
         order_criterion = []
+        order_keys = []
         if self._order_by:
             for order, k in self._order_by:
                 field = self.layer.field_by_keyname(k)
                 order_criterion.append(
                     dict(asc=sa.asc, desc=sa.desc)[order](tab.columns[field.column_name])
                 )
+                order_keys.append((order, tab.columns[field.column_name]))
         order_criterion.append(idcol)
+        order_keys.append(("asc", idcol))
 
         class QueryFeatureSet(FeatureSet):
             layer = self.layer
@@ -787,8 +977,10 @@ class FeatureQueryBase(FeatureQueryIntersectsMixin):
             _fields = self._fields
             _limit = self._limit
             _offset = self._offset
+            _stream = self._stream
+            _keyset = self._keyset
 
-            def __iter__(self):
+            def _query(self):
                 query = (
                     sql.select(*columns)
                     .limit(self._limit)
@@ -799,6 +991,18 @@ class FeatureQueryBase(FeatureQueryIntersectsMixin):
                 if len(where) > 0:
                     query = query.where(sa.and_(*where))
 
+                if self._keyset is not None:
+                    query = query.where(keyset_condition(order_keys, self._keyset))
+
+                return query
+
+            def __iter__(self):
+                query = self._query()
+                if self._stream:
+                    query = query.execution_options(
+                        stream_results=True, max_row_buffer=self._stream
+                    )
+
                 with self.layer.connection.get_connection() as conn:
                     result = conn.execute(query)
                     for row in result.mappings():
@@ -811,6 +1015,8 @@ class FeatureQueryBase(FeatureQueryIntersectsMixin):
                                 geom = Geometry.from_wkb(geom_data.tobytes(), validate=False)
                             elif self._geom_format == "WKT":
                                 geom = Geometry.from_wkt(geom_data, validate=False)
+                            elif self._geom_format == "GeoJSON":
+                                geom = Geometry.from_geojson(loadb(geom_data), validate=False)
                             else:
                                 raise NotImplementedError
                         else:
@@ -829,6 +1035,22 @@ class FeatureQueryBase(FeatureQueryIntersectsMixin):
                             box=_box,
                         )
 
+            def batches(self, size):
+                query = self._query().execution_options(stream_results=True, max_row_buffer=size)
+                with self.layer.connection.get_connection() as conn:
+                    result = conn.execute(query)
+                    keys = list(result.keys())
+                    while rows := result.fetchmany(size):
+                        yield FeatureBatch.from_rows(
+                            self.layer,
+                            keys,
+                            rows,
+                            fid="id",
+                            geom="geom" if self._geom else None,
+                            geom_format=self._geom_format,
+                            fields=selected_fields,
+                        )
+
             @property
             def total_count(self):
                 with self.layer.connection.get_connection() as conn:
@@ -842,4 +1064,18 @@ class FeatureQueryBase(FeatureQueryIntersectsMixin):
             def extent(self):
                 return calculate_extent(self.layer, where, geomcol)
 
+            def mvt(self, bounds, *, name, extent, buffer):
+                query = mvt_query(
+                    idcol,
+                    geomtile,
+                    selected_columns,
+                    where,
+                    bounds,
+                    name=name,
+                    extent=extent,
+                    buffer=buffer,
+                )
+                with self.layer.connection.get_connection() as conn:
+                    return bytes(conn.execute(query).scalar() or b"")
+
         return QueryFeatureSet()
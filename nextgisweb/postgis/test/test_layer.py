@@ -0,0 +1,66 @@
+import json
+
+import pytest
+import sqlalchemy as sa
+from osgeo import ogr
+
+from . import create_feature_layer
+
+pytestmark = pytest.mark.usefixtures("ngw_resource_defaults", "ngw_auth_administrator")
+
+geojson = {
+    "type": "FeatureCollection",
+    "crs": {"type": "name", "properties": {"name": "urn:ogc:def:crs:EPSG::3857"}},
+    "features": [
+        {
+            "type": "Feature",
+            "properties": {"name": "feature1"},
+            "geometry": {"type": "Point", "coordinates": [0, 0]},
+        },
+        {
+            "type": "Feature",
+            "properties": {"name": "feature2"},
+            "geometry": {"type": "Point", "coordinates": [10, 10]},
+        },
+    ],
+}
+
+
+def test_table_stats(ngw_env, ngw_resource_group_sub):
+    ds = ogr.Open(json.dumps(geojson))
+    ogrlayer = ds.GetLayer(0)
+
+    with create_feature_layer(ogrlayer, ngw_resource_group_sub) as layer:
+        stats = layer.table_stats()
+        assert stats.geometry_constrained
+        assert layer.table_stats() is stats
+
+        query = str(layer.feature_query()()._query())
+        assert "geometrytype" not in query
+
+        with layer.connection.get_connection() as conn:
+            tab = f'"{layer.schema}"."{layer.table}"'
+            conn.execute(sa.text(f"ANALYZE {tab}"))
+            conn.commit()
+
+        with ngw_env.postgis.options.override({"estimate.threshold": 1}):
+            ngw_env.postgis._table_stats.pop(layer.id)
+            stats = layer.table_stats()
+            assert stats.row_estimate == 2
+            assert stats.extent["minLon"] == pytest.approx(0, abs=1e-3)
+            assert stats.extent["maxLat"] == pytest.approx(10 / 111319.49, abs=1e-3)
+            assert layer.extent == stats.extent
+
+            # Estimates never replace exact answers of feature queries
+            with layer.connection.get_connection() as conn:
+                conn.execute(sa.text(f"DELETE FROM {tab} WHERE name = 'feature2'"))
+                conn.commit()
+            result = layer.feature_query()()
+            assert result.total_count == 1
+            assert result.extent["maxLat"] == pytest.approx(0, abs=1e-6)
+
+        # Estimates are disabled by default
+        ngw_env.postgis._table_stats.pop(layer.id)
+        assert layer.table_stats().extent is None
+        assert layer.extent["maxLat"] == pytest.approx(0, abs=1e-6)
+        ngw_env.postgis._table_stats.pop(layer.id)
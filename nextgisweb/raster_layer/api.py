@@ -3,9 +3,11 @@ import tempfile
 from io import DEFAULT_BUFFER_SIZE
 from typing import List, Literal, Union
 
-from msgspec import Meta, Struct
+from msgspec import Meta, Struct, convert
+from msgspec import ValidationError as MsgSpecValidationError
 from osgeo import gdal
 from pyramid.response import FileIter, FileResponse, Response
+from sqlalchemy.orm.exc import NoResultFound
 from typing_extensions import Annotated
 
 from nextgisweb.env import env, gettext
@@ -13,7 +15,8 @@ from nextgisweb.lib.apitype import AnyOf, ContentType, Query, StatusCode
 
 from nextgisweb.core.exception import ValidationError
 from nextgisweb.pyramid.util import set_output_buffering
-from nextgisweb.resource import DataScope, ResourceFactory
+from nextgisweb.resource import DataScope, ExportJobKind, ExportJobResult, ResourceFactory
+from nextgisweb.resource.exception import ResourceNotFound
 from nextgisweb.spatial_ref_sys import SRS
 
 from .gdaldriver import EXPORT_FORMAT_GDAL
@@ -60,57 +63,108 @@ class RangeFileWrapper(FileIter):
         return data
 
 
-def export(
-    resource,
-    request,
-    *,
-    export_params: Annotated[ExportParams, Query(spread=True)],
-) -> ExportResponse:  # type: ignore
-    request.resource_permission(DataScope.read)
-
+def _export(resource, export_params, filepath, progress=None):
     srs = (
         SRS.filter_by(id=export_params.srs).one()
         if export_params.srs is not None
         else resource.srs
     )
     bands = export_params.bands
-    format = export_params.format
+    driver = EXPORT_FORMAT_GDAL[export_params.format]
 
-    driver = EXPORT_FORMAT_GDAL[format]
+    callback = None
+    if progress is not None:
 
-    filename = "%d.%s" % (
-        resource.id,
-        driver.extension,
-    )
-    content_disposition = "attachment; filename=%s" % filename
+        def callback(complete, message, user_data):
+            progress(complete)
+            return 1
 
     def _warp(source_filename):
-        with tempfile.NamedTemporaryFile(suffix=".%s" % driver.extension) as tmp_file:
-            try:
-                gdal.UseExceptions()
-                gdal.Warp(
-                    tmp_file.name,
-                    source_filename,
-                    options=gdal.WarpOptions(
-                        format=driver.name, dstSRS=srs.wkt, creationOptions=driver.options
-                    ),
-                )
-            except RuntimeError as e:
-                raise ValidationError(str(e))
-            finally:
-                gdal.DontUseExceptions()
-
-            response = FileResponse(tmp_file.name, content_type=driver.mime)
-            response.content_disposition = content_disposition
-            return response
+        try:
+            gdal.UseExceptions()
+            gdal.Warp(
+                filepath,
+                source_filename,
+                options=gdal.WarpOptions(
+                    format=driver.name,
+                    dstSRS=srs.wkt,
+                    creationOptions=driver.options,
+                    callback=callback,
+                ),
+            )
+        except RuntimeError as e:
+            raise ValidationError(str(e))
+        finally:
+            gdal.DontUseExceptions()
 
     source_filename = env.raster_layer.workdir_path(resource.fileobj)
     if bands is not None and len(bands) != resource.band_count:
         with tempfile.NamedTemporaryFile(suffix=".tif") as tmp_file:
             gdal.Translate(tmp_file.name, str(source_filename), bandList=bands)
-            return _warp(tmp_file.name)
+            _warp(tmp_file.name)
     else:
-        return _warp(str(source_filename))
+        _warp(str(source_filename))
+
+
+def export(
+    resource,
+    request,
+    *,
+    export_params: Annotated[ExportParams, Query(spread=True)],
+) -> ExportResponse:  # type: ignore
+    request.resource_permission(DataScope.read)
+
+    driver = EXPORT_FORMAT_GDAL[export_params.format]
+
+    with tempfile.NamedTemporaryFile(suffix=".%s" % driver.extension) as tmp_file:
+        _export(resource, export_params, tmp_file.name)
+
+        response = FileResponse(tmp_file.name, content_type=driver.mime)
+        response.content_disposition = "attachment; filename=%d.%s" % (
+            resource.id,
+            driver.extension,
+        )
+        return response
+
+
+class RasterLayerExportJob(ExportJobKind):
+    """Export of a raster layer, which takes the resource ID in the 'resource'
+    parameter and the same parameters as the export API"""
+
+    identity = "raster_layer.export"
+
+    @classmethod
+    def prepare(cls, params, *, request):
+        params = dict(params)
+        if (resource_id := params.pop("resource", None)) is None:
+            raise ValidationError(message=gettext("Resource is not provided."))
+        try:
+            resource = RasterLayer.filter_by(id=resource_id).one()
+        except NoResultFound:
+            raise ResourceNotFound(resource_id)
+        request.resource_permission(DataScope.read, resource)
+
+        try:
+            export_params = convert(params, ExportParams)
+        except MsgSpecValidationError as exc:
+            raise ValidationError(message=str(exc))
+        if export_params.srs is not None and SRS.filter_by(id=export_params.srs).first() is None:
+            raise ValidationError(message=gettext("SRS (id=%d) not found.") % export_params.srs)
+
+        return [resource]
+
+    @classmethod
+    def run(cls, params, *, workdir, progress):
+        params = dict(params)
+        resource = RasterLayer.filter_by(id=params.pop("resource")).one()
+        export_params = convert(params, ExportParams)
+        driver = EXPORT_FORMAT_GDAL[export_params.format]
+
+        filename = "%d.%s" % (resource.id, driver.extension)
+        filepath = os.path.join(workdir, filename)
+        _export(resource, export_params, filepath, progress)
+
+        return ExportJobResult(filepath, filename, driver.mime or "application/octet-stream")
 
 
 def cog_head(
@@ -5,6 +5,7 @@ from nextgisweb.lib.logging import logger
 from .gdaldriver import GDAL_DRIVER_NAME_2_EXPORT_FORMATS
 from .kind_of_data import RasterLayerData
 from .model import RasterLayer, estimate_raster_layer_data
+from .util import DatasetCache
 from .workdir import WorkdirMixin
 
 
@@ -13,6 +14,7 @@ class RasterLayerComponent(Component, WorkdirMixin):
         self.env.core.mksdir(self)
         self.wdir = self.env.core.gtsdir(self)
         self.cog_enabled = self.options["cog_enabled"]
+        self.dataset_cache = DatasetCache(self.options["dataset_cache.size"])
 
     def setup_pyramid(self, config):
         from . import api, view
@@ -42,7 +44,10 @@ class RasterLayerComponent(Component, WorkdirMixin):
             size = estimate_raster_layer_data(resource)
             yield RasterLayerData, resource.id, size
 
+    # fmt: off
     option_annotations = (
         Option("cog_enabled", bool, default=True),
         Option("size_limit", SizeInBytes, default=None),
+        Option("dataset_cache.size", int, default=16, doc="Number of raster datasets kept open by each rendering thread."),
     )
+    # fmt: on
@@ -262,8 +262,15 @@ class RasterLayer(Base, Resource, SpatialLayerMixin):
         self.ysize = ds.RasterYSize
         self.band_count = ds.RasterCount
 
-    def gdal_dataset(self):
+    def gdal_dataset(self, *, cached=False):
+        """Open the raster as a read-only GDAL dataset
+
+        Cached datasets are shared by calls in the same thread, so they must
+        not be modified or used after leaving the thread."""
+
         fn = env.raster_layer.workdir_path(self.fileobj)
+        if cached:
+            return env.raster_layer.dataset_cache.open(fn)
         return gdal.Open(str(fn), gdalconst.GA_ReadOnly)
 
     def build_overview(self, missing_only=False, fn=None):
@@ -1,4 +1,6 @@
 import os.path
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 from operator import xor
 from pathlib import Path
 from tempfile import NamedTemporaryFile
@@ -10,6 +12,7 @@ from nextgisweb.core.exception import ValidationError
 from nextgisweb.spatial_ref_sys import SRS
 
 from ..model import RasterLayer
+from ..util import DatasetCache
 from .validate_cloud_optimized_geotiff import validate
 
 pytestmark = pytest.mark.usefixtures("ngw_resource_defaults")
@@ -92,3 +95,25 @@ def test_size_limit_reproj(source, expected_size, ngw_commit, ngw_data_path, ngw
 
     with ngw_env.raster_layer.options.override(dict(size_limit=expected_size)):
         res.load_file(filename)
+
+
+def test_dataset_cache(ngw_data_path, tmp_path):
+    fn = tmp_path / "rounds.tif"
+    shutil.copy(ngw_data_path / "rounds.tif", fn)
+
+    cache = DatasetCache(1)
+    ds = cache.open(fn)
+    assert cache.open(fn) is ds
+
+    # Datasets aren't shared between threads
+    with ThreadPoolExecutor(1) as executor:
+        assert executor.submit(cache.open, fn).result() is not ds
+
+    os.utime(fn, ns=(0, 0))
+    assert cache.open(fn) is not ds
+
+    ds = cache.open(fn)
+    other = tmp_path / "other.tif"
+    shutil.copy(fn, other)
+    cache.open(other)
+    assert cache.open(fn) is not ds
@@ -1,4 +1,8 @@
-from osgeo import gdal
+import os
+from collections import OrderedDict
+from threading import local
+
+from osgeo import gdal, gdalconst
 
 PYRAMID_TARGET_SIZE = 512
 
@@ -23,3 +27,45 @@ def raster_size(ds, aux_bands=0, data_type=None):
     data_type_bytes = gdal.GetDataTypeSize(data_type) // 8
     size = ds.RasterXSize * ds.RasterYSize * data_type_bytes * (ds.RasterCount + aux_bands)
     return size
+
+
+def _mtime(fn):
+    try:
+        return os.stat(fn).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+class DatasetCache:
+    """Per-thread LRU cache of read-only GDAL datasets
+
+    GDAL datasets can't be shared between threads, so each thread keeps its
+    own datasets. They're reopened if the file or its external overview is
+    modified, e.g. after rebuilding overviews."""
+
+    def __init__(self, size):
+        self.size = size
+        self._local = local()
+
+    def open(self, fn):
+        fn = str(fn)
+        if self.size <= 0:
+            return gdal.Open(fn, gdalconst.GA_ReadOnly)
+
+        datasets = getattr(self._local, "datasets", None)
+        if datasets is None:
+            datasets = self._local.datasets = OrderedDict()
+
+        key = (_mtime(fn), _mtime(fn + ".ovr"))
+        cached = datasets.get(fn)
+        if cached is not None and cached[0] == key:
+            datasets.move_to_end(fn)
+            return cached[1]
+
+        ds = gdal.Open(fn, gdalconst.GA_ReadOnly)
+        if ds is not None:
+            datasets[fn] = (key, ds)
+            datasets.move_to_end(fn)
+            while len(datasets) > self.size:
+                datasets.popitem(last=False)
+        return ds
@@ -2,7 +2,7 @@ from io import BytesIO
 
 import numpy
 import PIL
-from osgeo import gdal, gdal_array, gdalconst
+from osgeo import gdal, gdalconst
 from zope.interface import implementer
 
 from nextgisweb.env import Base, gettext
@@ -18,6 +18,8 @@ from nextgisweb.resource import DataScope, Resource
 
 Base.depends_on("resource")
 
+RAW_MODES = {3: "RGB", 4: "RGBA"}
+
 
 @implementer(IExtentRenderRequest, ITileRenderRequest)
 class RenderRequest:
@@ -61,7 +63,7 @@ class RasterStyle(Base, Resource):
         result = PIL.Image.new("RGBA", size, (0, 0, 0, 0))
 
         if self.parent.cls == "raster_layer":
-            parent_ds = self.parent.gdal_dataset()
+            parent_ds = self.parent.gdal_dataset(cached=True)
         elif self.parent.cls == "raster_mosaic":
             parent_ds = self.parent.gdal_dataset(extent=extent, size=size)
 
@@ -81,19 +83,33 @@ class RasterStyle(Base, Resource):
             ),
         )
 
+        # Read all bands at once in pixel-interleaved layout, which PIL uses
+        # for multiband images, so the buffer is wrapped without copying
         band_count = ds.RasterCount
-        array = numpy.zeros((size[1], size[0], band_count), numpy.uint8)
-
-        for i in range(band_count):
-            array[:, :, i] = gdal_array.BandReadAsArray(
-                ds.GetRasterBand(i + 1),
-            )
+        data = ds.ReadRaster(
+            0,
+            0,
+            size[0],
+            size[1],
+            buf_pixel_space=band_count,
+            buf_line_space=band_count * size[0],
+            buf_band_space=1,
+        )
 
         ds = None
         parent_ds = None
-        wnd = PIL.Image.fromarray(array)
-        result.paste(wnd)
 
+        mode = RAW_MODES.get(band_count)
+        if mode is None:
+            array = numpy.frombuffer(data, numpy.uint8).reshape(size[1], size[0], band_count)
+            result.paste(PIL.Image.fromarray(array))
+            return result
+
+        wnd = PIL.Image.frombuffer(mode, size, data, "raw", mode, 0, 1)
+        if mode == "RGBA":
+            return wnd
+
+        result.paste(wnd)
         return result
 
     def render_legend(self):
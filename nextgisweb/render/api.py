@@ -1,25 +1,31 @@
+from functools import lru_cache
 from io import BytesIO
 from itertools import product
 from math import ceil, floor, log
 from pathlib import Path
+from time import perf_counter
 from typing import Dict, List, Literal, Union
 
+import transaction
 from msgspec import Meta, Struct
 from PIL import Image, ImageDraw, ImageFont
 from pyramid.httpexceptions import HTTPBadRequest
 from pyramid.response import Response
+from sqlalchemy.orm import selectinload
 from typing_extensions import Annotated
 
-from nextgisweb.env import gettext
+from nextgisweb.env import env, gettext
 from nextgisweb.lib.apitype import AnyOf, AsJSON, ContentType, StatusCode
 
 from nextgisweb.core.exception import UserException, ValidationError
 from nextgisweb.resource import DataScope, Resource, ResourceFactory, ResourceNotFound
+from nextgisweb.resource.presolver import load_resources, resolve_permission
 
 from .imgcodec import COMPRESSION_FAST, FORMAT_PNG, image_encoder_factory
 from .interface import ILegendableStyle, IRenderableStyle
 from .legend import ILegendSymbols
-from .util import af_transform
+from .model import tile_advisory_lock
+from .util import SingleFlight, af_transform, unpack_color
 
 RenderResource = Annotated[
     List[int],
@@ -58,10 +64,12 @@ NoDataStatusCode = Annotated[
 ]
 TileCache = Annotated[bool, Meta(description="Use tile cache if available")]
 TileDebugInfo = Annotated[bool, Meta(description="Draw tile debug info")]
+RenderParallel = Annotated[bool, Meta(description="Render resources concurrently if enabled")]
 
 RenderResponse = AnyOf[
     Annotated[Response, ContentType("image/png")],
     Annotated[Response, StatusCode(204)],
+    Annotated[Response, StatusCode(304)],
     Annotated[Response, StatusCode(404), ContentType("application/octet-stream")],
 ]
 
@@ -159,26 +167,12 @@ def process_symbols(value: Symbols) -> Dict[int, List[int]]:
     return result
 
 
-def tile(
-    request,
-    *,
-    resource: RenderResource,
-    z: TileZ,
-    x: TileX,
-    y: TileY,
-    symbols: Symbols,
-    nd: NoDataStatusCode = 200,
-    cache: TileCache = True,
-) -> RenderResponse:
-    """Render tile from one or more resources"""
-    check_origin(request)
+def _resolve(request, resource):
+    loaded = load_resources(resource, (selectinload(Resource.tile_cache),))
 
-    p_symbols = process_symbols(symbols) if symbols else dict()
-    p_cache = cache and request.env.render.tile_cache_enabled
-
-    aimg = None
+    result = []
     for resid in resource:
-        obj = Resource.filter_by(id=resid).one_or_none()
+        obj = loaded.get(resid)
 
         if obj is None:
             raise ResourceNotFound(resid)
@@ -186,35 +180,54 @@ def tile(
         if not IRenderableStyle.providedBy(obj):
             raise ValidationError("Resource (ID=%d) cannot be rendered." % (resid,))
 
-        request.resource_permission(DataScope.read, obj)
+        result.append(obj)
+
+    permitted = resolve_permission(result, request.user, DataScope.read)
+    for obj in result:
+        if not permitted[obj]:
+            # Raise the same error as a regular permission check does
+            request.resource_permission(DataScope.read, obj)
 
-        rimg = None  # Resulting resource image
+    return result
 
-        rsymbols = p_symbols.get(resid)
-        tcache = obj.tile_cache
 
-        # Is requested tile may be cached?
-        cache_enabled = (
-            p_cache
-            and rsymbols is None
-            and tcache is not None
-            and tcache.enabled
-            and (tcache.max_z is None or z <= tcache.max_z)
-        )
+def _timed(job, obj, *args):
+    tstart = perf_counter()
+    rimg = job(obj, *args)
+    return rimg, perf_counter() - tstart
 
-        cache_exists = False
-        if cache_enabled:
-            cache_exists, rimg = tcache.get_tile((z, x, y))
 
-        if not cache_exists:
-            cond = dict()
-            if rsymbols is not None:
-                cond["symbols"] = rsymbols
-            req = obj.render_request(obj.srs, cond=cond)
-            rimg = req.render_tile((z, x, y), 256)
+def _timed_threaded(job, resid, *args):
+    # Worker threads have their own transactions and sessions, so resources
+    # are loaded again instead of sharing request session objects. Tile caches
+    # are loaded along as the request does, and loading isn't timed.
+    with transaction.manager:
+        obj = Resource.filter_by(id=resid).options(selectinload(Resource.tile_cache)).one()
+        return _timed(job, obj, *args)
+
+
+def _render(request, objs, job, args, parallel):
+    """Render resources with a given job and per-resource arguments and return
+    resulting images in the same order with rendering timings. Resources are
+    rendered on the component thread pool if parallel rendering is enabled."""
+
+    executor = request.env.render.executor
+    if parallel and executor is not None and len(objs) > 1:
+        futures = [
+            executor.submit(_timed_threaded, job, obj.id, *oargs) for obj, oargs in zip(objs, args)
+        ]
+        result = [f.result() for f in futures]
+    else:
+        result = [_timed(job, obj, *oargs) for obj, oargs in zip(objs, args)]
+
+    return [(obj, rimg, duration) for obj, (rimg, duration) in zip(objs, result)]
+
 
-            if cache_enabled:
-                tcache.put_tile((z, x, y), rimg)
+def _composite(rendered, response_factory):
+    aimg = None
+    timing = []
+    for obj, rimg, duration in rendered:
+        timing.append("r%d;dur=%.1f" % (obj.id, duration * 1000))
 
         if rimg is None:
             continue
@@ -230,200 +243,402 @@ def tile(
                     % (obj.id, aimg.mode, rimg.mode)
                 )
 
-    return image_response(aimg, nd, (256, 256))
+    response = response_factory(aimg)
+    response.headers["Server-Timing"] = ", ".join(timing)
+    return response
+
+
+def _tile_cache(obj, z, rsymbols, p_cache):
+    """Tile cache of a resource if the requested tile may be cached"""
+    tcache = obj.tile_cache
+    if (
+        p_cache
+        and rsymbols is None
+        and tcache is not None
+        and tcache.enabled
+        and (tcache.max_z is None or z <= tcache.max_z)
+    ):
+        return tcache
+    return None
+
+
+def _tile_job(obj, tile, rsymbols, p_cache, lookup):
+    tcache = _tile_cache(obj, tile[0], rsymbols, p_cache)
+
+    if tcache is not None and lookup:
+        cache_exists, rimg = tcache.get_tile(tile)
+        if cache_exists:
+            return rimg
+
+    # Concurrent requests for the same tile or metatile wait for a single
+    # rendering and get its result.
+    if tcache is not None and tcache.metatile is not None and tcache.metatile > 1:
+        z, x, y = tile
+        size = min(tcache.metatile, 2**z)
+        mtile = (z, x - x % size, y - y % size)
+
+        mimg = tile_flight.do(
+            ("metatile", tcache.uuid.hex, mtile),
+            _coalesced,
+            tcache,
+            mtile,
+            _render_metatile,
+            obj,
+            tcache,
+            mtile,
+            size,
+        )
+        if mimg is FROM_CACHE:
+            cache_exists, rimg = tcache.get_tile(tile)
+            if cache_exists:
+                return rimg
+            mimg = _render_metatile(obj, tcache, mtile, size, wait=False)
+
+        if mimg is None:
+            return None
+
+        offset = ((x - mtile[1]) * 256, (y - mtile[2]) * 256)
+        return mimg.crop(offset + (offset[0] + 256, offset[1] + 256))
+
+    rimg = tile_flight.do(
+        ("tile", obj.id, tile, None if rsymbols is None else tuple(rsymbols)),
+        _coalesced,
+        tcache,
+        tile,
+        _render_tile,
+        obj,
+        tcache,
+        tile,
+        rsymbols,
+    )
+    if rimg is FROM_CACHE:
+        cache_exists, rimg = tcache.get_tile(tile)
+        if not cache_exists:
+            rimg = _render_tile(obj, tcache, tile, rsymbols, wait=False)
 
+    return rimg
 
-def image(
+
+tile_flight = SingleFlight()
+
+FROM_CACHE = object()
+
+
+def _coalesced(tcache, tile, fn, *args):
+    """Call a rendering function holding an advisory lock on the tile if
+    coalescing between workers is enabled. If another worker has rendered the
+    tile meanwhile, FROM_CACHE is returned instead."""
+
+    if tcache is None or not env.render.options["coalesce.advisory_lock"]:
+        return fn(*args, wait=False)
+
+    with tile_advisory_lock(
+        (tcache.uuid.hex,) + tuple(tile),
+        env.render.options["coalesce.timeout"],
+    ) as waited:
+        if waited and tcache.get_tile(tile)[0]:
+            return FROM_CACHE
+
+        # Wait for the tile to be written, so other workers find it
+        return fn(*args, wait=waited is not None)
+
+
+def _render_tile(obj, tcache, tile, rsymbols, *, wait):
+    cond = dict()
+    if rsymbols is not None:
+        cond["symbols"] = rsymbols
+    req = obj.render_request(obj.srs, cond=cond)
+    rimg = req.render_tile(tile, 256)
+
+    if tcache is not None:
+        tcache.put_tile(tile, rimg, wait=wait)
+
+    return rimg
+
+
+def _render_metatile(obj, tcache, mtile, size, *, wait):
+    """Render a metatile, put all its tiles into the tile cache and return
+    the metatile image"""
+
+    z, mx, my = mtile
+    srs = obj.srs
+
+    # Top left and bottom right tiles of the metatile
+    tl_extent = srs.tile_extent((z, mx, my))
+    br_extent = srs.tile_extent((z, mx + size - 1, my + size - 1))
+    extent = (tl_extent[0], br_extent[1], br_extent[2], tl_extent[3])
+
+    req = obj.render_request(srs)
+    mimg = req.render_extent(extent, (256 * size, 256 * size))
+
+    # Tiles are written in a single batch and transaction
+    tiles = []
+    for tx, ty in product(range(size), range(size)):
+        if mimg is None:
+            timg = None
+        else:
+            offset = (tx * 256, ty * 256)
+            timg = mimg.crop(offset + (offset[0] + 256, offset[1] + 256))
+        tiles.append(((z, mx + tx, my + ty), timg))
+    tcache.put_tiles(tiles, queued=True, wait=wait)
+
+    return mimg
+
+
+@lru_cache(maxsize=256)
+def _solid_tile(color):
+    img = Image.new("RGBA", (256, 256), unpack_color(color))
+    buf = BytesIO()
+    image_encoder(img, buf)
+    return buf.getvalue()
+
+
+def _cached_tile_response(request, tcache, tile, nd):
+    """Response for a single-resource tile found in the tile cache, which is
+    sent without decoding and encoding again or None if it's missing."""
+
+    found = tcache.lookup_tile(tile)
+    if found is None:
+        return None
+
+    tstamp, color, data = found
+    etag = "%s-%x" % (tcache.uuid.hex, tstamp)
+    if etag in request.if_none_match:
+        return Response(status=304, etag=etag)
+
+    if color is not None:
+        if unpack_color(color)[3] == 0:
+            response = image_response(None, nd, (256, 256))
+        else:
+            response = Response(_solid_tile(color), content_type="image/png")
+    else:
+        response = Response(data, content_type="image/png")
+
+    response.etag = etag
+    return response
+
+
+def tile(
     request,
     *,
     resource: RenderResource,
-    extent: RenderExtent,
-    size: ImageSize,
+    z: TileZ,
+    x: TileX,
+    y: TileY,
     symbols: Symbols,
     nd: NoDataStatusCode = 200,
     cache: TileCache = True,
-    tdi: TileDebugInfo = False,
+    parallel: RenderParallel = True,
 ) -> RenderResponse:
-    """Render image from one or more resources"""
+    """Render tile from one or more resources"""
     check_origin(request)
 
     p_symbols = process_symbols(symbols) if symbols else dict()
     p_cache = cache and request.env.render.tile_cache_enabled
 
-    resolution = (
-        (extent[2] - extent[0]) / size[0],
-        (extent[3] - extent[1]) / size[1],
+    objs = _resolve(request, resource)
+
+    # Single-resource tiles found in the tile cache are sent as-is
+    lookup = True
+    if len(objs) == 1:
+        obj = objs[0]
+        tcache = _tile_cache(obj, z, p_symbols.get(obj.id), p_cache)
+        if tcache is not None:
+            response = _cached_tile_response(request, tcache, (z, x, y), nd)
+            if response is not None:
+                return response
+            lookup = False
+
+    rendered = _render(
+        request,
+        objs,
+        _tile_job,
+        [((z, x, y), p_symbols.get(obj.id), p_cache, lookup) for obj in objs],
+        parallel,
     )
 
-    aimg = None
-    zexact = None
-    for resid in resource:
-        obj = Resource.filter_by(id=resid).one_or_none()
+    return _composite(rendered, lambda aimg: image_response(aimg, nd, (256, 256)))
 
-        if obj is None:
-            raise ResourceNotFound(resid)
 
-        if not IRenderableStyle.providedBy(obj):
-            raise ValidationError("Resource (ID=%d) cannot be rendered." % (resid,))
+def _image_job(obj, extent, size, rsymbols, p_cache, ztile, tdi):
+    rimg = None
+    tcache = obj.tile_cache
 
-        request.resource_permission(DataScope.read, obj)
+    # Is requested image may be cached via tiles?
+    cache_enabled = (
+        p_cache
+        and rsymbols is None
+        and ztile is not None
+        and tcache is not None
+        and tcache.enabled
+        and tcache.image_compose
+        and (tcache.max_z is None or ztile <= tcache.max_z)
+    )
 
-        rimg = None
+    ext_extent = extent
+    ext_size = size
+    ext_offset = (0, 0)
 
-        if p_cache and zexact is None:
-            if abs(resolution[0] - resolution[1]) < 1e-9:
-                ztile = log((obj.srs.maxx - obj.srs.minx) / (256 * resolution[0]), 2)
-                zexact = abs(round(ztile) - ztile) < 1e-9
-                if zexact:
-                    ztile = int(round(ztile))
-            else:
-                zexact = False
-
-        rsymbols = p_symbols.get(resid)
-        tcache = obj.tile_cache
-
-        # Is requested image may be cached via tiles?
-        cache_enabled = (
-            p_cache
-            and rsymbols is None
-            and zexact
-            and tcache is not None
-            and tcache.enabled
-            and tcache.image_compose
-            and (tcache.max_z is None or ztile <= tcache.max_z)
+    if cache_enabled:
+        # Affine transform from layer to tile
+        at_l2t = af_transform(
+            (obj.srs.minx, obj.srs.miny, obj.srs.maxx, obj.srs.maxy),
+            (0, 0, 2**ztile, 2**ztile),
         )
+        at_t2l = ~at_l2t
 
-        ext_extent = extent
-        ext_size = size
-        ext_offset = (0, 0)
+        # Affine transform from layer to image
+        at_l2i = af_transform(extent, (0, 0) + tuple(size))
 
-        if cache_enabled:
-            # Affine transform from layer to tile
-            at_l2t = af_transform(
-                (obj.srs.minx, obj.srs.miny, obj.srs.maxx, obj.srs.maxy),
-                (0, 0, 2**ztile, 2**ztile),
-            )
-            at_t2l = ~at_l2t
+        # Affine transform from tile to image
+        at_t2i = at_l2i * ~at_l2t
 
-            # Affine transform from layer to image
-            at_l2i = af_transform(extent, (0, 0) + tuple(size))
+        # Tile coordinates of render extent
+        t_lb = tuple(at_l2t * extent[0:2])
+        t_rt = tuple(at_l2t * extent[2:4])
 
-            # Affine transform from tile to image
-            at_t2i = at_l2i * ~at_l2t
+        tb = (
+            int(floor(t_lb[0]) if t_lb[0] == min(t_lb[0], t_rt[0]) else ceil(t_lb[0])),
+            int(floor(t_lb[1]) if t_lb[1] == min(t_lb[1], t_rt[1]) else ceil(t_lb[1])),
+            int(floor(t_rt[0]) if t_rt[0] == min(t_lb[0], t_rt[0]) else ceil(t_rt[0])),
+            int(floor(t_rt[1]) if t_rt[1] == min(t_lb[1], t_rt[1]) else ceil(t_rt[1])),
+        )
 
-            # Tile coordinates of render extent
-            t_lb = tuple(at_l2t * extent[0:2])
-            t_rt = tuple(at_l2t * extent[2:4])
+        ext_extent = at_t2l * tb[0:2] + at_t2l * tb[2:4]
+        ext_im = rtoint(at_t2i * tb[0:2] + at_t2i * tb[2:4])
+        ext_size = (ext_im[2] - ext_im[0], ext_im[1] - ext_im[3])
+        ext_offset = (-ext_im[0], -ext_im[3])
 
-            tb = (
-                int(floor(t_lb[0]) if t_lb[0] == min(t_lb[0], t_rt[0]) else ceil(t_lb[0])),
-                int(floor(t_lb[1]) if t_lb[1] == min(t_lb[1], t_rt[1]) else ceil(t_lb[1])),
-                int(floor(t_rt[0]) if t_rt[0] == min(t_lb[0], t_rt[0]) else ceil(t_rt[0])),
-                int(floor(t_rt[1]) if t_rt[1] == min(t_lb[1], t_rt[1]) else ceil(t_rt[1])),
-            )
+        tx_range = tuple(range(min(tb[0], tb[2]), max(tb[0], tb[2])))
+        ty_range = tuple(range(min(tb[1], tb[3]), max(tb[1], tb[3])))
+
+        for tx, ty in product(tx_range, ty_range):
+            cache_exists, timg = tcache.get_tile((ztile, tx, ty))
+            if not cache_exists:
+                rimg = None
+                break
+            else:
+                if rimg is None:
+                    rimg = Image.new("RGBA", size)
 
-            ext_extent = at_t2l * tb[0:2] + at_t2l * tb[2:4]
-            ext_im = rtoint(at_t2i * tb[0:2] + at_t2i * tb[2:4])
-            ext_size = (ext_im[2] - ext_im[0], ext_im[1] - ext_im[3])
-            ext_offset = (-ext_im[0], -ext_im[3])
+                if tdi:
+                    msg = "CACHED"
+                    if timg is None:
+                        timg = Image.new("RGBA", size)
+                        msg += " EMPTY"
+                    timg = tile_debug_info(
+                        timg.convert("RGBA"),
+                        color="blue",
+                        zxy=(ztile, tx, ty),
+                        extent=at_t2l * (tx, ty) + at_t2l * (tx + 1, ty + 1),
+                        msg=msg,
+                    )
+
+                if timg is None:
+                    continue
+
+                toffset = rtoint(at_t2i * (tx, ty))
+                rimg.paste(timg, toffset)
+
+    if rimg is None:
+        cond = dict()
+        if rsymbols is not None:
+            cond["symbols"] = rsymbols
+        req = obj.render_request(obj.srs, cond=cond)
+        rimg = req.render_extent(ext_extent, ext_size)
 
-            tx_range = tuple(range(min(tb[0], tb[2]), max(tb[0], tb[2])))
-            ty_range = tuple(range(min(tb[1], tb[3]), max(tb[1], tb[3])))
+        empty_image = rimg is None
 
+        if cache_enabled:
+            tile_cache_failed = False
             for tx, ty in product(tx_range, ty_range):
-                cache_exists, timg = tcache.get_tile((ztile, tx, ty))
-                if not cache_exists:
-                    rimg = None
-                    break
+                t_offset = at_t2i * (tx, ty)
+                t_offset = rtoint((t_offset[0] + ext_offset[0], t_offset[1] + ext_offset[1]))
+                if empty_image:
+                    timg = None
                 else:
-                    if rimg is None:
-                        rimg = Image.new("RGBA", size)
-
-                    if tdi:
-                        msg = "CACHED"
-                        if timg is None:
-                            timg = Image.new("RGBA", size)
-                            msg += " EMPTY"
-                        timg = tile_debug_info(
-                            timg.convert("RGBA"),
-                            color="blue",
-                            zxy=(ztile, tx, ty),
-                            extent=at_t2l * (tx, ty) + at_t2l * (tx + 1, ty + 1),
-                            msg=msg,
-                        )
-
-                    if timg is None:
-                        continue
+                    timg = rimg.crop(t_offset + (t_offset[0] + 256, t_offset[1] + 256))
 
-                    toffset = rtoint(at_t2i * (tx, ty))
-                    rimg.paste(timg, toffset)
+                tile_cache_failed = tile_cache_failed or (
+                    not obj.tile_cache.put_tile((ztile, tx, ty), timg)
+                )
 
-        if rimg is None:
-            cond = dict()
-            if rsymbols is not None:
-                cond["symbols"] = rsymbols
-            req = obj.render_request(obj.srs, cond=cond)
-            rimg = req.render_extent(ext_extent, ext_size)
-
-            empty_image = rimg is None
-
-            if cache_enabled:
-                tile_cache_failed = False
-                for tx, ty in product(tx_range, ty_range):
-                    t_offset = at_t2i * (tx, ty)
-                    t_offset = rtoint((t_offset[0] + ext_offset[0], t_offset[1] + ext_offset[1]))
+                if tdi:
+                    if rimg is None:
+                        rimg = Image.new("RGBA", ext_size)
+                    msg = "NEW"
                     if empty_image:
-                        timg = None
-                    else:
-                        timg = rimg.crop(t_offset + (t_offset[0] + 256, t_offset[1] + 256))
-
-                    tile_cache_failed = tile_cache_failed or (
-                        not obj.tile_cache.put_tile((ztile, tx, ty), timg)
+                        msg += " EMPTY"
+                    rimg = tile_debug_info(
+                        rimg,
+                        offset=t_offset,
+                        color="red",
+                        zxy=(ztile, tx, ty),
+                        extent=at_t2l * (tx, ty) + at_t2l * (tx + 1, ty + 1),
+                        msg=msg,
                     )
 
-                    if tdi:
-                        if rimg is None:
-                            rimg = Image.new("RGBA", ext_size)
-                        msg = "NEW"
-                        if empty_image:
-                            msg += " EMPTY"
-                        rimg = tile_debug_info(
-                            rimg,
-                            offset=t_offset,
-                            color="red",
-                            zxy=(ztile, tx, ty),
-                            extent=at_t2l * (tx, ty) + at_t2l * (tx + 1, ty + 1),
-                            msg=msg,
-                        )
-
-                    elif tile_cache_failed:
-                        # Stop putting to the tile cache in case of its failure.
-                        break
-
-            if rimg is None:
-                continue
-
-            rimg = rimg.crop(
-                (
-                    ext_offset[0],
-                    ext_offset[1],
-                    ext_offset[0] + size[0],
-                    ext_offset[1] + size[1],
-                )
+                elif tile_cache_failed:
+                    # Stop putting to the tile cache in case of its failure.
+                    break
+
+        if rimg is None:
+            return None
+
+        rimg = rimg.crop(
+            (
+                ext_offset[0],
+                ext_offset[1],
+                ext_offset[0] + size[0],
+                ext_offset[1] + size[1],
             )
+        )
 
-        if aimg is None:
-            aimg = rimg
-        else:
-            try:
-                aimg = Image.alpha_composite(aimg, rimg)
-            except ValueError:
-                raise HTTPBadRequest(
-                    explanation="Image (ID=%d) must have mode %s, but it is %s mode."
-                    % (obj.id, aimg.mode, rimg.mode)
-                )
+    return rimg
+
+
+def image(
+    request,
+    *,
+    resource: RenderResource,
+    extent: RenderExtent,
+    size: ImageSize,
+    symbols: Symbols,
+    nd: NoDataStatusCode = 200,
+    cache: TileCache = True,
+    tdi: TileDebugInfo = False,
+    parallel: RenderParallel = True,
+) -> RenderResponse:
+    """Render image from one or more resources"""
+    check_origin(request)
+
+    p_symbols = process_symbols(symbols) if symbols else dict()
+    p_cache = cache and request.env.render.tile_cache_enabled
+
+    resolution = (
+        (extent[2] - extent[0]) / size[0],
+        (extent[3] - extent[1]) / size[1],
+    )
+
+    objs = _resolve(request, resource)
+
+    # Zoom level of the image if it matches the tile grid
+    ztile = None
+    if p_cache and abs(resolution[0] - resolution[1]) < 1e-9:
+        srs = objs[0].srs
+        zvalue = log((srs.maxx - srs.minx) / (256 * resolution[0]), 2)
+        if abs(round(zvalue) - zvalue) < 1e-9:
+            ztile = int(round(zvalue))
+
+    rendered = _render(
+        request,
+        objs,
+        _image_job,
+        [(extent, size, p_symbols.get(obj.id), p_cache, ztile, tdi) for obj in objs],
+        parallel,
+    )
 
-    return image_response(aimg, nd, size)
+    return _composite(rendered, lambda aimg: image_response(aimg, nd, size))
 
 
 def legend(request) -> Annotated[Response, ContentType("image/png")]:
@@ -0,0 +1,201 @@
+import multiprocessing
+from datetime import datetime
+from itertools import islice, product
+from time import time
+from typing import Optional
+
+import sqlalchemy as sa
+import transaction
+from shapely.geometry import box
+
+from nextgisweb.env import DBSession, env
+from nextgisweb.env.cli import EnvCommand, arg, comp_cli, opt
+from nextgisweb.lib.geometry import Geometry, Transformer
+from nextgisweb.lib.logging import logger
+
+from nextgisweb.layer import IBboxLayer
+from nextgisweb.resource import Resource
+from nextgisweb.spatial_ref_sys import SRS
+
+from .component import RenderComponent
+from .interface import IRenderableStyle
+from .model import TIMESTAMP_EPOCH
+
+
+@comp_cli.command()
+def cleanup(self: EnvCommand, *, render: RenderComponent):
+    render.cleanup()
+
+
+@comp_cli.command()
+class seed(EnvCommand):
+    """Render tiles of a resource into its tile cache
+
+    Tiles which already exist in the tile cache are skipped, so an interrupted
+    seeding can be resumed by running the same command again."""
+
+    resource: int = arg(metavar="id", doc="Resource ID")
+    zoom_min: int = opt(0, doc="Minimum zoom level")
+    zoom_max: int = opt(doc="Maximum zoom level")
+    extent: Optional[str] = opt(
+        metavar="minx,miny,maxx,maxy",
+        doc="Extent in resource SRS (layer extent by default)",
+    )
+    geom: Optional[str] = opt(metavar="wkt", doc="Seed only tiles intersecting WKT geometry")
+    workers: int = opt(1, doc="Number of worker processes")
+    chunk: int = opt(16, doc="Number of tiles rendered per task")
+
+    def __call__(self):
+        with transaction.manager:
+            obj = Resource.filter_by(id=self.resource).one()
+            if not IRenderableStyle.providedBy(obj):
+                raise ValueError("Resource (ID=%d) cannot be rendered." % obj.id)
+
+            tcache = obj.tile_cache
+            if tcache is None or not tcache.enabled:
+                raise ValueError("Tile cache is disabled for resource (ID=%d)." % obj.id)
+
+            srs = obj.srs
+            zoom_max = self.zoom_max
+            if tcache.max_z is not None and tcache.max_z < zoom_max:
+                logger.warning("Maximum zoom level is limited to %d by tile cache", tcache.max_z)
+                zoom_max = tcache.max_z
+
+            shape = None
+            if self.geom is not None:
+                shape = Geometry.from_wkt(self.geom, srid=srs.id).shape
+                extent = shape.bounds
+            elif self.extent is not None:
+                extent = tuple(float(v) for v in self.extent.split(","))
+                if len(extent) != 4:
+                    raise ValueError("Extent should contain 4 values.")
+            else:
+                extent = _layer_extent(obj, srs)
+
+            # SRS is used to generate tiles outside the transaction
+            DBSession.expunge(srs)
+
+        # Tiles are generated lazily and existing tiles are skipped by chunks,
+        # as both grow as 4^z. The total is an upper bound for the progress.
+        zooms = range(self.zoom_min, zoom_max + 1)
+        total = sum(_tile_range_size(srs, extent, z) for z in zooms)
+        logger.info(
+            "Up to %d tiles to render on zoom levels %d-%d", total, self.zoom_min, zoom_max
+        )
+
+        tasks = (
+            (self.resource, chunk)
+            for z in zooms
+            for chunk in _chunked(_tiles(srs, extent, shape, z), self.chunk)
+        )
+
+        if self.workers > 1:
+            # Forked processes reuse the environment, but not database
+            # connections of the parent process.
+            pool = multiprocessing.get_context("fork").Pool(self.workers, _worker_init)
+
+            # Pool consumes a task iterable entirely, so tasks are submitted
+            # by windows to keep memory usage bounded
+            results = (
+                result
+                for window in _chunked(tasks, self.workers * 4)
+                for result in pool.imap_unordered(_seed_task, window)
+            )
+        else:
+            pool = None
+            results = (_seed_task(task) for task in tasks)
+
+        tstart = tlog = time()
+        processed = rendered = 0
+        try:
+            for count, count_rendered in results:
+                processed += count
+                rendered += count_rendered
+                if (tnow := time()) - tlog > 10:
+                    tlog = tnow
+                    logger.info(
+                        "%d of %d tiles processed, %d rendered (%0.1f per second)",
+                        processed,
+                        total,
+                        rendered,
+                        rendered / (tnow - tstart),
+                    )
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+        logger.info("%d tiles processed, %d rendered", processed, rendered)
+
+
+def _layer_extent(obj, srs):
+    parent = obj.parent
+    if IBboxLayer.providedBy(parent):
+        bbox = parent.extent
+        if None not in bbox.values():
+            wgs84 = SRS.filter_by(id=4326).one()
+            geom = Geometry.from_box(
+                bbox["minLon"], bbox["minLat"], bbox["maxLon"], bbox["maxLat"], srid=wgs84.id
+            )
+            return Transformer(wgs84.wkt, srs.wkt).transform(geom).bounds
+    return (srs.minx, srs.miny, srs.maxx, srs.maxy)
+
+
+def _tile_range_bounds(srs, extent, z):
+    xmin, ymin, xmax, ymax = srs.extent_tile_range(extent, z)
+    tmax = 2**z - 1
+    return max(xmin, 0), max(ymin, 0), min(xmax, tmax), min(ymax, tmax)
+
+
+def _tile_range_size(srs, extent, z):
+    xmin, ymin, xmax, ymax = _tile_range_bounds(srs, extent, z)
+    return max(xmax - xmin + 1, 0) * max(ymax - ymin + 1, 0)
+
+
+def _tiles(srs, extent, shape, z):
+    xmin, ymin, xmax, ymax = _tile_range_bounds(srs, extent, z)
+    for x, y in product(range(xmin, xmax + 1), range(ymin, ymax + 1)):
+        if shape is None or shape.intersects(box(*srs.tile_extent((z, x, y)))):
+            yield (z, x, y)
+
+
+def _existing_tiles(tcache, tiles):
+    """Existing tiles among tiles of the same zoom level, which are queried
+    within their bounding range"""
+
+    z = tiles[0][0]
+    xs = [x for _, x, _ in tiles]
+    ys = [y for _, _, y in tiles]
+
+    c = tcache.tiletab.c
+    query = sa.select(c.z, c.x, c.y).where(
+        c.z == z,
+        c.x.between(min(xs), max(xs)),
+        c.y.between(min(ys), max(ys)),
+    )
+    if tcache.ttl is not None:
+        now = int((datetime.utcnow() - TIMESTAMP_EPOCH).total_seconds())
+        query = query.where(c.tstamp > now - tcache.ttl)
+    return set(tuple(row) for row in DBSession.execute(query))
+
+
+def _chunked(iterable, size):
+    it = iter(iterable)
+    while chunk := list(islice(it, size)):
+        yield chunk
+
+
+def _worker_init():
+    env.core.engine.dispose(close=False)
+
+
+def _seed_task(task):
+    resource_id, tiles = task
+    with transaction.manager:
+        obj = Resource.filter_by(id=resource_id).one()
+        existing = _existing_tiles(obj.tile_cache, tiles)
+        missing = [tile for tile in tiles if tile not in existing]
+        if len(missing) > 0:
+            req = obj.render_request(obj.srs)
+            obj.tile_cache.put_tiles([(tile, req.render_tile(tile, 256)) for tile in missing])
+    return len(tiles), len(missing)
@@ -1,4 +1,5 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from uuid import UUID
 
@@ -13,7 +14,7 @@ from nextgisweb.lib.logging import logger
 
 from nextgisweb.core import KindOfData
 
-from .model import TIMESTAMP_EPOCH
+from .model import TIMESTAMP_EPOCH, TileLRU
 from .model import ResourceTileCache as RTC
 
 vacuum_freepage_coeff = 0.5
@@ -28,9 +29,20 @@ class RenderComponent(Component):
     def initialize(self):
         self.tile_cache_enabled = self.options["tile_cache.enabled"]
         self.tile_cache_path = os.path.join(self.env.core.gtsdir(self), "tile_cache")
+        lru_size = self.options["tile_cache.lru_size"]
+        self.tile_lru = TileLRU(lru_size) if self.tile_cache_enabled and lru_size > 0 else None
         if not os.path.isdir(self.tile_cache_path):
             os.makedirs(self.tile_cache_path)
 
+        # Threads are started on demand, so it's safe to create the executor
+        # before forking worker processes.
+        self.executor = None
+        if self.options["parallel.enabled"]:
+            self.executor = ThreadPoolExecutor(
+                max_workers=self.options["parallel.workers"],
+                thread_name_prefix="render",
+            )
+
     @require("resource")
     def setup_pyramid(self, config):
         from . import api, view
@@ -50,6 +62,12 @@ class RenderComponent(Component):
 
         yield ("Fast PNG", gettext("Enabled") if has_fpng else gettext("Disabled"))
 
+        if (lru := self.tile_lru) is not None:
+            yield (
+                "Tile memory cache",
+                "%d hits, %d misses, %d bytes" % (lru.hits, lru.misses, lru.currsize),
+            )
+
     def maintenance(self):
         self.cleanup()
 
@@ -173,8 +191,15 @@ class RenderComponent(Component):
 
             yield TileCacheData, tc.resource_id, size_img + size_color
 
+    # fmt: off
     option_annotations = (
         Option("check_origin", bool, default=False, doc="Check request Origin header."),
         Option("tile_cache.enabled", bool, default=True),
+        Option("tile_cache.lru_size", int, default=64 * 2**20, doc="Size of in-process memory cache of tiles in bytes, 0 disables it."),
         Option("legend_symbols_section", bool, default=False),
+        Option("parallel.enabled", bool, default=False, doc="Render resources of multi-resource requests concurrently."),
+        Option("parallel.workers", int, default=4, doc="Number of rendering threads shared by all requests."),
+        Option("coalesce.advisory_lock", bool, default=False, doc="Coalesce renderings of the same tile between worker processes using PostgreSQL advisory locks."),
+        Option("coalesce.timeout", float, default=30.0, doc="Timeout of waiting for a tile rendered by another worker process in seconds."),
     )
+    # fmt: on
@@ -0,0 +1,7 @@
+/*** {
+    "revision": "471ef8d8", "parents": ["45964892"],
+    "date": "2024-09-21T14:30:00",
+    "message": "Add tile cache metatile column"
+} ***/
+
+ALTER TABLE resource_tile_cache ADD COLUMN metatile smallint;
@@ -0,0 +1,3 @@
+/*** { "revision": "471ef8d8" } ***/
+
+ALTER TABLE resource_tile_cache DROP COLUMN metatile;
@@ -1,13 +1,16 @@
 import atexit
 import os.path
 import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from functools import lru_cache
+from hashlib import blake2b
 from io import BytesIO
 from pathlib import Path
 from queue import Empty, Full, Queue
 from threading import Lock, Thread
-from time import time
+from time import monotonic, sleep, time
 from typing import Any, Union
 from uuid import uuid4
 
@@ -15,14 +18,17 @@ import sqlalchemy as sa
 import sqlalchemy.event as sa_event
 import sqlalchemy.orm as orm
 import transaction
+from cachetools import LRUCache
 from PIL import Image
 from sqlalchemy import MetaData, Table
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from zope.sqlalchemy import mark_changed
 
-from nextgisweb.env import Base, DBSession, env
+from nextgisweb.env import Base, DBSession, env, gettext
 from nextgisweb.lib import saext
 from nextgisweb.lib.logging import logger
 
+from nextgisweb.core.exception import ValidationError
 from nextgisweb.resource import CRUTypes, Resource, ResourceScope, SAttribute, Serializer
 
 from .interface import IRenderableNonCached, IRenderableStyle
@@ -36,8 +42,14 @@ QUEUE_MAX_SIZE = 256
 QUEUE_STUCK_TIMEOUT = 5.0
 BATCH_MAX_TILES = 32
 BATCH_DEADLINE = 0.5
+ENCODER_WORKERS = 4
 SHUTDOWN_TIMEOUT = 10
 
+METATILE_MAX = 16
+
+LOCK_POLL_MIN = 0.01
+LOCK_POLL_MAX = 0.25
+
 SQLITE_CON_CACHE = 32
 SQLITE_TIMEOUT = min(QUEUE_STUCK_TIMEOUT * 2, 30)
 
@@ -94,6 +106,20 @@ class TileWriterQueueFullException(TileWriterQueueException):
     pass
 
 
+def _encode_tile(data):
+    img = data["img"]
+    if img is not None and img.mode != "RGBA":
+        img = img.convert("RGBA")
+
+    colortuple = imgcolor(img)
+    if colortuple is not None:
+        return pack_color(colortuple), None
+
+    buf = BytesIO()
+    img.save(buf, format="PNG", compress_level=3)
+    return None, buf.getvalue()
+
+
 class TilestorWriter:
     __instance = None
 
@@ -102,6 +128,10 @@ class TilestorWriter:
             self.queue = Queue(maxsize=QUEUE_MAX_SIZE)
             self.cstart = None
 
+            self._encoder = ThreadPoolExecutor(
+                max_workers=ENCODER_WORKERS, thread_name_prefix="tilestor"
+            )
+
             self._worker = Thread(target=self._job)
             self._worker.daemon = True
             self._worker.start()
@@ -128,7 +158,6 @@ class TilestorWriter:
         atexit.register(self.wait_for_shutdown)
 
         data = None
-        tilestor = None
         while True:
             self.cstart = None
 
@@ -147,83 +176,61 @@ class TilestorWriter:
                         continue
 
             db_path = data["db_path"]
+            table_uuid = data["uuid"]
 
             self.cstart = ptime = time()
 
-            tiles_written = 0
             time_taken = 0.0
 
-            answers = []
+            # Collect a batch of tiles of the same tile cache, each queue item
+            # may contain multiple tiles, e.g. of a metatile
+            batch = []
+            while data is not None and data["db_path"] == db_path:
+                batch.append(data)
+
+                time_taken += time() - ptime
+
+                if (
+                    sum(len(item["tiles"]) for item in batch) >= BATCH_MAX_TILES
+                    or "answer_queue" in data
+                ):
+                    # Break the batch, also don't make waiting callers wait
+                    # for other tiles
+                    data = None
+                else:
+                    # Try to get next tile for the batch. Or break
+                    # the batch if there is no tiles left.
+                    if time_taken < BATCH_DEADLINE:
+                        try:
+                            data = self.queue.get(timeout=(BATCH_DEADLINE - time_taken))
+                        except Empty:
+                            data = None
+                    else:
+                        data = None
+
+                # Do not account queue block time
+                ptime = time()
+
+            answers = [item["answer_queue"] for item in batch if "answer_queue" in item]
 
             # Tile cache writer may fall sometimes in case of database connecti
-            # problem for example. So we just skip a tile with error and log an
+            # problem for example. So we just skip a batch with error and log an
             # exception.
             try:
+                # Color detection and PNG encoding release GIL mostly, so they
+                # run on the thread pool.
+                tiles = [dict(tile=tile, img=img) for item in batch for tile, img in item["tiles"]]
                 with transaction.manager:
-                    conn = DBSession.connection()
-                    tilestor, lock = get_tile_db(db_path)
-
-                    while data is not None and data["db_path"] == db_path:
-                        z, x, y = data["tile"]
-                        tstamp = int((datetime.utcnow() - TIMESTAMP_EPOCH).total_seconds())
-
-                        img = data["img"]
-                        if img is not None and img.mode != "RGBA":
-                            img = img.convert("RGBA")
-
-                        colortuple = imgcolor(img)
-                        color = pack_color(colortuple) if colortuple is not None else None
-
-                        self._write_tile_meta(
-                            conn, data["uuid"], dict(z=z, x=x, y=y, color=color, tstamp=tstamp)
-                        )
-
-                        if color is None:
-                            buf = BytesIO()
-                            img.save(buf, format="PNG", compress_level=3)
-                            value = buf.getvalue()
+                    self.write(db_path, table_uuid, tiles, self._encoder.map)
 
-                            with lock:
-                                self._write_tile_data(tilestor, z, x, y, tstamp, value)
-
-                        if "answer_queue" in data:
-                            answers.append(data["answer_queue"])
-
-                        tiles_written += 1
-
-                        ctime = time()
-                        time_taken += ctime - ptime
-
-                        if tiles_written >= BATCH_MAX_TILES:
-                            # Break the batch
-                            data = None
-                        else:
-                            # Try to get next tile for the batch. Or break
-                            # the batch if there is no tiles left.
-                            if time_taken < BATCH_DEADLINE:
-                                try:
-                                    data = self.queue.get(timeout=(BATCH_DEADLINE - time_taken))
-                                except Empty:
-                                    data = None
-                            else:
-                                data = None
-
-                        # Do not account queue block time
-                        ptime = time()
-
-                    # Force zope session management to commit changes
-                    mark_changed(DBSession())
-                    tilestor.commit()
-                    tilestor = None
-
-                    time_taken += time() - ptime
-                    logger.debug(
-                        "%d tiles were written in %0.3f seconds (%0.1f per " "second, qsize = %d)",
-                        tiles_written,
-                        time_taken,
-                        tiles_written / time_taken,
-                        self.queue.qsize(),
-                    )
+                time_taken += time() - ptime
+                logger.debug(
+                    "%d tiles were written in %0.3f seconds (%0.1f per " "second, qsize = %d)",
+                    len(tiles),
+                    time_taken,
+                    len(tiles) / time_taken,
+                    self.queue.qsize(),
+                )
 
                 # Report about sucess only after transaction commit
                 for a in answers:
@@ -232,30 +239,78 @@ class TilestorWriter:
             except Exception:
                 logger.exception("Uncaught exception in tile cache writer")
 
-                data = None
                 self.cstart = None
-                if tilestor is not None:
-                    tilestor.rollback()
 
-    def _write_tile_meta(self, conn, table_uuid, row):
-        # fmt: off
-        conn.execute(sa.sql.text("""
-            INSERT INTO tile_cache."{0}" AS tc (z, x, y, color, tstamp)
-            VALUES (:z, :x, :y, :color, :tstamp)
-            ON CONFLICT (z, x, y) DO UPDATE
-            SET color = :color, tstamp = :tstamp
-            WHERE tc.tstamp < :tstamp
-        """.format(table_uuid)), row)
-        # fmt: on
+                # Don't leave waiting callers blocked forever
+                for a in answers:
+                    a.put_nowait(None)
 
-    def _write_tile_data(self, tilestor, z, x, y, tstamp, value):
+    @classmethod
+    def write(cls, db_path, table_uuid, batch, encode=map):
+        """Write a batch of tiles synchronously within the current transaction.
+        Only the last version of a tile within the batch is written."""
+
+        tstamp = int((datetime.utcnow() - TIMESTAMP_EPOCH).total_seconds())
+
+        rows = dict()
+        for item, (color, value) in zip(batch, encode(_encode_tile, batch)):
+            z, x, y = item["tile"]
+            rows[(z, x, y)] = (color, value)
+
+        meta = [
+            dict(z=z, x=x, y=y, color=color, tstamp=tstamp)
+            for (z, x, y), (color, value) in rows.items()
+        ]
+        data_rows = [
+            (z, x, y, tstamp, value, tstamp, value, tstamp)
+            for (z, x, y), (color, value) in rows.items()
+            if value is not None
+        ]
+
+        # Tile data goes first, so metadata never refers to missing data
+        if len(data_rows) > 0:
+            tilestor, lock = get_tile_db(db_path)
+            with lock:
+                try:
+                    cls._write_tile_data(tilestor, data_rows)
+                    tilestor.commit()
+                except Exception:
+                    tilestor.rollback()
+                    raise
+
+        cls._write_tile_meta(DBSession.connection(), table_uuid, meta)
+
+        # Force zope session management to commit changes
+        mark_changed(DBSession())
+
+    @staticmethod
+    def _write_tile_meta(conn, table_uuid, rows):
+        table = sa.table(
+            table_uuid,
+            sa.column("z"),
+            sa.column("x"),
+            sa.column("y"),
+            sa.column("color"),
+            sa.column("tstamp"),
+            schema="tile_cache",
+        )
+        stmt = pg_insert(table).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["z", "x", "y"],
+            set_=dict(color=stmt.excluded.color, tstamp=stmt.excluded.tstamp),
+            where=table.c.tstamp < stmt.excluded.tstamp,
+        )
+        conn.execute(stmt)
+
+    @staticmethod
+    def _write_tile_data(tilestor, rows):
         # fmt: off
-        tilestor.execute("""
+        tilestor.executemany("""
             INSERT INTO tile VALUES (?, ?, ?, ?, ?)
             ON CONFLICT (z, x, y) DO UPDATE
             SET tstamp = ?, data = ?
             WHERE tstamp < ?
-        """, (z, x, y, tstamp, value, tstamp, value, tstamp))
+        """, rows)
         # fmt: on
 
     def wait_for_shutdown(self, timeout=SHUTDOWN_TIMEOUT):
@@ -279,6 +334,92 @@ class TilestorWriter:
             return True
 
 
+@contextmanager
+def tile_advisory_lock(key, timeout):
+    """Hold a PostgreSQL advisory lock on a tile key, so other worker
+    processes can wait for the tile rendering. The lock is taken on the
+    DBSession connection and polled with pg_try_advisory_lock, so waiting
+    doesn't take another connection from the pool. Yields False if the lock
+    was acquired immediately, True if after waiting for another holder, and
+    None if waiting timed out."""
+
+    lock_id = int.from_bytes(
+        blake2b(repr(key).encode(), digest_size=8).digest(), "big", signed=True
+    )
+
+    conn = DBSession.connection()
+    params = dict(lock_id=lock_id)
+    sql_try_lock = sa.text("SELECT pg_try_advisory_lock(:lock_id)")
+
+    acquired = conn.execute(sql_try_lock, params).scalar()
+    waited = False
+    if not acquired:
+        waited = True
+        deadline = monotonic() + timeout
+        delay = LOCK_POLL_MIN
+        while not (acquired := conn.execute(sql_try_lock, params).scalar()):
+            if (remaining := deadline - monotonic()) <= 0:
+                waited = None
+                break
+            sleep(min(delay, remaining))
+            delay = min(delay * 2, LOCK_POLL_MAX)
+
+    try:
+        yield waited
+    finally:
+        if acquired:
+            try:
+                conn.execute(sa.text("SELECT pg_advisory_unlock(:lock_id)"), params)
+            except sa.exc.DBAPIError:
+                # Session-level locks outlive aborted transactions, so the
+                # connection is closed not to return it to the pool locked.
+                # The error is likely caused by the one raised from the body.
+                logger.warning("Failed to release tile advisory lock", exc_info=True)
+                conn.invalidate()
+
+
+class TileLRU:
+    """Per-process LRU cache of tiles found in tile caches bounded by size of
+    tile data. Keys include tile cache UUID, so entries of a flushed tile
+    cache just become unreachable and get evicted eventually."""
+
+    ENTRY_OVERHEAD = 128
+
+    def __init__(self, maxsize):
+        self._cache = LRUCache(maxsize=maxsize, getsizeof=self._sizeof)
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def _sizeof(cls, value):
+        data = value[2]
+        return cls.ENTRY_OVERHEAD + (len(data) if data is not None else 0)
+
+    def get(self, key):
+        with self._lock:
+            value = self._cache.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self._sizeof(value) > self._cache.maxsize:
+            return
+        with self._lock:
+            self._cache[key] = value
+
+    def discard(self, key):
+        with self._lock:
+            self._cache.pop(key, None)
+
+    @property
+    def currsize(self):
+        return self._cache.currsize
+
+
 class ResourceTileCache(Base):
     __tablename__ = "resource_tile_cache"
 
@@ -289,6 +430,7 @@ class ResourceTileCache(Base):
     enabled = sa.Column(sa.Boolean, nullable=False, default=False)
     image_compose = sa.Column(sa.Boolean, nullable=False, default=False)
     max_z = sa.Column(sa.SmallInteger)
+    metatile = sa.Column(sa.SmallInteger)
     ttl = sa.Column(sa.Integer)
 
     async_writing = False
@@ -309,6 +451,15 @@ class ResourceTileCache(Base):
         self.reconstructor()
         super().__init__(*args, **kwagrs)
 
+    @orm.validates("metatile")
+    def _validate_metatile(self, key, value):
+        # Metatiles must be aligned with the tile grid on all zoom levels
+        if value is not None and not (1 <= value <= METATILE_MAX and value & (value - 1) == 0):
+            raise ValidationError(
+                gettext("Metatile size should be a power of two between 1 and %d.") % METATILE_MAX
+            )
+        return value
+
     @orm.reconstructor
     def reconstructor(self):
         self._sameta = None
@@ -354,7 +505,32 @@ class ResourceTileCache(Base):
 
         return os.path.join(tcpath, suuid[0:2], suuid[2:4], suuid)
 
-    def get_tile(self, tile):
+    def lookup_tile(self, tile):
+        """Find a tile and return its (tstamp, color, data) tuple, where color
+        is a packed color for single-color tiles and data are PNG-encoded bytes
+        for other tiles. Returns None if the tile is missing or expired."""
+
+        z, x, y = tile
+        lru = env.render.tile_lru
+        key = (self.uuid.hex, z, x, y)
+
+        found = lru.get(key) if lru is not None else None
+        if found is None:
+            found = self._lookup_tile(tile)
+            if found is None:
+                return None
+            if lru is not None:
+                lru.put(key, found)
+
+        tstamp = found[0]
+        if self.ttl is not None:
+            expdt = TIMESTAMP_EPOCH + timedelta(seconds=tstamp + self.ttl)
+            if expdt <= datetime.utcnow():
+                return None
+
+        return found
+
+    def _lookup_tile(self, tile):
         z, x, y = tile
 
         conn = DBSession.connection()
@@ -368,14 +544,31 @@ class ResourceTileCache(Base):
         ).fetchone()
 
         if trow is None:
-            return False, None
+            return None
 
         color, tstamp = trow
 
-        if self.ttl is not None:
-            expdt = TIMESTAMP_EPOCH + timedelta(seconds=tstamp + self.ttl)
-            if expdt <= datetime.utcnow():
-                return False, None
+        if color is not None:
+            return tstamp, color, None
+
+        tilestor, lock = self.get_tilestor()
+        with lock:
+            srow = tilestor.execute(
+                "SELECT data FROM tile WHERE z = ? AND x = ? AND y = ?",
+                (z, x, y),
+            ).fetchone()
+
+        if srow is None:
+            return None
+
+        return tstamp, None, bytes(srow[0])
+
+    def get_tile(self, tile):
+        found = self.lookup_tile(tile)
+        if found is None:
+            return False, None
+
+        tstamp, color, data = found
 
         if color is not None:
             colors = unpack_color(color)
@@ -383,30 +576,29 @@ class ResourceTileCache(Base):
                 return True, None
             return True, Image.new("RGBA", (256, 256), colors)
 
-        else:
-            tilestor, lock = self.get_tilestor()
-            with lock:
-                srow = tilestor.execute(
-                    "SELECT data FROM tile WHERE z = ? AND x = ? AND y = ?",
-                    (z, x, y),
-                ).fetchone()
+        return True, Image.open(BytesIO(data))
 
-            if srow is None:
-                return False, None
+    def put_tile(self, tile, img, timeout=None, *, wait=None):
+        return self._queue_tiles([(tile, img)], timeout, wait)
 
-            return True, Image.open(BytesIO(srow[0]))
+    def _queue_tiles(self, tiles, timeout, wait):
+        lru = env.render.tile_lru
+        if lru is not None:
+            for tile, img in tiles:
+                lru.discard((self.uuid.hex,) + tuple(tile))
 
-    def put_tile(self, tile, img, timeout=None):
         params = dict(
-            tile=tile,
-            img=None if img is None else img.copy(),
+            tiles=[(tile, None if img is None else img.copy()) for tile, img in tiles],
             uuid=self.uuid.hex,
             db_path=self.tilestor_path,
         )
 
         writer = TilestorWriter.getInstance()
 
-        if self.async_writing:
+        if wait is None:
+            wait = self.async_writing
+
+        if wait:
             answer_queue = Queue(maxsize=1)
             params["answer_queue"] = answer_queue
 
@@ -417,13 +609,13 @@ class ResourceTileCache(Base):
         except TileWriterQueueException as exc:
             result = False
             logger.error(
-                "Failed to put tile {} to tile cache for resource {}. {}".format(
-                    params["tile"], self.resource_id, exc
+                "Failed to put tiles {} to tile cache for resource {}. {}".format(
+                    ", ".join(str(tile) for tile, img in tiles), self.resource_id, exc
                 ),
                 exc_info=True,
             )
 
-        if self.async_writing:
+        if wait and result:
             try:
                 answer_queue.get()
             except Exception:
@@ -431,6 +623,26 @@ class ResourceTileCache(Base):
 
         return result
 
+    def put_tiles(self, tiles, *, queued=False, timeout=None, wait=None):
+        """Write tiles given as (tile, img) pairs synchronously within the
+        current transaction bypassing the tile writer queue
+
+        If queued, tiles are put into the tile writer queue as a single item,
+        so they take one queue slot and are written in one batch."""
+
+        if queued:
+            return self._queue_tiles(tiles, timeout, wait)
+
+        lru = env.render.tile_lru
+        batch = []
+        for tile, img in tiles:
+            if lru is not None:
+                lru.discard((self.uuid.hex,) + tuple(tile))
+            batch.append(dict(tile=tile, img=img))
+
+        if len(batch) > 0:
+            TilestorWriter.write(self.tilestor_path, self.uuid.hex, batch)
+
     def initialize(self):
         self.sameta.create_all(bind=DBSession.connection())
 
@@ -503,6 +715,7 @@ class TileCacheSerializer(Serializer, apitype=True):
     enabled = TileCacheAttr(read=ResourceScope.read, write=ResourceScope.update)
     image_compose = TileCacheAttr(read=ResourceScope.read, write=ResourceScope.update)
     max_z = TileCacheAttr(read=ResourceScope.read, write=ResourceScope.update)
+    metatile = TileCacheAttr(read=ResourceScope.read, write=ResourceScope.update)
     ttl = TileCacheAttr(read=ResourceScope.read, write=ResourceScope.update)
 
     def is_applicable(self):
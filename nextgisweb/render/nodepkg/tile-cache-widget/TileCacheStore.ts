@@ -10,6 +10,7 @@ const {
     enabled: enabled,
     image_compose: imageCompose,
     max_z: maxZ,
+    metatile: metatile,
     ttl: ttl,
     flush: flush,
     $load: mapperLoad,
@@ -25,6 +26,7 @@ export class TileCacheStore implements EditorStore<Value> {
     enabled = enabled.init(false, this);
     imageCompose = imageCompose.init(false, this);
     maxZ = maxZ.init(null, this);
+    metatile = metatile.init(null, this);
     ttl = ttl.init(null, this);
     flush = flush.init(false, this);
 
@@ -46,6 +48,7 @@ export class TileCacheStore implements EditorStore<Value> {
             ...this.enabled.jsonPart(),
             ...this.imageCompose.jsonPart(),
             ...this.maxZ.jsonPart(),
+            ...this.metatile.jsonPart(),
             ...this.ttl.jsonPart(),
             ...this.flush.jsonPart(),
         };
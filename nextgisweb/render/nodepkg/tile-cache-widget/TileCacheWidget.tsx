@@ -1,7 +1,7 @@
 import { observer } from "mobx-react-lite";
 import { useCallback } from "react";
 
-import { CheckboxValue, InputNumber } from "@nextgisweb/gui/antd";
+import { CheckboxValue, InputNumber, Select } from "@nextgisweb/gui/antd";
 import type { CheckboxValueProps } from "@nextgisweb/gui/antd";
 import { LotMV } from "@nextgisweb/gui/arm";
 import { Area } from "@nextgisweb/gui/mayout";
@@ -13,6 +13,12 @@ import type {
 
 import type { TileCacheStore } from "./TileCacheStore";
 
+// Metatiles must be aligned with the tile grid
+const metatileOptions = [1, 2, 4, 8, 16].map((value) => ({
+    value,
+    label: `${value}×${value}`,
+}));
+
 export const TileCacheWidget: EditorWidgetComponent<
     EditorWidgetProps<TileCacheStore>
 > = observer(({ store }) => {
@@ -67,6 +73,16 @@ export const TileCacheWidget: EditorWidgetComponent<
                     max: 18,
                 }}
             />
+            <LotMV
+                label={gettext("Metatile size")}
+                value={store.metatile}
+                component={Select}
+                props={{
+                    options: metatileOptions,
+                    allowClear: true,
+                    style: { width: "100%" },
+                }}
+            />
             <LotMV
                 label={gettext("TTL, sec.")}
                 value={store.ttl}
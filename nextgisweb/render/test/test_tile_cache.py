@@ -6,6 +6,7 @@ from PIL import Image, ImageDraw
 
 from nextgisweb.env import DBSession
 
+from nextgisweb.core.exception import ValidationError
 from nextgisweb.raster_layer import RasterLayer
 from nextgisweb.raster_style import RasterStyle
 
@@ -106,6 +107,26 @@ def test_get_missing(frtc):
     assert not exists
 
 
+def test_put_tiles_queued(frtc, img_cross_red, img_fill):
+    tiles = [((1, 0, 0), img_cross_red), ((1, 1, 0), img_fill), ((1, 0, 1), None)]
+    assert frtc.put_tiles(tiles, queued=True)
+    for tile, img in tiles:
+        exists, cimg = frtc.get_tile(tile)
+        assert exists
+        assert (cimg is None) if img is None else (cimg.getextrema() == img.getextrema())
+
+
+@pytest.mark.parametrize(
+    "metatile, valid", [(1, True), (4, True), (16, True), (3, False), (32, False)]
+)
+def test_metatile_validation(metatile, valid):
+    if valid:
+        assert ResourceTileCache(metatile=metatile).metatile == metatile
+    else:
+        with pytest.raises(ValidationError):
+            ResourceTileCache(metatile=metatile)
+
+
 def test_ttl(frtc, img_cross_red):
     tile = (0, 0, 0)
     frtc.ttl = 1
@@ -121,3 +142,38 @@ def test_clear(frtc, img_cross_red):
     frtc.clear()
     exists, cimg = frtc.get_tile(tile)
     assert not exists
+
+
+def test_lru(frtc, img_cross_red, ngw_env):
+    lru = ngw_env.render.tile_lru
+    if lru is None:
+        pytest.skip("Tile memory cache is disabled")
+
+    tile = (0, 0, 0)
+    frtc.put_tile(tile, img_cross_red)
+
+    exists, cimg = frtc.get_tile(tile)
+    assert exists
+
+    hits = lru.hits
+    exists, cimg = frtc.get_tile(tile)
+    assert exists and cimg.getextrema() == img_cross_red.getextrema()
+    assert lru.hits == hits + 1
+
+
+@pytest.mark.usefixtures("ngw_auth_administrator")
+def test_tile_etag(frtc, img_cross_red, ngw_webtest_app):
+    with transaction.manager:
+        ResourceTileCache.filter_by(resource_id=frtc.resource_id).update(dict(enabled=True))
+
+    frtc.put_tile((0, 0, 0), img_cross_red)
+
+    url = "/api/component/render/tile"
+    params = dict(resource=frtc.resource_id, z=0, x=0, y=0)
+
+    resp = ngw_webtest_app.get(url, params, status=200)
+    assert resp.etag is not None
+    assert resp.body[:8] == b"\x89PNG\r\n\x1a\n"
+
+    headers = {"If-None-Match": '"%s"' % resp.etag}
+    ngw_webtest_app.get(url, params, headers=headers, status=304)
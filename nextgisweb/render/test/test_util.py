@@ -1,4 +1,8 @@
-from ..util import scale_range_intersection
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+from time import sleep
+
+from ..util import SingleFlight, scale_range_intersection
 
 
 def test_scale_range_intersection():
@@ -6,3 +10,26 @@ def test_scale_range_intersection():
     assert sri((None, None), (None, None)) == (None, None)
     assert sri((100_000, None), (None, 10_000)) == (100_000, 10_000)
     assert sri((100_000, 10_000), (200_000, 20_000)) == (100_000, 20_000)
+
+
+def test_single_flight():
+    flight = SingleFlight()
+    started, release = Event(), Event()
+    calls = []
+
+    def fn(value):
+        calls.append(value)
+        started.set()
+        release.wait(5)
+        return value
+
+    with ThreadPoolExecutor(4) as executor:
+        leader = executor.submit(flight.do, "key", fn, 1)
+        started.wait(5)
+        followers = [executor.submit(flight.do, "key", fn, 2) for i in range(3)]
+        sleep(0.1)  # Let followers join the flight
+        release.set()
+        assert [f.result() for f in (leader, *followers)] == [1] * 4
+
+    assert calls == [1]
+    assert flight.do("key", fn, 3) == 3
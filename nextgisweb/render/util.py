@@ -1,4 +1,6 @@
 import struct
+from concurrent.futures import Future
+from threading import Lock
 
 import PIL.ImageStat
 from affine import Affine
@@ -79,3 +81,35 @@ def scale_range_intersection(a, b):
         max_i = max(max_a, max_b)
 
     return (min_i, max_i)
+
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key, so the function is called
+    once and other callers wait for its result"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._calls = dict()
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+        return result
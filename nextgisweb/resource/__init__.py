@@ -1,5 +1,11 @@
 from .component import ResourceComponent
 from .exception import DisplayNameNotUnique, HierarchyError, ResourceNotFound, ValidationError
+from .export_job import (
+    ExportJobKind,
+    ExportJobResult,
+    ResourceExportJob,
+    export_job_invalidation,
+)
 from .favorite import ResourceFavoriteModel
 from .interface import IResourceAdapter, IResourceBase, interface_registry
 from .model import (
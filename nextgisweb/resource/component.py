@@ -1,4 +1,6 @@
 import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 from typing import Literal
 
 import sqlalchemy as sa
@@ -46,6 +48,13 @@ class ResourceComponent(Component):
 
         self.quota_resource_by_cls = self.parse_quota_resource_by_cls()
 
+        # Threads are started on demand, so it's safe to create the executor
+        # before forking worker processes.
+        self.export_job_executor = ThreadPoolExecutor(
+            max_workers=self.options["export_job.workers"],
+            thread_name_prefix="export_job",
+        )
+
     def parse_quota_resource_by_cls(self):
         quota_resource_by_cls = dict()
 
@@ -124,9 +133,25 @@ class ResourceComponent(Component):
     @require("auth")
     def setup_pyramid(self, config):
         from . import api, view
+        from .export_job import api as export_job_api
 
         view.setup_pyramid(self, config)
         api.setup_pyramid(self, config)
+        export_job_api.setup_pyramid(self, config)
+
+    def maintenance(self):
+        super().maintenance()
+        self.cleanup()
+
+    def cleanup(self):
+        from .export_job import export_job_cleanup
+
+        export_job_cleanup()
+
+    def backup_configure(self, config):
+        super().backup_configure(config)
+        config.exclude_table_data("public", "resource_export_job")
+        config.exclude_table_data("public", "resource_export_job_resource")
 
     @property
     def template_include(self):
@@ -166,5 +191,9 @@ class ResourceComponent(Component):
         Option("home.enabled", bool, default=False),
         Option("home.keyname", str, default="resource_home"),
         Option("home.groups", list, default=[]),
+
+        Option("export_job.workers", int, default=2, doc="Number of threads running export jobs in each process."),
+        Option("export_job.ttl", timedelta, default=timedelta(days=1), doc="Time to keep export job results."),
+        Option("export_job.stale_timeout", timedelta, default=timedelta(minutes=30), doc="Time after which pending or running export jobs without progress are considered failed."),
     )
     # fmt: on
@@ -0,0 +1,11 @@
+from .base import (
+    ExportJobKind,
+    ExportJobResult,
+    export_job_cleanup,
+    export_job_fail_stale,
+    export_job_invalidate,
+    export_job_invalidation,
+    export_job_run,
+    export_job_submit,
+)
+from .model import ResourceExportJob
@@ -0,0 +1,120 @@
+from datetime import datetime
+from typing import Any, Dict, Literal, Union
+
+from msgspec import Struct
+from pyramid.httpexceptions import HTTPNotFound
+from pyramid.response import FileResponse
+from zope.event.classhandler import handler
+
+from nextgisweb.env import gettext
+
+from nextgisweb.core.exception import ValidationError
+from nextgisweb.pyramid.util import set_output_buffering
+
+from ..event import AfterResourcePut
+from ..scope import DataScope
+from .base import ExportJobKind, export_job_invalidate, export_job_submit
+from .model import ResourceExportJob
+
+
+class ExportJobCreate(Struct, kw_only=True):
+    kind: str
+    params: Dict[str, Any]
+
+
+class ExportJobRead(Struct, kw_only=True):
+    id: str
+    kind: str
+    status: Literal["pending", "running", "done", "failed"]
+    progress: Union[float, None]
+    error: Union[str, None]
+    created: datetime
+    expires: datetime
+    download: Union[str, None]
+
+
+def _job_read(job, request):
+    return ExportJobRead(
+        id=job.id,
+        kind=job.kind,
+        status=job.status,
+        progress=job.progress,
+        error=job.error,
+        created=job.created,
+        expires=job.expires,
+        download=(
+            request.route_url("resource.export_job.download", id=job.id)
+            if job.status == "done"
+            else None
+        ),
+    )
+
+
+def _job_get(id, request):
+    job = ResourceExportJob.filter(
+        ResourceExportJob.id == id,
+        ResourceExportJob.expires > datetime.utcnow(),
+    ).first()
+    if job is None:
+        raise HTTPNotFound()
+
+    for res in job.resources:
+        request.resource_permission(DataScope.read, res)
+
+    return job
+
+
+def cpost(request, body: ExportJobCreate) -> ExportJobRead:
+    """Submit export job or get existing one with the same parameters"""
+    if body.kind not in ExportJobKind.registry:
+        raise ValidationError(
+            message=gettext("Export job kind '%s' is not supported.") % body.kind
+        )
+
+    job = export_job_submit(body.kind, body.params, request=request)
+    return _job_read(job, request)
+
+
+def iget(request, id: str) -> ExportJobRead:
+    """Read export job status and progress"""
+    return _job_read(_job_get(id, request), request)
+
+
+def download(request, id: str) -> FileResponse:
+    """Download export job result"""
+    job = _job_get(id, request)
+    if job.status != "done":
+        raise ValidationError(message=gettext("Export job is not completed yet."))
+
+    response = FileResponse(
+        job.fileobj.filename(),
+        content_type=job.content_type,
+        request=request,
+    )
+    response.content_disposition = f"attachment; filename={job.filename}"
+    set_output_buffering(request, response, False)
+    return response
+
+
+def setup_pyramid(comp, config):
+    config.add_route(
+        "resource.export_job.collection",
+        "/api/component/resource/export_job/",
+        post=cpost,
+    )
+
+    config.add_route(
+        "resource.export_job.item",
+        "/api/component/resource/export_job/{id}",
+        get=iget,
+    )
+
+    config.add_route(
+        "resource.export_job.download",
+        "/api/component/resource/export_job/{id}/download",
+        get=download,
+    )
+
+    @handler(AfterResourcePut)
+    def _invalidate_export_jobs(event):
+        export_job_invalidate(event.resource.id)
@@ -0,0 +1,252 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import tempfile
+from datetime import datetime
+from functools import wraps
+from time import monotonic
+from typing import Any, Callable, ClassVar, Dict, List, Mapping, NamedTuple, Type
+from uuid import uuid4
+
+import sqlalchemy as sa
+import transaction
+from zope.sqlalchemy import mark_changed
+
+from nextgisweb.env import DBSession, env, gettext
+from nextgisweb.lib.logging import logger
+from nextgisweb.lib.registry import dict_registry
+
+from nextgisweb.core.exception import IUserException
+from nextgisweb.file_storage import FileObj
+
+from ..model import Resource
+from .model import ResourceExportJob, tab_export_job_resource
+
+Progress = Callable[[float], None]
+
+
+class ExportJobResult(NamedTuple):
+    path: str
+    filename: str
+    content_type: str
+
+
+@dict_registry
+class ExportJobKind:
+    """Export which can be submitted as a job and run by a background worker
+
+    Subclasses are registered by their identity, which is used as the job kind
+    in the API. They are expected to validate parameters and check permissions
+    in :meth:`prepare`, which is called in the request context, and to write a
+    file into a working directory in :meth:`run`, which is called in a worker
+    thread without a request."""
+
+    registry: ClassVar[Mapping[str, Type[ExportJobKind]]]
+    identity: ClassVar[str]
+
+    @classmethod
+    def prepare(cls, params: Dict[str, Any], *, request) -> List[Resource]:
+        """Validate job parameters and return the list of exported resources"""
+        raise NotImplementedError
+
+    @classmethod
+    def dedupe(cls, resource: Resource) -> bool:
+        """Whether a result can be reused while the resource isn't changed
+
+        Results are invalidated on changes made through the Web GIS, so it
+        should return False for resources with data in external storages."""
+        return True
+
+    @classmethod
+    def run(cls, params: Dict[str, Any], *, workdir: str, progress: Progress) -> ExportJobResult:
+        raise NotImplementedError
+
+
+def export_job_submit(identity, params, *, request) -> ResourceExportJob:
+    """Create an export job or return an existing one with the same
+    parameters if its result is still valid"""
+
+    kind = ExportJobKind.registry[identity]
+    resources = kind.prepare(params, request=request)
+
+    now = datetime.utcnow()
+    expires = now + env.resource.options["export_job.ttl"]
+
+    dedupe_key = None
+    if all(kind.dedupe(res) for res in resources):
+        dedupe_key = hashlib.sha256(
+            json.dumps([identity, params], sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+        job = (
+            ResourceExportJob.filter(
+                ResourceExportJob.dedupe_key == dedupe_key,
+                ResourceExportJob.status != "failed",
+                ResourceExportJob.expires > now,
+                ~ResourceExportJob.stale(now),
+            )
+            .order_by(ResourceExportJob.created.desc())
+            .first()
+        )
+        if job is not None:
+            job.expires = max(job.expires, expires)
+            return job
+
+    job = ResourceExportJob(
+        id=uuid4().hex,
+        kind=identity,
+        params=params,
+        dedupe_key=dedupe_key,
+        status="pending",
+        created=now,
+        expires=expires,
+        resources=resources,
+    ).persist()
+
+    # Workers must not see the job until it's committed
+    def _after_commit(success, job_id):
+        if success:
+            env.resource.export_job_executor.submit(export_job_run, job_id)
+
+    transaction.get().addAfterCommitHook(_after_commit, (job.id,))
+    return job
+
+
+def export_job_invalidate(resource_id):
+    """Prevent reuse of export results which include the resource"""
+
+    result = DBSession.execute(
+        sa.update(ResourceExportJob)
+        .where(
+            ResourceExportJob.dedupe_key.isnot(None),
+            ResourceExportJob.id.in_(
+                sa.select(tab_export_job_resource.c.job_id).where(
+                    tab_export_job_resource.c.resource_id == resource_id
+                )
+            ),
+        )
+        .values(dedupe_key=None)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount > 0:
+        mark_changed(DBSession())
+
+
+def export_job_invalidation(func):
+    """Decorator for resource methods which change its data and invalidate
+    export results which include the resource"""
+
+    @wraps(func)
+    def wrapped(resource, *args, **kwargs):
+        result = func(resource, *args, **kwargs)
+        export_job_invalidate(resource.id)
+        return result
+
+    return wrapped
+
+
+def _progress_writer(job_id, interval=1):
+    tab = ResourceExportJob.__table__
+    last = monotonic()
+
+    def progress(value):
+        nonlocal last
+        if (now := monotonic()) - last < interval:
+            return
+        last = now
+
+        # The job is running in its own transaction, so progress is written
+        # with a separate connection to make it visible immediately
+        with env.core.engine.begin() as conn:
+            conn.execute(
+                sa.update(tab)
+                .where(tab.c.id == job_id)
+                .values(progress=min(max(value, 0), 1), heartbeat=datetime.utcnow())
+            )
+
+    return progress
+
+
+def export_job_run(job_id):
+    try:
+        with transaction.manager:
+            row = DBSession.execute(
+                sa.update(ResourceExportJob)
+                .where(ResourceExportJob.id == job_id, ResourceExportJob.status == "pending")
+                .values(status="running", progress=0, heartbeat=datetime.utcnow())
+                .returning(ResourceExportJob.kind, ResourceExportJob.params)
+                .execution_options(synchronize_session=False)
+            ).first()
+            if row is None:
+                return
+            mark_changed(DBSession())
+
+        identity, params = row
+        kind = ExportJobKind.registry[identity]
+
+        with tempfile.TemporaryDirectory() as workdir, transaction.manager:
+            result = kind.run(params, workdir=workdir, progress=_progress_writer(job_id))
+
+            job = ResourceExportJob.filter_by(id=job_id).one()
+            job.fileobj = FileObj(component="resource").copy_from(result.path)
+            job.filename = result.filename
+            job.content_type = result.content_type
+            job.status = "done"
+            job.progress = 1
+    except Exception as exc:
+        logger.exception("Export job %s failed", job_id)
+
+        if user_exc := IUserException(exc, None):
+            error = env.core.localizer().translate(user_exc.message or user_exc.title)
+        else:
+            error = env.core.localizer().translate(gettext("Unexpected error"))
+
+        with transaction.manager:
+            job = ResourceExportJob.filter_by(id=job_id).first()
+            if job is not None:
+                job.status = "failed"
+                job.error = error
+
+
+def export_job_fail_stale(now=None):
+    """Mark jobs abandoned by dead workers as failed, so they aren't polled
+    and reused forever"""
+
+    if now is None:
+        now = datetime.utcnow()
+
+    result = DBSession.execute(
+        sa.update(ResourceExportJob)
+        .where(ResourceExportJob.stale(now))
+        .values(
+            status="failed",
+            error=env.core.localizer().translate(gettext("Export job was interrupted")),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount > 0:
+        mark_changed(DBSession())
+    return result.rowcount
+
+
+def export_job_cleanup():
+    """Delete expired export jobs and their result files and fail stale jobs"""
+
+    with transaction.manager:
+        now = datetime.utcnow()
+        stale = export_job_fail_stale(now)
+        jobs = ResourceExportJob.filter(ResourceExportJob.expires < now).all()
+
+        fileobj_ids = set(job.fileobj_id for job in jobs if job.fileobj_id is not None)
+        for job in jobs:
+            DBSession.delete(job)
+        DBSession.flush()
+
+        if fileobj_ids:
+            FileObj.filter(
+                FileObj.id.in_(fileobj_ids),
+                ~sa.exists().where(ResourceExportJob.fileobj_id == FileObj.id),
+            ).delete(synchronize_session=False)
+
+        logger.info("Expired export jobs deleted: %d, stale jobs failed: %d", len(jobs), stale)
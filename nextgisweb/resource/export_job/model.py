@@ -0,0 +1,64 @@
+import sqlalchemy as sa
+import sqlalchemy.dialects.postgresql as sa_pg
+import sqlalchemy.orm as orm
+
+from nextgisweb.env import Base, env
+from nextgisweb.lib import saext
+
+from nextgisweb.file_storage import FileObj
+
+from ..model import Resource
+
+EXPORT_JOB_STATUS = ("pending", "running", "done", "failed")
+
+tab_export_job_resource = sa.Table(
+    "resource_export_job_resource",
+    Base.metadata,
+    sa.Column(
+        "job_id",
+        sa.Unicode(32),
+        sa.ForeignKey("resource_export_job.id", ondelete="CASCADE"),
+        primary_key=True,
+    ),
+    sa.Column(
+        "resource_id",
+        sa.Integer,
+        sa.ForeignKey(Resource.id, ondelete="CASCADE"),
+        primary_key=True,
+    ),
+)
+
+
+class ResourceExportJob(Base):
+    __tablename__ = "resource_export_job"
+
+    id = sa.Column(sa.Unicode(32), primary_key=True)
+    kind = sa.Column(sa.Unicode, nullable=False)
+    params = sa.Column(sa_pg.JSONB, nullable=False)
+    dedupe_key = sa.Column(sa.Unicode(64), nullable=True)
+    status = sa.Column(saext.Enum(*EXPORT_JOB_STATUS), nullable=False)
+    progress = sa.Column(sa.Float, nullable=True)
+    error = sa.Column(sa.Unicode, nullable=True)
+    created = sa.Column(sa.DateTime, nullable=False)
+    heartbeat = sa.Column(sa.DateTime, nullable=True)
+    expires = sa.Column(sa.DateTime, nullable=False)
+    fileobj_id = sa.Column(sa.ForeignKey(FileObj.id), nullable=True)
+    filename = sa.Column(sa.Unicode, nullable=True)
+    content_type = sa.Column(sa.Unicode, nullable=True)
+
+    fileobj = orm.relationship(FileObj)
+    resources = orm.relationship(Resource, secondary=tab_export_job_resource, passive_deletes=True)
+
+    __table_args__ = (sa.Index("resource_export_job_dedupe_key_idx", dedupe_key),)
+
+    @classmethod
+    def stale(cls, now):
+        """Condition for jobs whose worker has probably died: running jobs
+        without progress for the export_job.stale_timeout. Pending jobs may
+        wait for a free worker for any time, so they're never stale."""
+
+        return sa.and_(
+            cls.status == "running",
+            sa.func.coalesce(cls.heartbeat, cls.created)
+            < now - env.resource.options["export_job.stale_timeout"],
+        )
@@ -0,0 +1,37 @@
+/*** {
+    "revision": "473268e1", "parents": ["45f6d7cf"],
+    "date": "2024-09-25T09:30:00",
+    "message": "Add resource_export_job tables"
+} ***/
+
+CREATE TABLE resource_export_job (
+    id character varying(32) NOT NULL,
+    kind character varying NOT NULL,
+    params jsonb NOT NULL,
+    dedupe_key character varying(64),
+    status character varying(50) NOT NULL,
+    progress double precision,
+    error character varying,
+    created timestamp without time zone NOT NULL,
+    heartbeat timestamp without time zone,
+    expires timestamp without time zone NOT NULL,
+    fileobj_id integer,
+    filename character varying,
+    content_type character varying,
+    CONSTRAINT resource_export_job_pkey PRIMARY KEY (id),
+    CONSTRAINT resource_export_job_fileobj_id_fkey FOREIGN KEY (fileobj_id) REFERENCES fileobj(id)
+);
+
+CREATE INDEX resource_export_job_dedupe_key_idx ON resource_export_job USING btree (dedupe_key);
+
+COMMENT ON TABLE resource_export_job IS 'resource';
+
+CREATE TABLE resource_export_job_resource (
+    job_id character varying(32) NOT NULL,
+    resource_id integer NOT NULL,
+    CONSTRAINT resource_export_job_resource_pkey PRIMARY KEY (job_id, resource_id),
+    CONSTRAINT resource_export_job_resource_job_id_fkey FOREIGN KEY (job_id) REFERENCES resource_export_job(id) ON DELETE CASCADE,
+    CONSTRAINT resource_export_job_resource_resource_id_fkey FOREIGN KEY (resource_id) REFERENCES resource(id) ON DELETE CASCADE
+);
+
+COMMENT ON TABLE resource_export_job_resource IS 'resource';
@@ -0,0 +1,4 @@
+/*** { "revision": "473268e1" } ***/
+
+DROP TABLE resource_export_job_resource;
+DROP TABLE resource_export_job;
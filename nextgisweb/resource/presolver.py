@@ -1,5 +1,12 @@
 from collections import defaultdict, namedtuple
 
+import sqlalchemy as sa
+from sqlalchemy.orm import selectinload, with_polymorphic
+
+from nextgisweb.env import DBSession
+
+from .model import Resource, ResourceACLRule
+
 ExplainDefault = namedtuple("ExplainDefault", ["result", "resource"])
 ExplainACLRule = namedtuple("ExplainACLRule", ["result", "resource", "acl_rule"])
 ExplainRequirement = namedtuple(
@@ -142,3 +149,54 @@ def _acl_rules(resource, user, permissions):
             for perm in permissions:
                 if rule.cmp_permission(perm):
                     yield perm, rule
+
+
+def load_resources(ids, options=()):
+    """Load resources with their parents and ACL rules in a few queries, so
+    permissions can be resolved without additional database round-trips.
+    Additional loader options may be given. Returns loaded resources by ID."""
+
+    chain = (
+        sa.select(Resource.id, Resource.parent_id)
+        .where(Resource.id.in_(ids))
+        .cte("chain", recursive=True)
+    )
+    chain = chain.union(
+        sa.select(Resource.id, Resource.parent_id).join(chain, Resource.id == chain.c.parent_id)
+    )
+
+    chain_cls = DBSession.query(Resource.cls).where(Resource.id.in_(sa.select(chain.c.id)))
+    polymorphic = with_polymorphic(
+        Resource, [Resource.registry[res_cls] for (res_cls,) in chain_cls.distinct()]
+    )
+
+    query = (
+        DBSession.query(polymorphic)
+        .options(
+            selectinload(polymorphic.acl).joinedload(ResourceACLRule.principal),
+            *options,
+        )
+        .where(polymorphic.id.in_(sa.select(chain.c.id)))
+    )
+
+    # Parents are looked up in the session identity map, so the whole chain is
+    # loaded here, but only requested resources are returned.
+    loaded = {obj.id: obj for obj in query}
+    return {resid: loaded[resid] for resid in ids if resid in loaded}
+
+
+def resolve_permission(resources, user, permission):
+    """Resolve a single permission for several resources in bulk"""
+
+    result = dict()
+    for res in resources:
+        if res in result:
+            continue
+        if permission not in res.class_permissions():
+            result[res] = False
+        elif user.superuser:
+            result[res] = True
+        else:
+            resolver = PermissionResolver(res, user, (permission,))
+            result[res] = resolver._result[permission] is True
+    return result
@@ -7,8 +7,8 @@ from nextgisweb.env import DBSession
 from nextgisweb.auth import Group, User
 
 from ..model import Resource, ResourceACLRule, ResourceGroup
-from ..presolver import PermissionResolver
-from ..scope import ResourceScope
+from ..presolver import PermissionResolver, load_resources, resolve_permission
+from ..scope import DataScope, ResourceScope
 
 pytestmark = pytest.mark.usefixtures("ngw_auth_administrator")
 
@@ -178,3 +178,15 @@ def test_admin_permissions(admin, ngw_webtest_app, ngw_resource_group):
     check(dict(scope="resource", permission="read"), 422)
     check(dict(scope="resource", permission="update"), 422)
     check(dict(scope="resource", permission="change_permissions"), 422)
+
+
+def test_resolve_permission_bulk(ngw_resource_group, ngw_txn):
+    loaded = load_resources([ngw_resource_group, 0, -1])
+    assert set(loaded) == {ngw_resource_group, 0}
+
+    resources = list(loaded.values())
+    for keyname in ("administrator", "guest"):
+        user = User.filter_by(keyname=keyname).one()
+        for permission in (ResourceScope.read, DataScope.read):
+            result = resolve_permission(resources, user, permission)
+            assert result == {r: r.has_permission(permission, user) for r in resources}
@@ -1,7 +1,9 @@
+import os
 from datetime import timedelta
 
 from nextgisweb.env import Component, require
 from nextgisweb.lib.config import Option
+from nextgisweb.lib.httpcache import HTTPCache
 
 from .model import SCHEME
 
@@ -12,6 +14,24 @@ class TMSClientComponent(Component):
 
         self.headers = {"User-Agent": self.options["user_agent"]}
 
+        self.upstream_cache = None
+        if (
+            self.options["upstream_cache.enabled"]
+            and (path := self.env.core.gtsdir(self)) is not None
+        ):
+            os.makedirs(path, exist_ok=True)
+            self.upstream_cache = HTTPCache(
+                os.path.join(path, "upstream_cache.sqlite"),
+                max_size=self.options["upstream_cache.size"],
+                ttl=self.options["upstream_cache.ttl"],
+            )
+
+    def sys_info(self):
+        from .tile_fetcher import TileFetcher
+
+        if (tile_fetcher := TileFetcher.instance(create=False)) is not None:
+            yield ("Tile fetcher", str(tile_fetcher.stats))
+
     def client_settings(self, request):
         return dict(schemes=SCHEME.enum)
 
@@ -28,5 +48,10 @@ class TMSClientComponent(Component):
         Option("nextgis_geoservices.url_template", default="https://geoservices.nextgis.com/raster/{layer}/{z}/{x}/{y}.png"),
         Option("user_agent", default="NextGIS Web"),
         Option("timeout", timedelta, default=timedelta(seconds=15)),
+        Option("upstream_cache.enabled", bool, default=False, doc="Cache upstream responses on disk."),
+        Option("upstream_cache.size", int, default=2**30, doc="Upstream cache size limit in bytes."),
+        Option("upstream_cache.ttl", timedelta, default=timedelta(days=1), doc="Default lifetime of cached upstream responses."),
+        Option("fetcher.host_connections", int, default=8, doc="Maximum number of concurrent requests to a single upstream host."),
+        Option("fetcher.max_inflight", int, default=64, doc="Maximum number of concurrent upstream requests of all layers."),
     )
     # fmt: on
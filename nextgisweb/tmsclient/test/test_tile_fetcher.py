@@ -0,0 +1,56 @@
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from time import sleep
+from types import SimpleNamespace
+
+import pytest
+
+from ..tile_fetcher import TileFetcher
+from ..util import SCHEME
+
+
+@pytest.fixture(scope="module")
+def tile_server():
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            sleep(0.1)
+            body = self.path.encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    yield "http://127.0.0.1:%d" % server.server_port
+    server.shutdown()
+
+
+def test_concurrent_jobs(tile_server, ngw_env):
+    connection = SimpleNamespace(
+        url_template=tile_server + "/{z}/{x}/{y}",
+        scheme=SCHEME.XYZ,
+        query_params=None,
+        username=None,
+        password=None,
+        insecure=False,
+    )
+    tile_fetcher = TileFetcher.instance()
+
+    def fetch(x):
+        return dict(tile_fetcher.get_tiles(connection, None, 3, x, x + 1, 0, 1))
+
+    with ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(fetch, range(4)))
+
+    for x, tiles in enumerate(results):
+        assert len(tiles) == 4
+        assert tiles[(1, 1)] == b"/3/%d/1" % (x + 1)
+
+    assert tile_fetcher.stats.jobs == 0
+    assert tile_fetcher.stats.inflight == 0
+    assert tile_fetcher.stats.requests >= 16
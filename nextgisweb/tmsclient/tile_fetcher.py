@@ -1,13 +1,16 @@
 import asyncio
 import atexit
+from contextlib import asynccontextmanager
 from dataclasses import dataclass
 from queue import Empty, Queue
-from threading import Thread
+from threading import Lock, Thread
+from time import monotonic
 from typing import Optional, Tuple
 
-from httpx import AsyncClient, Limits, RemoteProtocolError, Timeout, TimeoutException
+from httpx import URL, AsyncClient, Limits, RemoteProtocolError, Timeout, TimeoutException
 
 from nextgisweb.env import env, gettext
+from nextgisweb.lib.httpcache import cache_key, cacheable_response
 
 from nextgisweb.core.exception import ExternalServiceError
 
@@ -32,36 +35,125 @@ class FetchResult:
     exception: Optional[Exception] = None
 
 
+@dataclass
+class FetchStats:
+    jobs: int = 0
+    queued: int = 0
+    inflight: int = 0
+    requests: int = 0
+    errors: int = 0
+    latency: float = 0
+
+    def __str__(self):
+        latency = self.latency / self.requests * 1000 if self.requests else 0
+        return (
+            f"{self.jobs} jobs, {self.queued} queued, {self.inflight} in flight, "
+            f"{self.requests} requests, {self.errors} errors, "
+            f"{latency:.0f} ms average latency"
+        )
+
+
 class TimeoutError(ExternalServiceError):
     message = gettext("The remote server did not respond in time.")
 
 
+def _tile_data(response):
+    if response.status_code == 200:
+        return response.content
+    elif response.status_code in (204, 404):
+        return None
+    raise ExternalServiceError(
+        gettext("An unexpected HTTP status code was received from the remote server."),
+        data=dict(status_code=response.status_code),
+    )
+
+
 class TileFetcher:
-    __instance = None
+    """Fetch tiles of multiple requests concurrently on a shared event loop
 
-    def __init__(self):
-        if TileFetcher.__instance is None:
-            self._request_timeout = env.tmsclient.options["timeout"].total_seconds()
-            self._session_timeout = self._request_timeout * 2
+    Each request is a job running as a task in the loop thread. Tile requests
+    wait for a slot limited per upstream host and for a slot limited by the
+    global number of requests in flight. A job is cancelled with its pending
+    tile requests if the caller times out or stops iterating."""
 
-            self._queue = Queue(maxsize=1)
-            self._loop = asyncio.new_event_loop()
+    __instance = None
+    __instance_lock = Lock()
 
-            self._worker = Thread(target=self._job, daemon=True)
-            self._worker.start()
+    def __init__(self):
+        opts = env.tmsclient.options
+        self._request_timeout = opts["timeout"].total_seconds()
+        self._session_timeout = self._request_timeout * 2
+        self._host_connections = opts["fetcher.host_connections"]
+        self._max_inflight = opts["fetcher.max_inflight"]
+
+        self.stats = FetchStats()
+
+        # Created in the loop thread as asyncio primitives are bound to it
+        self._clients = dict()
+        self._host_slots = dict()
+        self._inflight = None
+
+        self._loop = asyncio.new_event_loop()
+        self._worker = Thread(target=self._loop.run_forever, name="tile_fetcher", daemon=True)
+        self._worker.start()
+        atexit.register(self._wait_for_shutdown)
 
     @classmethod
-    def instance(cls):
-        if cls.__instance is None:
-            cls.__instance = TileFetcher()
+    def instance(cls, *, create=True):
+        if cls.__instance is None and create:
+            with cls.__instance_lock:
+                if cls.__instance is None:
+                    cls.__instance = TileFetcher()
         return cls.__instance
 
+    def _client(self, insecure):
+        if (client := self._clients.get(insecure)) is None:
+            client = self._clients[insecure] = AsyncClient(
+                headers=env.tmsclient.headers,
+                limits=Limits(
+                    max_connections=self._max_inflight,
+                    max_keepalive_connections=self._max_inflight,
+                ),
+                verify=not insecure,
+                http2=True,
+            )
+        return client
+
+    @asynccontextmanager
+    async def _slot(self, host):
+        if self._inflight is None:
+            self._inflight = asyncio.Semaphore(self._max_inflight)
+        if (host_slots := self._host_slots.get(host)) is None:
+            host_slots = self._host_slots[host] = asyncio.Semaphore(self._host_connections)
+
+        self.stats.queued += 1
+        try:
+            # Take a host slot first not to hold a global one while waiting
+            await host_slots.acquire()
+            try:
+                await self._inflight.acquire()
+            except BaseException:
+                host_slots.release()
+                raise
+        finally:
+            self.stats.queued -= 1
+
+        self.stats.inflight += 1
+        try:
+            yield
+        finally:
+            self.stats.inflight -= 1
+            self._inflight.release()
+            host_slots.release()
+
     async def _get_tiles(
         self,
         tasks,
         client,
         *,
         req_kw,
+        cache,
+        cache_credentials,
         scheme,
         url_template,
         zoom,
@@ -76,26 +168,52 @@ class TileFetcher:
 
             url = url_template.format(x=xtile, y=ytile, z=zoom, q=quad_key(xtile, ytile, zoom))
 
+            entry = None
+            if cache is not None:
+                key = cache_key(str(URL(url, params=req_kw.get("params"))), **cache_credentials)
+                entry = await loop.run_in_executor(None, cache.get, key)
+                if entry is not None and entry.fresh:
+                    return position, _tile_data(entry)
+
+            async with self._slot(URL(url).host):
+                tstart = monotonic()
+                try:
+                    headers = entry.validators() if entry is not None else None
+                    response = await client.get(url, headers=headers, **req_kw)
+                except RemoteProtocolError as exc:
+                    self.stats.errors += 1
+                    raise ExternalServiceError(
+                        gettext("Unable to get a response from the remote server."),
+                    ) from exc
+                except TimeoutException as exc:
+                    self.stats.errors += 1
+                    raise TimeoutError from exc
+                finally:
+                    self.stats.requests += 1
+                    self.stats.latency += monotonic() - tstart
+
+            if cache is not None:
+                if response.status_code == 304 and entry is not None:
+                    response = await loop.run_in_executor(
+                        None, cache.revalidate, key, entry, response.headers
+                    )
+                elif cacheable_response(response.status_code, response.headers):
+                    response = await loop.run_in_executor(
+                        None,
+                        cache.put,
+                        key,
+                        response.status_code,
+                        response.content,
+                        response.headers,
+                    )
+
             try:
-                response = await client.get(url, **req_kw)
-            except RemoteProtocolError as exc:
-                raise ExternalServiceError(
-                    gettext("Unable to get a response from the remote server."),
-                ) from exc
-            except TimeoutException as exc:
-                raise TimeoutError from exc
-            if response.status_code == 200:
-                data = response.content
-            elif response.status_code in (204, 404):
-                data = None
-            else:
-                raise ExternalServiceError(
-                    gettext("An unexpected HTTP status code was received from the remote server."),
-                    data=dict(status_code=response.status_code),
-                )
-
-            return position, data
+                return position, _tile_data(response)
+            except ExternalServiceError:
+                self.stats.errors += 1
+                raise
 
+        loop = asyncio.get_running_loop()
         for x, xtile in enumerate(range(xmin, xmax + 1)):
             for y, ytile in enumerate(range(ymin, ymax + 1)):
                 coro = _get_tile((x, y), xtile, ytile)
@@ -104,43 +222,20 @@ class TileFetcher:
         for coro in asyncio.as_completed(tasks):
             yield await coro
 
-    async def _ajob(self):
-        self._shutdown = False
-        atexit.register(self._wait_for_shutdown)
-
-        params = dict(
-            headers=env.tmsclient.headers,
-            limits=Limits(max_keepalive_connections=8),
-            http2=True,
-        )
-        async with AsyncClient(**params) as client, AsyncClient(
-            verify=False, **params
-        ) as client_insecure:
-            while True:
-                if self._shutdown:
-                    break
-
-                try:
-                    get_timeout = SHUTDOWN_TIMEOUT / 5
-                    data = self._queue.get(True, get_timeout)
-                except Empty:
-                    continue
-
-                answer = data.pop("answer")
-                _client = client_insecure if data.pop("insecure") else client
-                tasks = []
-                try:
-                    async for pos, data in self._get_tiles(tasks, _client, **data):
-                        answer.put_nowait(FetchResult(FetchStatus.DATA, position=pos, data=data))
-                except Exception as exc:
-                    answer.put_nowait(FetchResult(FetchStatus.ERROR, exception=exc))
-                    for task in tasks:
-                        task.cancel()
-                else:
-                    answer.put_nowait(FetchResult(FetchStatus.DONE))
-
-    def _job(self):
-        self._loop.run_until_complete(self._ajob())
+    async def _ajob(self, answer, *, insecure, **kwargs):
+        self.stats.jobs += 1
+        tasks = []
+        try:
+            async for pos, data in self._get_tiles(tasks, self._client(insecure), **kwargs):
+                answer.put_nowait(FetchResult(FetchStatus.DATA, position=pos, data=data))
+        except Exception as exc:
+            answer.put_nowait(FetchResult(FetchStatus.ERROR, exception=exc))
+        else:
+            answer.put_nowait(FetchResult(FetchStatus.DONE))
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.stats.jobs -= 1
 
     def get_tiles(self, connection, layer_name, zoom, xmin, xmax, ymin, ymax):
         url_template = connection.url_template
@@ -162,25 +257,42 @@ class TileFetcher:
         if connection.username is not None:
             data["req_kw"]["auth"] = (connection.username, connection.password)
         data["insecure"] = connection.insecure
-        answer = data["answer"] = Queue()
+        data["cache"] = env.tmsclient.upstream_cache
+        data["cache_credentials"] = dict(
+            username=connection.username,
+            password=connection.password,
+        )
+        answer = Queue()
 
-        self._queue.put_nowait(data)
+        job = asyncio.run_coroutine_threadsafe(self._ajob(answer, **data), self._loop)
+        try:
+            while True:
+                try:
+                    result = answer.get(True, self._session_timeout)
+                except Empty:
+                    raise TimeoutError
 
-        while True:
-            try:
-                result = answer.get(True, self._session_timeout)
-            except Empty:
-                with self._queue.mutex:
-                    self._queue.queue.clear()
-                raise TimeoutError
-
-            if result.status == FetchStatus.DONE:
-                break
-            if result.status == FetchStatus.ERROR:
-                raise result.exception
-            yield result.position, result.data
+                if result.status == FetchStatus.DONE:
+                    break
+                if result.status == FetchStatus.ERROR:
+                    raise result.exception
+                yield result.position, result.data
+        finally:
+            # Cancel pending tile requests on timeout or if the caller stopped
+            # iterating, it's no-op for a completed job
+            job.cancel()
 
     def _wait_for_shutdown(self):
-        self._shutdown = True
+        async def _close():
+            for client in self._clients.values():
+                await client.aclose()
+
+        try:
+            asyncio.run_coroutine_threadsafe(_close(), self._loop).result(SHUTDOWN_TIMEOUT)
+        except Exception:
+            pass
+
+        self._loop.call_soon_threadsafe(self._loop.stop)
         self._worker.join(SHUTDOWN_TIMEOUT)
-        self._loop.close()
+        if not self._worker.is_alive():
+            self._loop.close()
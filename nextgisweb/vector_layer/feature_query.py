@@ -7,20 +7,31 @@ from zope.interface import implementer
 
 from nextgisweb.env import DBSession
 from nextgisweb.lib.geometry import Geometry
+from nextgisweb.lib.json import loadb
 
 from nextgisweb.feature_layer import (
     Feature,
+    FeatureBatch,
     FeatureQueryIntersectsMixin,
     FeatureSet,
     IFeatureQuery,
+    IFeatureQueryBatch,
     IFeatureQueryClipByBox,
     IFeatureQueryFilter,
     IFeatureQueryFilterBy,
+    IFeatureQueryFilterExpr,
+    IFeatureQueryGeoJSON,
     IFeatureQueryIlike,
     IFeatureQueryIntersects,
+    IFeatureQueryKeyset,
     IFeatureQueryLike,
+    IFeatureQueryMVT,
     IFeatureQueryOrderBy,
     IFeatureQuerySimplify,
+    IFeatureQueryStream,
+    filter_expr_condition,
+    keyset_condition,
+    mvt_query,
 )
 from nextgisweb.spatial_ref_sys import SRS
 
@@ -29,12 +40,18 @@ from nextgisweb.spatial_ref_sys import SRS
     IFeatureQuery,
     IFeatureQueryFilter,
     IFeatureQueryFilterBy,
+    IFeatureQueryFilterExpr,
+    IFeatureQueryGeoJSON,
     IFeatureQueryLike,
     IFeatureQueryIlike,
     IFeatureQueryIntersects,
     IFeatureQueryOrderBy,
     IFeatureQueryClipByBox,
     IFeatureQuerySimplify,
+    IFeatureQueryMVT,
+    IFeatureQueryStream,
+    IFeatureQueryKeyset,
+    IFeatureQueryBatch,
 )
 class FeatureQueryBase(FeatureQueryIntersectsMixin):
     def __init__(self):
@@ -45,6 +62,7 @@ class FeatureQueryBase(FeatureQueryIntersectsMixin):
         self._srs = None
         self._geom = None
         self._geom_format = "WKB"
+        self._geom_precision = None
         self._clip_by_box = None
         self._simplify = None
         self._box = None
@@ -55,11 +73,15 @@ class FeatureQueryBase(FeatureQueryIntersectsMixin):
 
         self._filter = None
         self._filter_by = None
+        self._filter_expr = None
         self._like = None
         self._ilike = None
 
         self._order_by = None
 
+        self._stream = None
+        self._keyset = None
+
     def pit(self, version):
         self._pit_version = version
 
@@ -72,6 +94,9 @@ class FeatureQueryBase(FeatureQueryIntersectsMixin):
     def geom_format(self, geom_format):
         self._geom_format = geom_format
 
+    def geom_precision(self, digits):
+        self._geom_precision = digits
+
     def clip_by_box(self, box):
         self._clip_by_box = box
 
@@ -94,6 +119,9 @@ class FeatureQueryBase(FeatureQueryIntersectsMixin):
     def filter_by(self, **kwargs):
         self._filter_by = kwargs
 
+    def filter_expr(self, expr):
+        self._filter_expr = expr
+
     def order_by(self, *args):
         self._order_by = args
 
@@ -103,6 +131,12 @@ class FeatureQueryBase(FeatureQueryIntersectsMixin):
     def ilike(self, value):
         self._ilike = value
 
+    def stream(self, batch_size):
+        self._stream = batch_size
+
+    def keyset(self, key):
+        self._keyset = key
+
     def __call__(self):
         vls = self.layer.vlschema()
         if not self._pit_version:
@@ -142,20 +176,27 @@ class FeatureQueryBase(FeatureQueryIntersectsMixin):
                 )
             )
 
+        # Geometry expression before serialization for MVT encoding
+        geomtile = geomexpr
+
         if self._geom:
-            geomexpr = (
-                func.st_asbinary(geomexpr, "NDR")
-                if self._geom_format == "WKB"
-                else func.st_astext(geomexpr)
-            )
+            if self._geom_format == "WKB":
+                geomexpr = func.st_asbinary(geomexpr, "NDR")
+            elif self._geom_format == "GeoJSON":
+                precision = 9 if self._geom_precision is None else self._geom_precision
+                geomexpr = func.st_asgeojson(geomexpr, precision, 0)
+            else:
+                geomexpr = func.st_astext(geomexpr)
             columns.append(geomexpr.label("geom"))
 
         selected_fields = []
+        selected_columns = []
         for idx, (fld_k, fld_c) in enumerate(fields.items(), start=1):
             if self._fields is None or fld_k in self._fields:
                 label = f"fld_{idx}"
                 columns.append(fld_c.label(label))
                 selected_fields.append((fld_k, label))
+                selected_columns.append(fld_c.label(fld_k))
 
         if self._filter_by:
             for k, v in self._filter_by.items():
@@ -210,6 +251,17 @@ class FeatureQueryBase(FeatureQueryIntersectsMixin):
             if len(_where_filter) > 0:
                 where.append(sa.and_(*_where_filter))
 
+        if self._filter_expr is not None:
+            where.append(
+                filter_expr_condition(
+                    self._filter_expr,
+                    idcol=idcol,
+                    fields=fields,
+                    geomcol=geomcol,
+                    srid=self.layer.srs_id,
+                )
+            )
+
         if self._like or self._ilike:
             operands = []
             text_seach_fields = set(f.keyname for f in self.layer.fields if f.text_search)
@@ -242,10 +294,13 @@ class FeatureQueryBase(FeatureQueryIntersectsMixin):
             where.append(func.st_intersects(geomcol, int_geom))
 
         order_by = []
+        order_keys = []
         if self._order_by:
             for order, fld_k in self._order_by:
                 order_by.append(getattr(fields[fld_k], order)())
+                order_keys.append((order, fields[fld_k]))
         order_by.append(idcol.asc())
+        order_keys.append(("asc", idcol))
 
         qbase = select(idcol)
         if (vid_col := table.c.get("vid")) is not None:
@@ -266,10 +321,21 @@ class FeatureQueryBase(FeatureQueryIntersectsMixin):
             _box = self._box
             _limit = self._limit
             _offset = self._offset
+            _stream = self._stream
+            _keyset = self._keyset
 
-            def __iter__(self):
+            def _query(self):
                 query = qbase.where(*where).order_by(*order_by)
-                query = query.limit(self._limit).offset(self._offset)
+                if self._keyset is not None:
+                    query = query.where(keyset_condition(order_keys, self._keyset))
+                return query.limit(self._limit).offset(self._offset)
+
+            def __iter__(self):
+                query = self._query()
+                if self._stream:
+                    query = query.execution_options(
+                        stream_results=True, max_row_buffer=self._stream
+                    )
 
                 result = DBSession.execute(query)
                 for row in result.mappings():
@@ -282,6 +348,8 @@ class FeatureQueryBase(FeatureQueryIntersectsMixin):
                             geom = Geometry.from_wkb(geom_data.tobytes(), validate=False)
                         elif self._geom_format == "WKT":
                             geom = Geometry.from_wkt(geom_data, validate=False)
+                        elif self._geom_format == "GeoJSON":
+                            geom = Geometry.from_geojson(loadb(geom_data), validate=False)
                         else:
                             raise NotImplementedError
                     else:
@@ -301,6 +369,22 @@ class FeatureQueryBase(FeatureQueryIntersectsMixin):
                         box=_box,
                     )
 
+            def batches(self, size):
+                query = self._query().execution_options(stream_results=True, max_row_buffer=size)
+                result = DBSession.execute(query)
+                keys = list(result.keys())
+                while rows := result.fetchmany(size):
+                    yield FeatureBatch.from_rows(
+                        self.layer,
+                        keys,
+                        rows,
+                        fid="fid",
+                        vid="vid",
+                        geom="geom" if self._geom else None,
+                        geom_format=self._geom_format,
+                        fields=selected_fields,
+                    )
+
             @property
             def total_count(self):
                 query = select(func.count(idcol)).where(*where)
@@ -311,6 +395,19 @@ class FeatureQueryBase(FeatureQueryIntersectsMixin):
                 geom_clause = select(geomcol).where(*where).subquery().c[0]
                 return calculate_extent(geom_clause)
 
+            def mvt(self, bounds, *, name, extent, buffer):
+                query = mvt_query(
+                    idcol,
+                    geomtile,
+                    selected_columns,
+                    where,
+                    bounds,
+                    name=name,
+                    extent=extent,
+                    buffer=buffer,
+                )
+                return bytes(DBSession.scalar(query) or b"")
+
         return QueryFeatureSet()
 
 
@@ -26,6 +26,7 @@ from nextgisweb.feature_layer import (
     IWritableFeatureLayer,
     LayerField,
     LayerFieldsMixin,
+    mvt_cache_invalidation,
 )
 from nextgisweb.feature_layer.exception import FeatureNotFound, RestoreNotDeleted
 from nextgisweb.feature_layer.versioning import (
@@ -49,6 +50,7 @@ from nextgisweb.resource import (
     SAttribute,
     Serializer,
     SRelationship,
+    export_job_invalidation,
 )
 from nextgisweb.spatial_ref_sys import SRS
 
@@ -340,6 +342,8 @@ class VectorLayer(Base, Resource, SpatialLayerMixin, LayerFieldsMixin, FVersioni
 
     @vlschema_autoflush
     @fversioning_guard
+    @mvt_cache_invalidation
+    @export_job_invalidation
     def feature_create(self, feature):
         vls = self.vlschema()
         session = inspect(self).session
@@ -367,6 +371,8 @@ class VectorLayer(Base, Resource, SpatialLayerMixin, LayerFieldsMixin, FVersioni
 
     @vlschema_autoflush
     @fversioning_guard
+    @mvt_cache_invalidation
+    @export_job_invalidation
     def feature_put(self, feature):
         vls = self.vlschema()
         session = inspect(self).session
@@ -401,6 +407,8 @@ class VectorLayer(Base, Resource, SpatialLayerMixin, LayerFieldsMixin, FVersioni
 
     @vlschema_autoflush
     @fversioning_guard
+    @mvt_cache_invalidation
+    @export_job_invalidation
     def feature_delete(self, feature_id):
         vls = self.vlschema()
         session = inspect(self).session
@@ -420,6 +428,8 @@ class VectorLayer(Base, Resource, SpatialLayerMixin, LayerFieldsMixin, FVersioni
 
     @vlschema_autoflush
     @fversioning_guard
+    @mvt_cache_invalidation
+    @export_job_invalidation
     def feature_restore(self, feature):
         vls = self.vlschema()
         session = inspect(self).session
@@ -453,6 +463,8 @@ class VectorLayer(Base, Resource, SpatialLayerMixin, LayerFieldsMixin, FVersioni
 
     @vlschema_autoflush
     @fversioning_guard
+    @mvt_cache_invalidation
+    @export_job_invalidation
     def feature_delete_all(self):
         vls = self.vlschema()
         session = inspect(self).session
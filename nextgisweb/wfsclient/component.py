@@ -2,6 +2,7 @@ from datetime import timedelta
 
 from nextgisweb.env import Component, require
 from nextgisweb.lib.config import Option
+from nextgisweb.lib.httpsession import SessionPool
 
 
 class WFSClientComponent(Component):
@@ -9,6 +10,12 @@ class WFSClientComponent(Component):
         super().initialize()
 
         self.headers = {"User-Agent": self.options["user_agent"]}
+        self.sessions = SessionPool(
+            headers=self.headers,
+            pool_size=self.options["session.pool_size"],
+            retries=self.options["session.retries"],
+        )
+        self._constraints = dict()
 
     @require("feature_layer")
     def setup_pyramid(self, config):
@@ -16,7 +23,13 @@ class WFSClientComponent(Component):
 
         api.setup_pyramid(self, config)
 
+    # fmt: off
     option_annotations = (
         Option("user_agent", default="NextGIS Web"),
         Option("timeout", timedelta, default=timedelta(seconds=60)),
+        Option("session.pool_size", int, default=10, doc="Maximum number of keep-alive connections per upstream host."),
+        Option("session.retries", int, default=2, doc="Number of retries of failed upstream requests."),
+        Option("page_size", int, default=1000, doc="Number of features per request to servers supporting result paging."),
+        Option("capabilities.ttl", timedelta, default=timedelta(minutes=5), doc="Lifetime of cached server capabilities."),
     )
+    # fmt: on
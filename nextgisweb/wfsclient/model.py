@@ -1,6 +1,7 @@
 import re
 from datetime import date, datetime, time
 from io import BytesIO
+from time import monotonic
 from typing import Literal, Union
 
 import requests
@@ -106,6 +107,16 @@ def geom_from_gml(el):
     return Geometry.from_ogr(ogr_geom)
 
 
+def ows_constraints(root):
+    result = dict()
+    for el in find_tags(root, "Constraint"):
+        name = el.attrib.get("name")
+        default = find_tags(el, "DefaultValue")
+        if name is not None and len(default) > 0:
+            result[name] = default[0].text
+    return result
+
+
 def get_srid(value):
     try:
         crs = Crs(value)
@@ -141,7 +152,7 @@ class WFSConnection(Base, Resource):
     def check_parent(cls, parent):
         return isinstance(parent, ResourceGroup)
 
-    def request_wfs(self, method, xml_root=None, **kwargs):
+    def _request(self, method, xml_root=None, **kwargs):
         if method == "GET":
             if "params" not in kwargs:
                 kwargs["params"] = dict()
@@ -159,20 +170,79 @@ class WFSConnection(Base, Resource):
             kwargs["auth"] = requests.auth.HTTPBasicAuth(self.username, self.password)
 
         try:
-            response = requests.request(
+            response = env.wfsclient.sessions.session(self.id).request(
                 method,
                 self.path,
-                headers=env.wfsclient.headers,
                 timeout=env.wfsclient.options["timeout"].total_seconds(),
                 **kwargs,
             )
         except RequestException:
             raise ExternalServiceError()
 
-        if response.status_code == 200:
-            return etree.parse(BytesIO(response.content)).getroot()
-        else:
+        if response.status_code != 200:
+            response.close()
             raise ExternalServiceError()
+        return response
+
+    def request_wfs(self, method, xml_root=None, **kwargs):
+        response = self._request(method, xml_root, **kwargs)
+        return etree.parse(BytesIO(response.content)).getroot()
+
+    def iter_wfs(self, method, tag, xml_root=None, **kwargs):
+        """Same as request_wfs but parse the response incrementally and yield
+        elements with the given local name, which are cleared afterwards"""
+
+        response = self._request(method, xml_root, stream=True, **kwargs)
+        try:
+            response.raw.decode_content = True
+            for _, el in etree.iterparse(response.raw, events=("end",), tag="{*}" + tag):
+                yield el
+                el.clear()
+                while el.getprevious() is not None:
+                    del el.getparent()[0]
+        finally:
+            response.close()
+
+    def constraints(self):
+        """Constraints of the server capabilities, cached for
+        wfsclient.capabilities.ttl"""
+
+        comp = env.wfsclient
+        key = (self.path, self.version, self.username)
+        cached = comp._constraints.get(self.id)
+        if cached is not None and cached[0] == key and cached[1] > monotonic():
+            return cached[2]
+
+        root = self.request_wfs("GET", params=dict(REQUEST="GetCapabilities"))
+        constraints = ows_constraints(root)
+
+        expires = monotonic() + comp.options["capabilities.ttl"].total_seconds()
+        comp._constraints[self.id] = (key, expires, constraints)
+        return constraints
+
+    def page_size(self):
+        """Number of features per GetFeature request if the server advertises
+        result paging, None otherwise"""
+
+        constraints = self.constraints()
+        if (constraints.get("ImplementsResultPaging") or "").upper() != "TRUE":
+            return None
+
+        page_size = env.wfsclient.options["page_size"]
+        try:
+            count_default = int(constraints.get("CountDefault"))
+        except (TypeError, ValueError):
+            pass
+        else:
+            # Servers return at most CountDefault features per request
+            if count_default > 0:
+                page_size = min(page_size, count_default)
+        return page_size
+
+    def sorting(self):
+        """Whether the server advertises sorting of GetFeature results"""
+
+        return (self.constraints().get("ImplementsSorting") or "").upper() == "TRUE"
 
     def get_capabilities(self):
         root = self.request_wfs("GET", params=dict(REQUEST="GetCapabilities"))
@@ -225,7 +295,7 @@ class WFSConnection(Base, Resource):
 
         return fields
 
-    def get_feature(
+    def _get_feature_request(
         self,
         layer,
         *,
@@ -233,14 +303,12 @@ class WFSConnection(Base, Resource):
         filter_=None,
         intersects=None,
         propertyname=None,
-        get_count=False,
-        limit=None,
-        offset=None,
         srs=None,
-        add_box=False,
+        order_fid=False,
     ):
         NS_WFS = "http://www.opengis.net/wfs/2.0"
         NS_FES = "http://www.opengis.net/fes/2.0"
+        NS_GML = "http://www.opengis.net/gml/3.2"
 
         req_root = etree.Element(
             etree.QName(NS_WFS, "GetFeature"), nsmap=dict(wfs=NS_WFS, fes=NS_FES)
@@ -311,90 +379,135 @@ class WFSConnection(Base, Resource):
             __query.append(__filter)
         # } Filter
 
-        if limit is not None:
-            req_root.attrib["count"] = str(limit)
-            if offset is not None:
-                req_root.attrib["startIndex"] = str(offset)
-
-        if get_count:
-            req_root.attrib["resultType"] = "hits"
-            root = self.request_wfs("POST", xml_root=req_root)
-            n_returned = root.attrib["numberReturned"]
-            count = None if n_returned == "unknown" else int(n_returned)
-            return None, count
-
         if propertyname is not None:
             for p in propertyname:
                 __p = etree.Element(etree.QName(NS_WFS, "PropertyName"))
                 __p.text = p
                 __query.append(__p)
 
+        if order_fid:
+            # Servers may return features in a different order on each request
+            __sort_by = etree.Element(etree.QName(NS_FES, "SortBy"), nsmap=dict(gml=NS_GML))
+            __sort_property = etree.Element(etree.QName(NS_FES, "SortProperty"))
+            __value_reference = etree.Element(etree.QName(NS_FES, "ValueReference"))
+            __value_reference.text = "@gml:id"
+            __sort_property.append(__value_reference)
+            __sort_order = etree.Element(etree.QName(NS_FES, "SortOrder"))
+            __sort_order.text = "ASC"
+            __sort_property.append(__sort_order)
+            __sort_by.append(__sort_property)
+            __query.append(__sort_by)
+
         if srs is not None:
             req_root.attrib["srsName"] = "EPSG:%d" % srs
 
+        return req_root
+
+    def get_feature_count(self, layer, *, limit=None, offset=None, add_box=False, **kwargs):
+        req_root = self._get_feature_request(layer, **kwargs)
+
+        if limit is not None:
+            req_root.attrib["count"] = str(limit)
+            if offset is not None:
+                req_root.attrib["startIndex"] = str(offset)
+
+        req_root.attrib["resultType"] = "hits"
         root = self.request_wfs("POST", xml_root=req_root)
+        n_returned = root.attrib["numberReturned"]
+        return None if n_returned == "unknown" else int(n_returned)
+
+    def get_feature(self, layer, *, limit=None, offset=None, add_box=False, **kwargs):
+        """Yield features as they're parsed from GetFeature responses
+
+        If the server advertises result paging, features are requested by
+        pages of wfsclient.page_size features. Paged requests and requests with
+        an offset are sorted by feature ID to get features in a stable order
+        if the server advertises sorting, and aren't sorted otherwise."""
 
-        _members = find_tags(root, "member")
+        page_size = self.page_size()
+        order_fid = (page_size is not None or offset is not None) and self.sorting()
+        req_root = self._get_feature_request(layer, order_fid=order_fid, **kwargs)
 
         fld_map = dict()
         for field in layer.fields:
             fld_map[field.keyname] = field.datatype
 
-        features = []
-        for _member in _members:
-            _feature = _member[0]
-
-            fields = dict()
-            geom = None
-            for _property in _feature:
-                is_nil = _property.attrib.get(nil_attr, "false") == "true"
-
-                key = ns_trim(_property.tag)
-                if key == layer.column_geom:
-                    if not is_nil:
-                        geom = geom_from_gml(_property[0])
-                    continue
-
-                datatype = fld_map[key]
-                if is_nil:
-                    value = None
-                elif datatype in (FIELD_TYPE.INTEGER, FIELD_TYPE.BIGINT):
-                    value = int(_property.text)
-                elif datatype == FIELD_TYPE.REAL:
-                    value = float(_property.text)
-                elif datatype == FIELD_TYPE.STRING:
-                    if _property.text is None:
-                        value = ""
-                    else:
-                        value = _property.text
-                elif datatype == FIELD_TYPE.DATE:
-                    value = date.fromisoformat(_property.text)
-                elif datatype == FIELD_TYPE.TIME:
-                    value = time.fromisoformat(_property.text)
-                elif datatype == FIELD_TYPE.DATETIME:
-                    value = datetime.fromisoformat(_property.text)
-                else:
-                    raise ValidationError("Unknown data type: %s" % datatype)
-                fields[key] = value
-
-            fid = _feature.attrib["{http://www.opengis.net/gml/3.2}id"]
+        remaining = limit
+        start = offset
+        while True:
+            if remaining is not None and remaining <= 0:
+                return
+
+            count = remaining
+            if page_size is not None:
+                count = page_size if count is None else min(count, page_size)
+                start = start or 0
+
+            if count is not None:
+                req_root.attrib["count"] = str(count)
+                if start is not None:
+                    req_root.attrib["startIndex"] = str(start)
+
+            returned = 0
+            for _member in self.iter_wfs("POST", "member", xml_root=req_root):
+                returned += 1
+                yield self._feature_from_gml(layer, _member[0], fld_map, add_box)
+
+            if page_size is None or returned < count:
+                return
+
+            start += returned
+            if remaining is not None:
+                remaining -= returned
+
+    def _feature_from_gml(self, layer, _feature, fld_map, add_box):
+        fields = dict()
+        geom = None
+        for _property in _feature:
+            is_nil = _property.attrib.get(nil_attr, "false") == "true"
+
+            key = ns_trim(_property.tag)
+            if key == layer.column_geom:
+                if not is_nil:
+                    geom = geom_from_gml(_property[0])
+                continue
 
-            if add_box and geom is not None:
-                _box = box(*geom.bounds)
+            datatype = fld_map[key]
+            if is_nil:
+                value = None
+            elif datatype in (FIELD_TYPE.INTEGER, FIELD_TYPE.BIGINT):
+                value = int(_property.text)
+            elif datatype == FIELD_TYPE.REAL:
+                value = float(_property.text)
+            elif datatype == FIELD_TYPE.STRING:
+                if _property.text is None:
+                    value = ""
+                else:
+                    value = _property.text
+            elif datatype == FIELD_TYPE.DATE:
+                value = date.fromisoformat(_property.text)
+            elif datatype == FIELD_TYPE.TIME:
+                value = time.fromisoformat(_property.text)
+            elif datatype == FIELD_TYPE.DATETIME:
+                value = datetime.fromisoformat(_property.text)
             else:
-                _box = None
-
-            features.append(
-                Feature(
-                    layer=layer,
-                    id=fid_int(fid, layer.layer_name),
-                    fields=fields,
-                    geom=geom,
-                    box=_box,
-                )
-            )
+                raise ValidationError("Unknown data type: %s" % datatype)
+            fields[key] = value
+
+        fid = _feature.attrib["{http://www.opengis.net/gml/3.2}id"]
 
-        return features, len(features)
+        if add_box and geom is not None:
+            _box = box(*geom.bounds)
+        else:
+            _box = None
+
+        return Feature(
+            layer=layer,
+            id=fid_int(fid, layer.layer_name),
+            fields=fields,
+            geom=geom,
+            box=_box,
+        )
 
 
 class PathAttr(SColumn, apitype=True):
@@ -488,7 +601,7 @@ class WFSLayer(Base, Resource, SpatialLayerMixin, LayerFieldsMixin):
             )
 
         # Check feature id readable
-        features, count = self.connection.get_feature(self, limit=1)
+        features = list(self.connection.get_feature(self, limit=1))
 
         if self.geometry_type is None:
             example_feature = features[0]
@@ -648,23 +761,21 @@ class FeatureQueryBase(FeatureQueryIntersectsMixin):
 
             def __init__(self):
                 super().__init__()
-                self._features = None
                 self._count = None
 
             def __iter__(self):
-                if self._features is None:
-                    self._features, self._count = self.layer.connection.get_feature(
-                        self.layer, **params
-                    )
-                for feature in self._features:
+                # Features aren't kept, so they're requested again on each
+                # iteration, but memory usage doesn't depend on their number
+                count = 0
+                for feature in self.layer.connection.get_feature(self.layer, **params):
+                    count += 1
                     yield feature
+                self._count = count
 
             @property
             def total_count(self):
                 if self._count is None:
-                    _none_features, self._count = self.layer.connection.get_feature(
-                        self.layer, get_count=True, **params
-                    )
+                    self._count = self.layer.connection.get_feature_count(self.layer, **params)
 
                 if self._count is None:
                     raise ExternalServiceError(
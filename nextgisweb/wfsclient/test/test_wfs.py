@@ -141,3 +141,18 @@ def test_layer(layer_id, ngw_webtest_app):
         dict(geom_format="geojson", limit=1, offset=0),
     )
     assert res.json == [feature1]
+
+
+@pytest.mark.parametrize("limit, offset, count", [(None, None, 2), (2, 1, 1), (1, 0, 1)])
+def test_paging(limit, offset, count, layer_id, ngw_env, ngw_webtest_app):
+    layer_url = "/api/resource/%d/feature/" % layer_id
+    query = dict(geom_format="geojson")
+    if limit is not None:
+        query.update(limit=limit, offset=offset)
+
+    with ngw_env.wfsclient.options.override({"page_size": 100}):
+        expected = ngw_webtest_app.get(layer_url, query).json
+    assert len(expected) == count
+
+    with ngw_env.wfsclient.options.override({"page_size": 1}):
+        assert ngw_webtest_app.get(layer_url, query).json == expected
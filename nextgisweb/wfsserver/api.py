@@ -31,7 +31,9 @@ def wfs(resource, request):
         request,
         force_schema_validation=fsv,
     ).response()
-    return Response(xml, content_type="text/xml", charset="utf-8")
+    if isinstance(xml, str):
+        return Response(xml, content_type="text/xml", charset="utf-8")
+    return Response(app_iter=xml, content_type="text/xml", charset="utf-8")
 
 
 def error_renderer(request, err_info, exc, exc_info, debug=True):
@@ -8,6 +8,8 @@ from nextgisweb.env import DBSession
 
 from nextgisweb.vector_layer import VectorLayer
 
+from ..wfs_handler import filter_expr_simple, xml_invalid_chars
+
 pytestmark = pytest.mark.usefixtures("ngw_resource_defaults", "ngw_auth_administrator")
 
 
@@ -64,4 +66,143 @@ def test_api(vector_layer_id, ngw_webtest_app, ngw_resource_group):
 
     ET.fromstring(resp.text.encode("utf-8"))
 
+    resp = ngw_webtest_app.get(
+        "/api/resource/%d/wfs" % wfsserver_service_id,
+        dict(service="wfs", version="2.0.2", request="GetFeature", typenames="points"),
+        status=200,
+    )
+
+    ns = dict(wfs="http://www.opengis.net/wfs/2.0", gml="http://www.opengis.net/gml/3.2")
+    root = ET.fromstring(resp.body)
+    assert root.get("numberMatched") == "2"
+    assert root.get("numberReturned") == "2"
+    assert len(root.findall("wfs:member", ns)) == 2
+
+    envelope = root.find("wfs:boundedBy/gml:Envelope", ns)
+    lower = [float(v) for v in envelope.find("gml:lowerCorner", ns).text.split()]
+    upper = [float(v) for v in envelope.find("gml:upperCorner", ns).text.split()]
+    assert lower == pytest.approx([0, 0], abs=1e-3)
+    assert upper == pytest.approx([10, 10], abs=1e-3)
+
+    resp = ngw_webtest_app.get(
+        "/api/resource/%d/wfs" % wfsserver_service_id,
+        dict(
+            service="wfs",
+            version="2.0.2",
+            request="GetFeature",
+            typenames="points",
+            count=1,
+            startindex=1,
+        ),
+        status=200,
+    )
+
+    root = ET.fromstring(resp.body)
+    assert root.get("numberMatched") == "2"
+    assert root.get("numberReturned") == "1"
+    assert len(root.findall("wfs:member", ns)) == 1
+
     ngw_webtest_app.delete("/api/resource/%d" % wfsserver_service_id, status=200)
+
+
+FES_NS = 'xmlns:fes="http://www.opengis.net/fes/2.0" xmlns:gml="http://www.opengis.net/gml/3.2"'
+
+
+@pytest.mark.parametrize(
+    "fes, expected",
+    (
+        (
+            "<fes:Or>"
+            '<fes:PropertyIsLike wildCard="*" singleChar="." escapeChar="!">'
+            "<fes:ValueReference>name</fes:ValueReference><fes:Literal>feat*</fes:Literal>"
+            "</fes:PropertyIsLike>"
+            "<fes:PropertyIsBetween><fes:ValueReference>price</fes:ValueReference>"
+            "<fes:LowerBoundary><fes:Literal>-5</fes:Literal></fes:LowerBoundary>"
+            "<fes:UpperBoundary><fes:Literal>0</fes:Literal></fes:UpperBoundary>"
+            "</fes:PropertyIsBetween>"
+            "</fes:Or>",
+            2,
+        ),
+        (
+            '<fes:PropertyIsLike wildCard="*" singleChar="." escapeChar="!">'
+            "<fes:ValueReference>name</fes:ValueReference><fes:Literal>feature.</fes:Literal>"
+            "</fes:PropertyIsLike>",
+            1,
+        ),
+        (
+            "<fes:Not><fes:PropertyIsNull>"
+            "<fes:ValueReference>name</fes:ValueReference>"
+            "</fes:PropertyIsNull></fes:Not>",
+            1,
+        ),
+        (
+            "<fes:DWithin><fes:ValueReference>geom</fes:ValueReference>"
+            '<gml:Point srsName="EPSG:3857"><gml:pos>9 9</gml:pos></gml:Point>'
+            '<fes:Distance uom="m">2</fes:Distance>'
+            "</fes:DWithin>",
+            1,
+        ),
+        (
+            "<fes:And>"
+            "<fes:Intersects><fes:ValueReference>geom</fes:ValueReference>"
+            '<gml:Envelope srsName="EPSG:3857">'
+            "<gml:lowerCorner>-1 -1</gml:lowerCorner><gml:upperCorner>11 11</gml:upperCorner>"
+            "</gml:Envelope></fes:Intersects>"
+            "<fes:PropertyIsLessThan><fes:Literal>0</fes:Literal>"
+            "<fes:ValueReference>price</fes:ValueReference></fes:PropertyIsLessThan>"
+            "</fes:And>",
+            0,
+        ),
+    ),
+)
+def test_filter(fes, expected, vector_layer_id, ngw_webtest_app, ngw_resource_group):
+    data = dict(
+        resource=dict(
+            cls="wfsserver_service", display_name="test_wfs", parent=dict(id=ngw_resource_group)
+        ),
+        wfsserver_service=dict(
+            layers=[dict(keyname="points", display_name="points", resource_id=vector_layer_id)]
+        ),
+    )
+    resp = ngw_webtest_app.post_json("/api/resource/", data, status=201)
+    wfsserver_service_id = resp.json["id"]
+
+    resp = ngw_webtest_app.get(
+        "/api/resource/%d/wfs" % wfsserver_service_id,
+        dict(
+            service="wfs",
+            version="2.0.2",
+            request="GetFeature",
+            typenames="points",
+            filter=f"<fes:Filter {FES_NS}>{fes}</fes:Filter>",
+        ),
+        status=200,
+    )
+
+    ns = dict(wfs="http://www.opengis.net/wfs/2.0")
+    root = ET.fromstring(resp.body)
+    assert len(root.findall("wfs:member", ns)) == expected
+
+    ngw_webtest_app.delete("/api/resource/%d" % wfsserver_service_id, status=200)
+
+
+@pytest.mark.parametrize(
+    "expr, expected",
+    (
+        (("in", "id", [1, 2]), ([1, 2], None, [])),
+        (("eq", "name", "a"), ([], None, [("name", "eq", "a")])),
+        (
+            ("and", ("in", "id", [1]), ("and", ("isnull", "name"), ("intersects", "geom"))),
+            ([1], "geom", [("name", "isnull", "yes")]),
+        ),
+        (("or", ("eq", "name", "a"), ("eq", "name", "b")), None),
+        (("and", ("bbox", "geom"), ("intersects", "geom")), None),
+        (("like", "name", "a%"), None),
+    ),
+)
+def test_filter_expr_simple(expr, expected):
+    assert filter_expr_simple(expr) == expected
+
+
+def test_xml_invalid_chars():
+    assert xml_invalid_chars.sub("", "a\x00b\x1bc\td\ne\uffff") == "abc\td\ne"
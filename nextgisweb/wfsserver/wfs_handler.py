@@ -1,8 +1,11 @@
 import re
+from contextlib import nullcontext
 from datetime import datetime
 from os import path
 from tempfile import NamedTemporaryFile
+from xml.sax.saxutils import escape, quoteattr
 
+import transaction
 from lxml import etree, html
 from lxml.builder import ElementMaker
 from msgspec import UNSET
@@ -12,6 +15,7 @@ from shapely.geometry import box
 from sqlalchemy import and_
 from sqlalchemy.orm.exc import NoResultFound
 
+from nextgisweb.env import env
 from nextgisweb.lib.geometry import Geometry, GeometryNotValid, Transformer
 from nextgisweb.lib.ows import (
     FIELD_TYPE_WFS,
@@ -22,7 +26,14 @@ from nextgisweb.lib.ows import (
 )
 
 from nextgisweb.core.exception import ValidationError
-from nextgisweb.feature_layer import FIELD_TYPE, GEOM_TYPE, Feature, IVersionableFeatureLayer
+from nextgisweb.feature_layer import (
+    FIELD_TYPE,
+    GEOM_TYPE,
+    Feature,
+    IFeatureQueryFilterExpr,
+    IVersionableFeatureLayer,
+    feature_batches,
+)
 from nextgisweb.layer import IBboxLayer
 from nextgisweb.resource import DataScope
 from nextgisweb.spatial_ref_sys import SRS
@@ -32,6 +43,9 @@ from .util import validate_tag
 
 wfsfld_pattern = re.compile(r"^wfsfld_(\d+)$")
 
+# Characters not allowed in XML 1.0 documents even as character references
+xml_invalid_chars = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff\ud800-\udfff]")
+
 FIELD_TYPE_2_WFS = {
     FIELD_TYPE.INTEGER: FIELD_TYPE_WFS.INTEGER,
     FIELD_TYPE.BIGINT: FIELD_TYPE_WFS.LONG,
@@ -142,6 +156,10 @@ def find_tags(element, tag):
     return element.xpath('.//*[local-name()="%s"]' % tag)
 
 
+def filter_children(element):
+    return [el for el in element if isinstance(el.tag, str)]
+
+
 def fid_encode(fid, layer_name):
     return "%s.%d" % (layer_name, fid)
 
@@ -171,17 +189,107 @@ GEOM_TYPE_TO_GML_TYPE = {
     GEOM_TYPE.MULTIPOLYGONZ: "gml:MultiPolygonPropertyType",
 }
 
-# Values are feature query operators
+# Values are filter expression operators
 COMPARISON_OPERATORS = {
     "PropertyIsEqualTo": "eq",
     "PropertyIsNotEqualTo": "ne",
-    "PropertyIsNil": "isnull",
     "PropertyIsGreaterThan": "gt",
     "PropertyIsGreaterThanOrEqualTo": "ge",
     "PropertyIsLessThan": "lt",
     "PropertyIsLessThanOrEqualTo": "le",
 }
 
+COMPARISON_REVERSED = dict(eq="eq", ne="ne", gt="lt", ge="le", lt="gt", le="ge")
+
+SPATIAL_OPERATORS = {
+    "BBOX": "bbox",
+    "Intersects": "intersects",
+    "Disjoint": "disjoint",
+    "Within": "within",
+    "Contains": "contains",
+    "Touches": "touches",
+    "Crosses": "crosses",
+    "Overlaps": "overlaps",
+    "Equals": "equals",
+    "DWithin": "dwithin",
+    "Beyond": "beyond",
+}
+
+
+def filter_expr_simple(expr):
+    """Split a filter expression into feature IDs, an intersection geometry
+    and (key, operator, value) conditions for feature queries which don't
+    support filter expressions. Returns None if the expression isn't a
+    conjunction of such conditions."""
+
+    fids, intersects, conditions = [], None, []
+
+    operands = [expr]
+    while len(operands) > 0:
+        operand = operands.pop(0)
+        op = operand[0]
+        if op == "and":
+            operands.extend(operand[1:])
+        elif op == "in" and operand[1] == "id":
+            fids.extend(operand[2])
+        elif op in ("bbox", "intersects") and intersects is None:
+            intersects = operand[1]
+        elif op in COMPARISON_REVERSED:
+            conditions.append((operand[1], op, operand[2]))
+        elif op == "isnull":
+            conditions.append((operand[1], "isnull", "yes"))
+        else:
+            return None
+
+    return fids, intersects, conditions
+
+
+UOM_METRE = (
+    "m",
+    "meter",
+    "meters",
+    "metre",
+    "metres",
+    "urn:ogc:def:uom:EPSG::9001",
+    "http://www.opengis.net/def/uom/EPSG/0/9001",
+)
+
+
+def like_escape(value):
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def like_pattern(value, wildcard, singlechar, escapechar):
+    """Convert OGC PropertyIsLike pattern to SQL LIKE pattern"""
+    result = []
+    chars = iter(value)
+    for c in chars:
+        if c == escapechar:
+            result.append(like_escape(next(chars, "")))
+        elif c == wildcard:
+            result.append("%")
+        elif c == singlechar:
+            result.append("_")
+        else:
+            result.append(like_escape(c))
+    return "".join(result)
+
+
+def _extent_bounds(extent, srs):
+    if None in extent.values():
+        return None
+
+    geom = Geometry.from_box(
+        extent["minLon"], extent["minLat"], extent["maxLon"], extent["maxLat"], srid=4326
+    )
+    if srs.id != 4326:
+        wgs84 = SRS.filter_by(id=4326).one()
+        try:
+            geom = Transformer(wgs84.wkt, srs.wkt).transform(geom)
+        except ValueError:
+            return None
+    return geom.bounds
+
 
 def get_geom_column(feature_layer):
     return feature_layer.column_geom if hasattr(feature_layer, "column_geom") else "geom"
@@ -314,7 +422,13 @@ class WFSHandler:
         else:
             raise ValidationError("Unsupported request: '%s'." % self.p_request)
 
-        xml = etree.tostring(root, encoding="unicode")
+        if not etree.iselement(root):
+            # Feature members are streamed unless the result is validated
+            if not self.p_validate_schema:
+                return root
+            xml = b"".join(root).decode("utf-8")
+        else:
+            xml = etree.tostring(root, encoding="unicode")
 
         if self.p_validate_schema:
             if self.p_request in (GET_CAPABILITIES, TRANSACTION):
@@ -464,69 +578,135 @@ class WFSHandler:
             parent.append(__list)
 
     def _parse_filter(self, __filter, layer):
-        filter_result = dict(fids=list(), intersects=None, filter=list())
-        next_target = [(__filter, 0)]
-        while len(next_target) > 0:
-            __parent, start_index = next_target.pop()
-            for i in range(start_index, len(__parent)):
-                __el = __parent[i]
-                tag = ns_trim(__el.tag)
-                if tag == "And":
-                    next_target.append((__parent, i + 1))
-                    next_target.append((__el, 0))
-                    break
-
-                if tag == "ResourceId":  # 2.0.0
-                    resid_attr = "rid"
-                elif tag == "GmlObjectId":  # 1.1.0
-                    resid_attr = ns_attr("gml", "id", self.p_version)
-                elif tag == "FeatureId":  # 1.0.0 and 1.1.0
-                    resid_attr = "fid"
-                else:
-                    resid_attr = None
-                if resid_attr is not None:
-                    fid = __el.get(resid_attr)
-                    filter_result["fids"].append(fid_decode(fid, layer.keyname))
-                    continue
-
-                if tag in ("BBOX", "Intersects"):
-                    if filter_result["intersects"] is not None:
-                        raise ValidationError("%d parameter conflict." % tag)
-                    __value_reference = __el[0]
-                    if ns_trim(__value_reference.tag) != "ValueReference":
-                        raise ValidationError("%d parse: ValueReference required." % tag)
-                    elif __value_reference.text != get_geom_column(layer.resource):
-                        raise ValidationError(
-                            "Geometry column '%s' not found." % __value_reference.text
-                        )
-                    __gml = __el[1]
-                    try:
-                        filter_result["intersects"] = geom_from_gml(__gml)
-                    except GeometryNotValid:
-                        raise ValidationError("%d parse: geometry is not valid." % tag)
-                    continue
-
-                if tag in COMPARISON_OPERATORS.keys():
-                    op = COMPARISON_OPERATORS[tag]
+        """Parse OGC filter into a filter expression which is compiled into a
+        single SQL condition by the feature query, see filter_expr_condition"""
+        return self._parse_filter_group(__filter, layer, "and")
+
+    def _parse_filter_group(self, __parent, layer, op):
+        fids = []
+        operands = []
+        for __el in filter_children(__parent):
+            tag = ns_trim(__el.tag)
+            if tag == "ResourceId":  # 2.0.0
+                resid_attr = "rid"
+            elif tag == "GmlObjectId":  # 1.1.0
+                resid_attr = ns_attr("gml", "id", self.p_version)
+            elif tag == "FeatureId":  # 1.0.0 and 1.1.0
+                resid_attr = "fid"
+            else:
+                operands.append(self._parse_filter_operator(__el, layer))
+                continue
+            fids.append(fid_decode(__el.get(resid_attr), layer.keyname))
+
+        if len(fids) > 0:
+            operands.insert(0, ("in", "id", fids))
+        if len(operands) == 0:
+            raise ValidationError("%s parse: operands required." % ns_trim(__parent.tag))
+        return operands[0] if len(operands) == 1 else (op, *operands)
+
+    def _parse_filter_operator(self, __el, layer):
+        tag = ns_trim(__el.tag)
+        __args = filter_children(__el)
+
+        if tag in ("And", "Or"):
+            return self._parse_filter_group(__el, layer, tag.lower())
+
+        if tag == "Not":
+            return ("not", self._parse_filter_group(__el, layer, "and"))
+
+        if tag in COMPARISON_OPERATORS:
+            op = COMPARISON_OPERATORS[tag]
+            if len(__args) != 2:
+                raise ValidationError("%s parse: two operands required." % tag)
+            if ns_trim(__args[0].tag) == "Literal":
+                __args.reverse()
+                op = COMPARISON_REVERSED[op]
+            k = self._parse_filter_property(__args[0], layer, tag)
+            v = self._parse_filter_literal(__args[1], tag)
+
+            if __el.get("matchCase") == "false" and op in ("eq", "ne"):
+                expr = ("ilike", k, like_escape(v))
+                return expr if op == "eq" else ("not", expr)
+            return (op, k, v)
+
+        if tag in ("PropertyIsNil", "PropertyIsNull"):
+            if len(__args) != 1:
+                raise ValidationError("%s parse: one operand required." % tag)
+            return ("isnull", self._parse_filter_property(__args[0], layer, tag))
+
+        if tag == "PropertyIsLike":
+            if len(__args) != 2:
+                raise ValidationError("%s parse: two operands required." % tag)
+            k = self._parse_filter_property(__args[0], layer, tag)
+            pattern = like_pattern(
+                self._parse_filter_literal(__args[1], tag),
+                wildcard=__el.get("wildCard", "%"),
+                singlechar=__el.get("singleChar", "_"),
+                escapechar=__el.get("escapeChar", __el.get("escape", "\\")),
+            )
+            return ("ilike" if __el.get("matchCase") == "false" else "like", k, pattern)
+
+        if tag == "PropertyIsBetween":
+            if len(__args) != 3:
+                raise ValidationError("%s parse: three operands required." % tag)
+            k = self._parse_filter_property(__args[0], layer, tag)
+            bounds = []
+            for __bound, bound_tag in zip(__args[1:], ("LowerBoundary", "UpperBoundary")):
+                __bound_args = filter_children(__bound)
+                if ns_trim(__bound.tag) != bound_tag or len(__bound_args) != 1:
+                    raise ValidationError("%s parse: %s required." % (tag, bound_tag))
+                bounds.append(self._parse_filter_literal(__bound_args[0], tag))
+            return ("between", k, *bounds)
+
+        if tag in SPATIAL_OPERATORS:
+            op = SPATIAL_OPERATORS[tag]
+            if len(__args) > 0 and ns_trim(__args[0].tag) in ("ValueReference", "PropertyName"):
+                self._parse_filter_property(__args.pop(0), layer, tag, geom=True)
+
+            distance = None
+            if op in ("dwithin", "beyond"):
+                if len(__args) != 2 or ns_trim(__args[1].tag) != "Distance":
+                    raise ValidationError("%s parse: Distance required." % tag)
+                __distance = __args.pop()
+                uom = __distance.get("uom", __distance.get("units"))
+                if uom in UOM_METRE and layer.resource.srs.is_geographic:
+                    raise ValidationError(
+                        "%s parse: distance in meters isn't supported for geographic SRS." % tag
+                    )
+                try:
+                    distance = float(__distance.text)
+                except (TypeError, ValueError):
+                    raise ValidationError("%s parse: Distance is not valid." % tag)
+
+            if len(__args) != 1:
+                raise ValidationError("%s parse: geometry required." % tag)
+            __gml = __args[0]
+            if ns_trim(__gml.tag) == "Literal" and len(filter_children(__gml)) == 1:
+                __gml = filter_children(__gml)[0]
+            try:
+                geom = geom_from_gml(__gml)
+            except GeometryNotValid:
+                raise ValidationError("%s parse: geometry is not valid." % tag)
 
-                    __value_reference = __el[0]
-                    if ns_trim(__value_reference.tag) != "ValueReference":
-                        raise ValidationError("%d parse: ValueReference required." % tag)
-                    k = __value_reference.text
+            return (op, geom) if distance is None else (op, geom, distance)
 
-                    if tag == "PropertyIsNil":
-                        v = "yes"
-                    else:
-                        __literal = __el[1]
-                        if ns_trim(__literal.tag) != "Literal":
-                            raise ValidationError("%d parse: Literal required." % tag)
-                        v = __literal.text
+        raise ValidationError("Filter element '%s' is not supported." % __el.tag)
 
-                    filter_result["filter"].append((k, op, v))
-                    continue
+    def _parse_filter_property(self, __el, layer, tag, geom=False):
+        if ns_trim(__el.tag) not in ("ValueReference", "PropertyName") or not __el.text:
+            raise ValidationError("%s parse: ValueReference required." % tag)
+        k = self._field_key_decode(ns_trim(__el.text.strip()), layer.resource.fields)
+        if geom:
+            if k != get_geom_column(layer.resource):
+                raise ValidationError("Geometry column '%s' not found." % k)
+        elif not any(fld.keyname == k for fld in layer.resource.fields):
+            raise ValidationError("Field '%s' not found." % k)
+        return k
 
-                raise ValidationError("Filter element '%s' is not supported." % __el.tag)
-        return filter_result
+    def _parse_filter_literal(self, __el, tag):
+        if ns_trim(__el.tag) != "Literal":
+            raise ValidationError("%s parse: Literal required." % tag)
+        return __el.text or ""
 
     def _get_capabilities100(self):
         EM = ElementMaker(nsmap=dict(ogc=nsmap("ogc", self.p_version)["ns"]))
@@ -578,10 +758,18 @@ class WFSHandler:
 
         __sc = El("Spatial_Capabilities", namespace=_ns_ogc, parent=__filter)
         __so = El("Spatial_Operators", namespace=_ns_ogc, parent=__sc)
-        El("BBOX", namespace=_ns_ogc, parent=__so)
+        for operator in SPATIAL_OPERATORS:
+            El(
+                "Intersect" if operator == "Intersects" else operator,
+                namespace=_ns_ogc,
+                parent=__so,
+            )
 
         __sc = El("Scalar_Capabilities", namespace=_ns_ogc, parent=__filter)
         El("Logical_Operators", namespace=_ns_ogc, parent=__sc)
+        __co = El("Comparison_Operators", namespace=_ns_ogc, parent=__sc)
+        for operator in ("Simple_Comparisons", "Like", "Between", "NullCheck"):
+            El(operator, namespace=_ns_ogc, parent=__co)
 
         return root
 
@@ -664,10 +852,24 @@ class WFSHandler:
             El("GeometryOperand", text=operand, namespace=_ns_ogc, parent=__go)
 
         __so = El("SpatialOperators", namespace=_ns_ogc, parent=__sc)
-        El("SpatialOperator", dict(name="BBOX"), namespace=_ns_ogc, parent=__so)
+        for operator in SPATIAL_OPERATORS:
+            El("SpatialOperator", dict(name=operator), namespace=_ns_ogc, parent=__so)
 
         __sc = El("Scalar_Capabilities", namespace=_ns_ogc, parent=__filter)
         El("LogicalOperators", namespace=_ns_ogc, parent=__sc)
+        __co = El("ComparisonOperators", namespace=_ns_ogc, parent=__sc)
+        for operator in (
+            "LessThan",
+            "GreaterThan",
+            "LessThanEqualTo",
+            "GreaterThanEqualTo",
+            "EqualTo",
+            "NotEqualTo",
+            "Like",
+            "Between",
+            "NullCheck",
+        ):
+            El("ComparisonOperator", text=operator, namespace=_ns_ogc, parent=__co)
 
         __id = El("Id_Capabilities", namespace=_ns_ogc, parent=__filter)
         El("FID", namespace=_ns_ogc, parent=__id)
@@ -735,6 +937,12 @@ class WFSHandler:
         for version in VERSION_SUPPORTED:
             El("Value", text=version, namespace=_ns_ows, parent=__values)
 
+        __constraint = El(
+            "Constraint", dict(name="ImplementsResultPaging"), namespace=_ns_ows, parent=__op_md
+        )
+        El("NoValues", namespace=_ns_ows, parent=__constraint)
+        El("DefaultValue", namespace=_ns_ows, parent=__constraint, text="TRUE")
+
         # FeatureTypeList
         self._feature_type_list(root)
 
@@ -752,16 +960,31 @@ class WFSHandler:
         constraint("ImplementsQuery", "FALSE")
         constraint("ImplementsAdHocQuery", "FALSE")
         constraint("ImplementsFunctions", "FALSE")
-        constraint("ImplementsMinStandardFilter", "FALSE")
-        constraint("ImplementsStandardFilter", "FALSE")
-        constraint("ImplementsMinSpatialFilter", "FALSE")
-        constraint("ImplementsSpatialFilter", "FALSE")
+        constraint("ImplementsMinStandardFilter", "TRUE")
+        constraint("ImplementsStandardFilter", "TRUE")
+        constraint("ImplementsMinSpatialFilter", "TRUE")
+        constraint("ImplementsSpatialFilter", "TRUE")
         constraint("ImplementsMinTemporalFilter", "FALSE")
         constraint("ImplementsTemporalFilter", "FALSE")
         constraint("ImplementsVersionNav", "FALSE")
         constraint("ImplementsSorting", "FALSE")
         constraint("ImplementsExtendedOperators", "FALSE")
 
+        __id = El("Id_Capabilities", namespace=_ns_fes, parent=__filter)
+        El("ResourceIdentifier", dict(name="fes:ResourceId"), namespace=_ns_fes, parent=__id)
+
+        __sc = El("Scalar_Capabilities", namespace=_ns_fes, parent=__filter)
+        El("LogicalOperators", namespace=_ns_fes, parent=__sc)
+        __co = El("ComparisonOperators", namespace=_ns_fes, parent=__sc)
+        for operator in (
+            *COMPARISON_OPERATORS,
+            "PropertyIsLike",
+            "PropertyIsNull",
+            "PropertyIsNil",
+            "PropertyIsBetween",
+        ):
+            El("ComparisonOperator", dict(name=operator), namespace=_ns_fes, parent=__co)
+
         __sc = El("Spatial_Capabilities", namespace=_ns_fes, parent=__filter)
 
         __go = El("GeometryOperands", namespace=_ns_fes, parent=__sc)
@@ -769,7 +992,8 @@ class WFSHandler:
             El("GeometryOperand", dict(name=operand), namespace=_ns_fes, parent=__go)
 
         __so = El("SpatialOperators", namespace=_ns_fes, parent=__sc)
-        El("SpatialOperator", dict(name="BBOX"), namespace=_ns_fes, parent=__so)
+        for operator in SPATIAL_OPERATORS:
+            El("SpatialOperator", dict(name=operator), namespace=_ns_fes, parent=__so)
 
         return root
 
@@ -906,46 +1130,7 @@ class WFSHandler:
 
         geom_column = get_geom_column(feature_layer)
 
-        EM = ElementMaker(
-            namespace=wfs["ns"],
-            nsmap=dict(
-                gml=gml["ns"],
-                wfs=wfs["ns"],
-                ngw=self.service_namespace,
-                ogc=nsmap("ogc", self.p_version)["ns"],
-                xsi=nsmap("xsi", self.p_version)["ns"],
-            ),
-        )
-        describe_location = self.request.route_url(
-            "wfsserver.wfs",
-            id=self.resource.id,
-            _query=dict(
-                REQUEST=DESCRIBE_FEATURE_TYPE,
-                SERVICE="WFS",
-                VERSION=self.p_version,
-                TYPENAME=self.p_typenames,
-            ),
-        )
-        schema_location = " ".join(
-            (
-                wfs["ns"],
-                wfs["loc"],
-                gml["ns"],
-                gml["loc"],
-                self.service_namespace,
-                describe_location,
-            )
-        )
-        root = EM(
-            "FeatureCollection",
-            {
-                "xmlns": self.service_namespace,
-                ns_attr("xsi", "schemaLocation", self.p_version): schema_location,
-            },
-        )
-
-        query = feature_layer.feature_query()
-
+        box_geom = None
         if self.p_bbox is not None:
             bbox_param = self.p_bbox.split(",")
             box_coords = map(float, bbox_param[:4])
@@ -967,7 +1152,6 @@ class WFSHandler:
                     box_geom = box_geom.flip_coordinates()
             except GeometryNotValid:
                 raise ValidationError("Paremeter BBOX geometry is not valid.")
-            query.intersects(box_geom)
 
         __filters = []
         if __query is not None:
@@ -975,119 +1159,102 @@ class WFSHandler:
         if self.p_filter is not None:
             __filters.append(etree.fromstring(self.p_filter))
 
+        filter_expr = None
         if len(__filters) == 1:
-            result = self._parse_filter(__filters[0], layer)
-            if len(result["fids"]) > 0:
-                query.filter(("id", "in", ",".join((str(fid) for fid in result["fids"]))))
-            if result["intersects"] is not None:
-                if self.p_bbox is not None:
-                    raise ValidationError("Parameters conflict: BBOX, Intersects")
-                query.intersects(result["intersects"])
-            if len(result["filter"]) > 0:
-                query.filter(*result["filter"])
+            filter_expr = self._parse_filter(__filters[0], layer)
         elif len(__filters) > 1:
             raise ValidationError("Multiple filters not supported.")
 
         if self.p_propertyname is not None:
             self.p_propertyname = [ns_trim(v) for v in self.p_propertyname.split(",")]
-            query.fields(*self.p_propertyname)
         elif __query is not None:
             __propertynames = find_tags(__query, "PropertyName")
             if len(__propertynames) > 0:
                 self.p_propertyname = [ns_trim(el.text) for el in __propertynames]
-                query.fields(*self.p_propertyname)
 
         limit = int(self.p_count) if self.p_count is not None else layer.maxfeatures
+        offset = 0
         if limit is not None:
             offset = 0 if self.p_startindex is None else int(self.p_startindex)
-            query.limit(limit, offset)
 
-        if self.p_resulttype == "hits":
-            count = query().total_count
-        else:
-            count = 0
+        def feature_query(feature_layer, srs_out=None):
+            query = feature_layer.feature_query()
+
+            if box_geom is not None:
+                query.intersects(box_geom)
+
+            if filter_expr is None:
+                pass
+            elif IFeatureQueryFilterExpr.providedBy(query):
+                query.filter_expr(filter_expr)
+            elif (simple := filter_expr_simple(filter_expr)) is not None:
+                fids, intersects, conditions = simple
+                if len(fids) > 0:
+                    query.filter(("id", "in", ",".join(str(fid) for fid in fids)))
+                if intersects is not None:
+                    if box_geom is not None:
+                        raise ValidationError("Parameters conflict: BBOX, Intersects")
+                    query.intersects(intersects)
+                if len(conditions) > 0:
+                    query.filter(*conditions)
+            else:
+                raise ValidationError("Filter is not supported by the layer.")
 
-            if self.p_propertyname is None or geom_column in self.p_propertyname:
-                query.geom()
+            if self.p_propertyname is not None:
+                query.fields(*self.p_propertyname)
 
-            if self.p_srsname is not None:
-                try:
-                    # Ignore axis_xy, return X/Y always
-                    srs_id, axis_xy = parse_srs(self.p_srsname)
-                except SRSParseError as e:
-                    raise ValidationError(str(e))
+            if limit is not None:
+                query.limit(limit, offset)
 
-                srs_out = (
-                    feature_layer.srs
-                    if srs_id == feature_layer.srs_id
-                    else SRS.filter_by(id=srs_id).one()
-                )
-            else:
-                srs_out = feature_layer.srs
-            query.srs(srs_out)
+            if srs_out is not None:
+                if self.p_propertyname is None or geom_column in self.p_propertyname:
+                    query.geom()
+                query.srs(srs_out)
 
-            osr_out = srs_out.to_osr()
+            return query
+
+        if self.p_resulttype == "hits":
+            count = feature_query(feature_layer)().total_count
+            return self._feature_collection(count, count if limit is None else None)
+
+        if self.p_srsname is not None:
+            try:
+                # Ignore axis_xy, return X/Y always
+                srs_id, axis_xy = parse_srs(self.p_srsname)
+            except SRSParseError as e:
+                raise ValidationError(str(e))
+
+            srs_out = (
+                feature_layer.srs
+                if srs_id == feature_layer.srs_id
+                else SRS.filter_by(id=srs_id).one()
+            )
+        else:
+            srs_out = feature_layer.srs
+
+        # Members are written as they are fetched, so the envelope comes from
+        # the layer extent instead of returned features.
+        bounds = None
+        if IBboxLayer.providedBy(feature_layer):
+            bounds = _extent_bounds(feature_layer.extent, srs_out)
+
+        def collection(feature_layer):
+            # WFS 2.0 requires numbers of features in the collection header,
+            # so they're counted within the transaction features are read in.
+            matched = returned = None
+            if self.p_version >= v200:
+                matched = feature_query(feature_layer)().total_count
+                returned = max(matched - offset, 0)
+                if limit is not None:
+                    returned = min(returned, limit)
 
+            root = self._feature_collection(returned, matched)
             __boundedBy = El(
                 "boundedBy",
                 parent=root,
                 namespace=wfs["ns"] if self.p_version >= v200 else gml["ns"],
             )
-            minX = maxX = minY = maxY = None
-            gml_parser = etree.XMLParser(huge_tree=True)
-
-            for feature in query():
-                feature_id = fid_encode(feature.id, layer.keyname)
-                __member = (
-                    El("member", parent=root, namespace=wfs["ns"])
-                    if self.p_version >= v200
-                    else El("featureMember", parent=root, namespace=gml["ns"])
-                )
-                id_attr = ns_attr("gml", "id", self.p_version) if self.p_version >= v110 else "fid"
-                __feature = El(layer.keyname, {id_attr: feature_id}, parent=__member)
-
-                if (geom := feature.geom) is not UNSET:
-                    __geom = El("geom", parent=__feature)
-                    if geom is not None:
-                        geom = feature.geom.ogr
-                        geom.AssignSpatialReference(osr_out)
-
-                        _minX, _maxX, _minY, _maxY = geom.GetEnvelope()
-                        minX = _minX if minX is None else min(minX, _minX)
-                        minY = _minY if minY is None else min(minY, _minY)
-                        maxX = _maxX if maxX is None else max(maxX, _maxX)
-                        maxY = _maxY if maxY is None else max(maxY, _maxY)
-
-                        geom_gml = geom.ExportToGML(
-                            [
-                                "FORMAT=%s" % self.gml_format,
-                                "NAMESPACE_DECL=YES",
-                                "SRSNAME_FORMAT=SHORT",
-                                "GMLID=geom-%s" % feature_id,
-                            ]
-                        )
-                        __gml = etree.fromstring(geom_gml, parser=gml_parser)
-                        __geom.append(__gml)
-                    else:
-                        __geom.set(ns_attr("xsi", "nil", self.p_version), "true")
-
-                for field in feature_layer.fields:
-                    if field.keyname not in feature.fields:
-                        continue
-                    __field = El(self._field_key_encode(field), parent=__feature)
-                    value = feature.fields[field.keyname]
-                    if value is not None:
-                        if isinstance(value, datetime):
-                            value = value.isoformat()
-                        elif not isinstance(value, str):
-                            value = str(value)
-                        __field.text = value
-                    else:
-                        __field.set(ns_attr("xsi", "nil", self.p_version), "true")
-
-                count += 1
-
-            if None in (minX, minY, maxX, maxY):
+            if bounds is None:
                 El(
                     "Null" if self.gml_format == "GML32" else "null",
                     parent=__boundedBy,
@@ -1105,13 +1272,13 @@ class WFSHandler:
                     "lowerCorner",
                     parent=_envelope,
                     namespace=gml["ns"],
-                    text="%f %f" % (minX, minY),
+                    text="%f %f" % bounds[:2],
                 )
                 El(
                     "upperCorner",
                     parent=_envelope,
                     namespace=gml["ns"],
-                    text="%f %f" % (maxX, maxY),
+                    text="%f %f" % bounds[2:],
                 )
             else:
                 _box = El(
@@ -1124,20 +1291,154 @@ class WFSHandler:
                     "coordinates",
                     parent=_box,
                     namespace=gml["ns"],
-                    text="%f %f %f %f" % (minX, minY, maxX, maxY),
+                    text="%f %f %f %f" % bounds,
                 )
 
+            # The collection skeleton is serialized by lxml, and members are
+            # inserted right before the closing tag.
+            collection = etree.tostring(root, encoding="unicode")
+            split = collection.rindex("</")
+            return collection[:split], collection[split:]
+
+        return self._feature_members(
+            collection,
+            layer_id=layer.id,
+            feature_query=feature_query,
+            srs_id=srs_out.id,
+            own_transaction=not self.p_validate_schema,
+        )
+
+    def _feature_collection(self, returned, matched):
+        wfs = nsmap("wfs", self.p_version)
+        gml = nsmap("gml", self.p_version)
+
+        EM = ElementMaker(
+            namespace=wfs["ns"],
+            nsmap=dict(
+                gml=gml["ns"],
+                wfs=wfs["ns"],
+                ngw=self.service_namespace,
+                ogc=nsmap("ogc", self.p_version)["ns"],
+                xsi=nsmap("xsi", self.p_version)["ns"],
+            ),
+        )
+        describe_location = self.request.route_url(
+            "wfsserver.wfs",
+            id=self.resource.id,
+            _query=dict(
+                REQUEST=DESCRIBE_FEATURE_TYPE,
+                SERVICE="WFS",
+                VERSION=self.p_version,
+                TYPENAME=self.p_typenames,
+            ),
+        )
+        schema_location = " ".join(
+            (
+                wfs["ns"],
+                wfs["loc"],
+                gml["ns"],
+                gml["loc"],
+                self.service_namespace,
+                describe_location,
+            )
+        )
+        root = EM(
+            "FeatureCollection",
+            {
+                "xmlns": self.service_namespace,
+                ns_attr("xsi", "schemaLocation", self.p_version): schema_location,
+            },
+        )
+
         if self.p_version == v110:
-            root.set("numberOfFeatures", str(count))
+            if returned is not None:
+                root.set("numberOfFeatures", str(returned))
         elif self.p_version >= v200:
-            root.set("numberMatched", str(count) if limit is None else "unknown")
-            root.set("numberReturned", str(count))
+            root.set("numberMatched", str(matched) if matched is not None else "unknown")
+            root.set("numberReturned", str(returned))
 
         if self.p_version >= v110:
             root.set("timeStamp", datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%f"))
 
         return root
 
+    def _feature_members(self, collection, *, layer_id, feature_query, srs_id, own_transaction):
+        # The request transaction is already committed when the response body
+        # is being iterated, so features are read within a separate one.
+        with transaction.manager if own_transaction else nullcontext():
+            layer = Layer.filter_by(id=layer_id).one()
+            feature_layer = layer.resource
+
+            head, tail = collection(feature_layer)
+            yield head.encode("utf-8")
+
+            srs_out = SRS.filter_by(id=srs_id).one()
+            query = feature_query(feature_layer, srs_out)
+            osr_out = srs_out.to_osr()
+
+            if self.p_version >= v200:
+                member_open, member_close = "<wfs:member>", "</wfs:member>"
+            else:
+                member_open, member_close = "<gml:featureMember>", "</gml:featureMember>"
+            id_attr = "gml:id" if self.p_version >= v110 else "fid"
+            gml_options = ["FORMAT=%s" % self.gml_format, "SRSNAME_FORMAT=SHORT"]
+            field_tags = {
+                field.keyname: self._field_key_encode(field) for field in feature_layer.fields
+            }
+
+            batch_size = env.feature_layer.options["stream.batch_size"]
+            for batch in feature_batches(query, batch_size):
+                geoms = batch.geom
+                if geoms is not UNSET:
+                    if batch.geom_format == "WKB":
+                        geom_loader = ogr.CreateGeometryFromWkb
+                    else:
+                        geom_loader = ogr.CreateGeometryFromWkt
+                field_columns = [
+                    (field_tags[field.keyname], batch.fields[field.keyname])
+                    for field in feature_layer.fields
+                    if field.keyname in batch.fields
+                ]
+
+                chunk = []
+                for idx, fid in enumerate(batch.fid):
+                    feature_id = fid_encode(fid, layer.keyname)
+                    chunk.append(member_open)
+                    chunk.append("<%s %s=%s>" % (layer.keyname, id_attr, quoteattr(feature_id)))
+
+                    if geoms is not UNSET:
+                        if (geom := geoms[idx]) is not None:
+                            geom = geom_loader(geom)
+                            geom.AssignSpatialReference(osr_out)
+
+                            # GML is written as is, the gml prefix is declared
+                            # on the collection element
+                            geom_gml = geom.ExportToGML(
+                                gml_options + ["GMLID=geom-%s" % feature_id]
+                            )
+                            chunk.append("<geom>%s</geom>" % geom_gml)
+                        else:
+                            chunk.append('<geom xsi:nil="true"/>')
+
+                    for tag, column in field_columns:
+                        value = column[idx]
+                        if value is not None:
+                            if isinstance(value, datetime):
+                                value = value.isoformat()
+                            elif not isinstance(value, str):
+                                value = str(value)
+                            value = escape(xml_invalid_chars.sub("", value))
+                            chunk.append("<%s>%s</%s>" % (tag, value, tag))
+                        else:
+                            chunk.append('<%s xsi:nil="true"/>' % tag)
+
+                    chunk.append("</%s>" % layer.keyname)
+                    chunk.append(member_close)
+
+                yield "".join(chunk).encode("utf-8")
+
+            yield tail.encode("utf-8")
+
     def _transaction(self):
         _ns_wfs = nsmap("wfs", self.p_version)["ns"]
         _ns_ogc = nsmap("ogc", self.p_version)["ns"]
@@ -1249,14 +1550,12 @@ class WFSHandler:
                         summary["totalInserted"] += 1
                 else:
                     _filter = find_tags(_operation, "Filter")[0]
-                    result = self._parse_filter(_filter, layer)
-                    if result["intersects"] is not None or len(result["filter"]) != 0:
+                    expr = self._parse_filter(_filter, layer)
+                    if expr[:2] != ("in", "id"):
                         raise ValidationError(
                             "Only feature ID filter is supported in transaction."
                         )
-                    fids = result["fids"]
-                    if len(fids) == 0:
-                        raise ValidationError("Feature ID filter must be specified.")
+                    fids = expr[2]
 
                     if operation == "Update":
                         if len(fids) != 1:
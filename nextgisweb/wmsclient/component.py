@@ -1,7 +1,10 @@
+import os
 from datetime import timedelta
 
 from nextgisweb.env import Component
 from nextgisweb.lib.config import Option
+from nextgisweb.lib.httpcache import HTTPCache
+from nextgisweb.lib.httpsession import SessionPool
 
 from .model import WMS_VERSIONS
 
@@ -11,6 +14,23 @@ class WMSClientComponent(Component):
         super().initialize()
 
         self.headers = {"User-Agent": self.options["user_agent"]}
+        self.sessions = SessionPool(
+            headers=self.headers,
+            pool_size=self.options["session.pool_size"],
+            retries=self.options["session.retries"],
+        )
+
+        self.upstream_cache = None
+        if (
+            self.options["upstream_cache.enabled"]
+            and (path := self.env.core.gtsdir(self)) is not None
+        ):
+            os.makedirs(path, exist_ok=True)
+            self.upstream_cache = HTTPCache(
+                os.path.join(path, "upstream_cache.sqlite"),
+                max_size=self.options["upstream_cache.size"],
+                ttl=self.options["upstream_cache.ttl"],
+            )
 
     def setup_pyramid(self, config):
         from . import view
@@ -24,5 +44,10 @@ class WMSClientComponent(Component):
     option_annotations = (
         Option("user_agent", default="NextGIS Web"),
         Option("timeout", timedelta, default=timedelta(seconds=15), doc="WMS request timeout."),
+        Option("session.pool_size", int, default=10, doc="Maximum number of keep-alive connections per upstream host."),
+        Option("session.retries", int, default=2, doc="Number of retries of failed upstream requests."),
+        Option("upstream_cache.enabled", bool, default=False, doc="Cache upstream responses on disk."),
+        Option("upstream_cache.size", int, default=2**30, doc="Upstream cache size limit in bytes."),
+        Option("upstream_cache.ttl", timedelta, default=timedelta(days=1), doc="Default lifetime of cached upstream responses."),
     )
     # fmt: on
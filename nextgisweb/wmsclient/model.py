@@ -6,7 +6,6 @@ from typing import Any, Dict, Literal, Union
 from urllib.parse import parse_qsl, quote, urlencode, urlparse, urlunparse
 
 import PIL
-import requests
 import sqlalchemy as sa
 import sqlalchemy.dialects.postgresql as sa_pg
 import sqlalchemy.orm as orm
@@ -17,6 +16,7 @@ from zope.interface import implementer
 
 from nextgisweb.env import Base, env, gettext
 from nextgisweb.lib import saext
+from nextgisweb.lib.httpcache import cache_key, cacheable_response
 
 from nextgisweb.core.exception import ExternalServiceError, ValidationError
 from nextgisweb.jsrealm import TSExport
@@ -72,7 +72,7 @@ class Connection(Base, Resource):
             and self.capcache_tstamp is not None
         )
 
-    def request_wms(self, request, query=None):
+    def request_wms(self, request, query=None, *, cache=None):
         up = urlparse(self.url, allow_fragments=False)
 
         query_main = dict(parse_qsl(up.query))
@@ -92,16 +92,33 @@ class Connection(Base, Resource):
         else:
             auth = None
 
+        headers = None
+        if cache is not None:
+            key = cache_key(url, username=self.username, password=self.password)
+            entry = cache.get(key)
+            if entry is not None:
+                if entry.fresh:
+                    return entry
+                headers = entry.validators()
+
         try:
-            return requests.get(
+            response = env.wmsclient.sessions.session(self.id).get(
                 url,
                 auth=auth,
-                headers=env.wmsclient.headers,
+                headers=headers,
                 timeout=env.wmsclient.options["timeout"].total_seconds(),
             )
         except RequestException:
             raise ExternalServiceError
 
+        if cache is not None:
+            if response.status_code == 304 and entry is not None:
+                return cache.revalidate(key, entry, response.headers)
+            elif cacheable_response(response.status_code, response.headers):
+                return cache.put(key, response.status_code, response.content, response.headers)
+
+        return response
+
     def capcache_query(self):
         self.capcache_tstamp = datetime.utcnow()
 
@@ -258,7 +275,7 @@ class Layer(Base, Resource, SpatialLayerMixin):
 
         srs_param = "crs" if self.connection.version == "1.3.0" else "srs"
         query[srs_param] = "EPSG:%d" % self.srs.id
-        response = self.connection.request_wms("GetMap", query)
+        response = self.connection.request_wms("GetMap", query, cache=env.wmsclient.upstream_cache)
 
         if response.status_code == 200:
             data = BytesIO(response.content)
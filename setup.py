@@ -32,7 +32,7 @@ requires = [
     "msgspec==0.17.0",
     "numpy",
     "networkx",
-    "orjson==3.9.9",
+    "orjson==3.9.15",
     "OWSLib==0.29.2",
     "passlib==1.7.4",
     "pillow==10.2.0",